@@ -12,15 +12,51 @@ Purpose
   5) Always checks MongoDB inventory and reports status clearly.
   6) Strict output order: Recipe → Ingredients → Steps → Inventory.
   7) No emojis, no manual fallback recipes.
+  8) "How many X can we make" / "what's about to 86" come straight from stock:
+     max producible portions for the whole menu (ASSISTANT_LOW_PORTIONS sets "about to").
+  9) "What's the food cost / margin of X" comes from the precomputed itemcosts table
+     (npm run costs:rebuild; refreshed by purchases).
+ 10) "Which dishes use X" / "what breaks if we run out of X" come from an in-memory
+     ingredient -> dish index over the items collection.
+ 11) "What do I need to order for the weekend" / "how long will the flour last" come from
+     forecast.py: usage history forecast once per service day, joined with current stock
+     (ASSISTANT_LEAD_DAYS, ASSISTANT_SAFETY_Z and ASSISTANT_FORECAST_* tune it).
+
+Usage
+-----
+  python assistant.py "<question>"   one-shot: answer a single question and exit
+  python assistant.py --serve        long-lived: JSON-lines over stdin/stdout
+                                     request  {"id": ..., "text": "..."}
+                                     response {"id": ..., "reply": "..."} or {"id": ..., "error": "..."}
+                                     request  {"id": ..., "cmd": "stats"} returns cache, coalescing and parse counters
+                                     request  {"id": ..., "cmd": "health"} returns MongoDB circuit state
+                                     request  {"id": ..., "cmd": "metrics"} returns {"id": ..., "metrics": "..."},
+                                              per-stage timings and counters as Prometheus text
+                                     request  {"id": ..., "cmd": "batch", "texts": [...]} streams
+                                              {"id": ..., "index": i, "reply": "..."} per question,
+                                              then {"id": ..., "done": true}
+                                     request  {"id": ..., "cmd": "stream", "text": "..."} streams
+                                              {"id": ..., "chunk": "..."} pieces, then {"id": ..., "done": true}
+  python assistant.py --stream "<q>" print the answer piece by piece as it is generated
+  python assistant.py --batch [file] answer one question per line of file (or stdin); prints
+                                     {"index": i, "query": "...", "reply": "..."} lines as they complete
+
+  ASSISTANT_TRACE=1 writes one JSON line per question (stderr, or ASSISTANT_TRACE_PATH) with its
+  timed spans: connect, inventory, forecast, lookup, search, llm, parse, save, plus cache hits/misses.
 
 Dependencies
 -----------
-  pip install google-generativeai duckduckgo_search pymongo python-dotenv
+  pip install google-generativeai duckduckgo_search pymongo python-dotenv numpy
 """
 
-import os, re, sys, json, traceback
-from typing import Dict, List, Any, Optional, Tuple
-from pymongo import MongoClient
+import os, re, sys, copy, json, time, bisect, atexit, asyncio, functools, tempfile, threading, traceback, contextvars
+_import_started = time.perf_counter()
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Any, NamedTuple, Optional, Tuple
+from pymongo import MongoClient, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError
 from bson import ObjectId
 
 # Load environment
@@ -32,19 +68,16 @@ try:
 except Exception:
     pass
 
-# DuckDuckGo
-try:
-    import importlib
-    _ddg = importlib.import_module('duckduckgo_search')
-    DDGS = getattr(_ddg, 'DDGS', None)
-except Exception:
-    DDGS = None
-
-# Gemini
-try:
-    import google.generativeai as genai
-except Exception:
-    genai = None
+# DuckDuckGo and Gemini SDKs are imported on first use (load_ddgs / load_genai), so
+# inventory, availability and database-hit questions never pay for them. NumPy and
+# forecast.py likewise (load_numpy / load_forecast): only fuzzy dish search, portion counts
+# and forecasts use them.
+DDGS = None
+genai = None
+np = None
+forecast = None
+_ddg_loaded = False
+_genai_loaded = False
 
 # Config
 MONGO_URI = os.environ.get("MONGO_URI")
@@ -53,6 +86,40 @@ GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
 DEBUG = os.environ.get("ASSISTANT_DEBUG", "0") == "1"
 AUTO_ADD_INGREDIENTS = os.environ.get("ASSISTANT_AUTO_ADD_INGREDIENTS", "0") == "1"
 AUTO_SAVE_ITEMS = os.environ.get("ASSISTANT_AUTO_SAVE_ITEMS", "0") == "1"
+MONGO_TIMEOUT_MS = int(os.environ.get("ASSISTANT_MONGO_TIMEOUT_MS", "8000"))
+MONGO_MAX_POOL = int(os.environ.get("ASSISTANT_MONGO_MAX_POOL", "20"))
+MONGO_MIN_POOL = int(os.environ.get("ASSISTANT_MONGO_MIN_POOL", "0"))
+MONGO_COOLDOWN = float(os.environ.get("ASSISTANT_MONGO_COOLDOWN", "30"))
+SERVER_WORKERS = int(os.environ.get("ASSISTANT_WORKERS", "8"))
+BATCH_WORKERS = int(os.environ.get("ASSISTANT_BATCH_WORKERS", "4"))
+# Async synthesis pipeline: concurrent DDG queries, speculative snippet-free Gemini call, deadlines
+ASYNC_PIPELINE = os.environ.get("ASSISTANT_ASYNC_PIPELINE", "1") == "1"
+SPECULATIVE_LLM = os.environ.get("ASSISTANT_SPECULATIVE_LLM", "1") == "1"
+DDG_TIMEOUT = float(os.environ.get("ASSISTANT_DDG_TIMEOUT", "6"))
+LLM_TIMEOUT = float(os.environ.get("ASSISTANT_LLM_TIMEOUT", "25"))
+TOTAL_BUDGET = float(os.environ.get("ASSISTANT_TOTAL_BUDGET", "40"))
+JSON_MODE = os.environ.get("ASSISTANT_JSON_MODE", "1") == "1"
+UPSTREAM_WORKERS = int(os.environ.get("ASSISTANT_UPSTREAM_WORKERS", "16"))
+ITEM_INDEX_REFRESH = float(os.environ.get("ASSISTANT_ITEM_INDEX_REFRESH", "5"))
+FUZZY_THRESHOLD = float(os.environ.get("ASSISTANT_FUZZY_THRESHOLD", "0.75"))
+LOW_PORTIONS = int(os.environ.get("ASSISTANT_LOW_PORTIONS", "5"))
+INVENTORY_MAX_STALENESS = float(os.environ.get("ASSISTANT_INVENTORY_MAX_STALENESS", "2"))
+INVENTORY_RESYNC = float(os.environ.get("ASSISTANT_INVENTORY_RESYNC", "300"))
+CACHE_PATH = os.environ.get("ASSISTANT_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".assistant_cache.json"))
+CACHE_SIZE = int(os.environ.get("ASSISTANT_CACHE_SIZE", "512"))
+CACHE_FLUSH_DELAY = float(os.environ.get("ASSISTANT_CACHE_FLUSH_DELAY", "5"))
+RECIPE_TTL = float(os.environ.get("ASSISTANT_RECIPE_TTL", str(7 * 24 * 3600)))
+SNIPPET_TTL = float(os.environ.get("ASSISTANT_SNIPPET_TTL", str(24 * 3600)))
+METRICS = os.environ.get("ASSISTANT_METRICS", "1") == "1"
+TRACE = os.environ.get("ASSISTANT_TRACE", "0") == "1"
+TRACE_PATH = os.environ.get("ASSISTANT_TRACE_PATH") or None
+FORECAST_HISTORY = int(os.environ.get("ASSISTANT_FORECAST_HISTORY", "56"))
+FORECAST_METHOD = os.environ.get("ASSISTANT_FORECAST_METHOD", "ewma")
+FORECAST_ALPHA = float(os.environ.get("ASSISTANT_FORECAST_ALPHA", "0.3"))
+FORECAST_WINDOW = int(os.environ.get("ASSISTANT_FORECAST_WINDOW", "7"))
+LEAD_DAYS = float(os.environ.get("ASSISTANT_LEAD_DAYS", "1"))
+SAFETY_Z = float(os.environ.get("ASSISTANT_SAFETY_Z", "1.65"))
+ORDER_DAYS = int(os.environ.get("ASSISTANT_ORDER_DAYS", "3"))
 
 RESTAURANT_KEYWORDS = [
     "dish", "recipe", "ingredients", "prepare", "cook", "bake", "fry", "grill", "boil",
@@ -68,109 +135,904 @@ CATEGORY_GUESS = [
     (r"juice|drink|beverage", "drink"),
     (r"cake|dessert|pancake", "dessert"),
 ]
+# Same enum as models/Item.js
+ITEM_CATEGORIES = ["plate", "sandwich", "drink", "burger", "pizza", "dessert", "beverage", "fries",
+                   "spirits", "pancakes", "cake", "juice"]
+
+INVENTORY_PHRASES = ["how much", "how many", "buckets", "quantity", "stock", "inventory"]
+# Stock items looked for when an inventory question names nothing the patterns can extract
+INVENTORY_STAPLES = ["water", "oil", "flour", "sugar", "salt", "coffee", "tea", "milk", "eggs"]
+
+# ---------------- Tracing ----------------
+
+# Seconds; the "le" bounds of the per-stage latency histograms
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class RequestTrace:
+    """Spans and cache lookups recorded while answering one question (ASSISTANT_TRACE=1)."""
+
+    def __init__(self, trace_id: int, query: str):
+        self.id = trace_id
+        self.query = query
+        self.started = time.perf_counter()
+        self.route: Optional[str] = None
+        self.spans: List[Dict[str, Any]] = []
+        self.cache: Dict[str, Dict[str, int]] = {}
+        # Spans also arrive from UPSTREAM_POOL threads (DDG and Gemini calls)
+        self.lock = threading.Lock()
+
+    def add_span(self, stage: str, started: float, seconds: float, error: bool) -> None:
+        span = {"stage": stage, "startMs": round((started - self.started) * 1000, 2), "ms": round(seconds * 1000, 2)}
+        if error:
+            span["error"] = True
+        with self.lock:
+            self.spans.append(span)
+
+    def add_cache(self, kind: str, hit: bool) -> None:
+        with self.lock:
+            counts = self.cache.setdefault(kind, {"hits": 0, "misses": 0})
+            counts["hits" if hit else "misses"] += 1
+
+_current_trace: "contextvars.ContextVar[Optional[RequestTrace]]" = contextvars.ContextVar("assistant_trace", default=None)
+
+class _NullSpan:
+    """Shared no-op span / request handed out while metrics are off."""
+    route = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ("metrics", "stage", "started")
+
+    def __init__(self, metrics: "StageMetrics", stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # A stream abandoned by its consumer closes with GeneratorExit; that is not a failure
+        error = exc_type is not None and not issubclass(exc_type, GeneratorExit)
+        self.metrics.observe(self.stage, time.perf_counter() - self.started, error, self.started)
+        return False
+
+class _RequestSpan:
+    """One answered question: times the whole answer as the "request" stage, counts it under
+    route, and with tracing on collects its spans and writes them out as one JSON line."""
+
+    def __init__(self, metrics: "StageMetrics", query: str):
+        self.metrics = metrics
+        self.query = query
+        self.route: Optional[str] = None
+        self.trace: Optional[RequestTrace] = None
+        self.token = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        if self.metrics.trace:
+            self.trace = RequestTrace(self.metrics.next_trace_id(), self.query)
+            self.token = _current_trace.set(self.trace)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.started
+        route = "error" if exc_type is not None else (self.route or "unknown")
+        self.metrics.observe("request", seconds, exc_type is not None)
+        self.metrics.count_route(route)
+        if self.trace is not None:
+            _current_trace.reset(self.token)
+            self.trace.route = route
+            self.metrics.write_trace(self.trace, seconds)
+        return False
+
+class StageMetrics:
+    """Per-stage latency histograms (connect, inventory, lookup, search, llm, parse, save and
+    the whole request), answers per route and cache hit/miss counters, rendered as Prometheus
+    text by the "metrics" serve command. ASSISTANT_METRICS=0 turns every span into a shared
+    no-op; ASSISTANT_TRACE=1 also writes one JSON line per question (to ASSISTANT_TRACE_PATH,
+    else stderr) with its spans in start order."""
+
+    def __init__(self, enabled: bool, trace: bool, trace_path: Optional[str]):
+        self.enabled = enabled or trace
+        self.trace = trace
+        self.trace_path = trace_path
+        self.lock = threading.Lock()
+        self.buckets: Dict[str, List[int]] = {}
+        self.sums: Dict[str, float] = {}
+        self.errors: Dict[str, int] = {}
+        self.routes: Dict[str, int] = {}
+        self.cache_counts: Dict[str, List[int]] = {}
+        self.trace_ids = 0
+        self.write_lock = threading.Lock()
+        self.cold = True
+        self.import_seconds = 0.0
+        self.started = time.time()
+
+    def span(self, stage: str):
+        return _Span(self, stage) if self.enabled else _NULL_SPAN
+
+    def request(self, query: str):
+        return _RequestSpan(self, query) if self.enabled else _NULL_SPAN
+
+    def observe(self, stage: str, seconds: float, error: bool = False, started: Optional[float] = None) -> None:
+        if not self.enabled:
+            return
+        i = bisect.bisect_left(STAGE_BUCKETS, seconds)
+        with self.lock:
+            counts = self.buckets.get(stage)
+            if counts is None:
+                counts = self.buckets[stage] = [0] * (len(STAGE_BUCKETS) + 1)
+                self.sums[stage] = 0.0
+            counts[i] += 1
+            self.sums[stage] += seconds
+            if error:
+                self.errors[stage] = self.errors.get(stage, 0) + 1
+        if self.trace and stage != "request":
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.add_span(stage, started if started is not None else time.perf_counter() - seconds, seconds, error)
+
+    def cache(self, kind: str, hit: bool) -> None:
+        if not self.enabled:
+            return
+        with self.lock:
+            counts = self.cache_counts.setdefault(kind, [0, 0])
+            counts[0 if hit else 1] += 1
+        if self.trace:
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.add_cache(kind, hit)
+
+    def count_route(self, route: str) -> None:
+        with self.lock:
+            self.routes[route] = self.routes.get(route, 0) + 1
+
+    def next_trace_id(self) -> int:
+        with self.lock:
+            self.trace_ids += 1
+            return self.trace_ids
+
+    def write_trace(self, trace: RequestTrace, seconds: float) -> None:
+        record = {"trace": trace.id, "pid": os.getpid(), "ts": datetime.now(timezone.utc).isoformat(),
+                  "query": trace.query[:200], "route": trace.route, "ms": round(seconds * 1000, 2),
+                  "spans": sorted(trace.spans, key=lambda s: s["startMs"]), "cache": trace.cache}
+        with self.write_lock:
+            if self.cold:
+                # First question of the process: how long `import assistant` took
+                record["importMs"] = round(self.import_seconds * 1000, 2)
+                self.cold = False
+            line = json.dumps(record, ensure_ascii=False, default=str)
+            try:
+                if self.trace_path:
+                    with open(self.trace_path, "a", encoding="utf-8") as f:
+                        f.write(line + "\n")
+                else:
+                    sys.stderr.write(line + "\n")
+                    sys.stderr.flush()
+            except Exception as e:
+                log("Trace write failed:", e)
+
+    def prometheus(self) -> List[str]:
+        with self.lock:
+            buckets = {k: list(v) for k, v in self.buckets.items()}
+            sums, errors, routes = dict(self.sums), dict(self.errors), dict(self.routes)
+            cache_counts = {k: list(v) for k, v in self.cache_counts.items()}
+        lines = ["# HELP assistant_stage_seconds Time spent per pipeline stage.",
+                 "# TYPE assistant_stage_seconds histogram"]
+        for stage in sorted(buckets):
+            total = 0
+            for le, n in zip(STAGE_BUCKETS, buckets[stage]):
+                total += n
+                lines.append(f'assistant_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {total}')
+            total += buckets[stage][-1]
+            lines.append(f'assistant_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {total}')
+            lines.append(f'assistant_stage_seconds_sum{{stage="{stage}"}} {sums[stage]:.6f}')
+            lines.append(f'assistant_stage_seconds_count{{stage="{stage}"}} {total}')
+        lines += prometheus_family("assistant_stage_errors_total", "counter", "Stage calls that raised.",
+                                   {f'stage="{k}"': v for k, v in sorted(errors.items())})
+        lines += prometheus_family("assistant_requests_total", "counter", "Questions answered, by route.",
+                                   {f'route="{k}"': v for k, v in sorted(routes.items())})
+        lines += prometheus_family("assistant_cache_hits_total", "counter", "Cache lookups served from the cache.",
+                                   {f'cache="{k}"': v[0] for k, v in sorted(cache_counts.items())})
+        lines += prometheus_family("assistant_cache_misses_total", "counter", "Cache lookups that missed.",
+                                   {f'cache="{k}"': v[1] for k, v in sorted(cache_counts.items())})
+        lines += prometheus_family("assistant_import_seconds", "gauge", "Time taken by `import assistant`.",
+                                   {"": round(self.import_seconds, 6)})
+        lines += prometheus_family("assistant_uptime_seconds", "gauge", "Seconds since the process started.",
+                                   {"": round(time.time() - self.started, 3)})
+        return lines
+
+def prometheus_family(name: str, kind: str, help_text: str, samples: Dict[str, Any]) -> List[str]:
+    """Prometheus text lines for one metric; samples maps a label string ('' for none) to its value."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples.items():
+        lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    return lines
+
+stage_metrics = StageMetrics(METRICS, TRACE, TRACE_PATH)
+
+def timed(stage: str):
+    """Decorator recording each call of the function as a span of the given stage."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if not stage_metrics.enabled:
+                return fn(*args, **kwargs)
+            with _Span(stage_metrics, stage):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+# ---------------- Fuzzy dish matching ----------------
+
+# Filler words stripped from free-text queries before matching ("a big cheeseburger please")
+FUZZY_STOPWORDS = {
+    "a", "an", "the", "some", "please", "me", "i", "we", "want", "would", "like", "can", "could",
+    "you", "give", "get", "for", "of", "to", "how", "make", "recipe", "ingredients", "order",
+}
+
+def dish_trigrams(text: str, strip_stopwords: bool = False) -> set:
+    """Word-padded character trigrams of a dish name or query."""
+    tokens = re.findall(r"[a-z0-9]+", (text or "").lower())
+    if strip_stopwords:
+        tokens = [t for t in tokens if t not in FUZZY_STOPWORDS] or tokens
+    grams = set()
+    for t in tokens:
+        padded = f" {t} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class FuzzyDishMatcher:
+    """Trigram inverted index over dish names with top-k similarity search.
+
+    score = (containment + dice) / 2, where containment is the share of the candidate's
+    trigrams present in the query (tolerates extra words around the dish) and dice is the
+    symmetric overlap (prefers the most specific candidate among several contained ones).
+    Postings hold dense slot numbers; overlap counting is one np.bincount per query."""
+
+    def __init__(self):
+        self.postings: Dict[str, set] = {}
+        self.arrays: Dict[str, Any] = {}
+        self.slots: Dict[Any, int] = {}
+        self.item_ids: List[Any] = []
+        self.names: List[str] = []
+        self.sizes: List[int] = []
+        self.sizes_arr = None
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def add(self, item_id: Any, name: str) -> None:
+        slot = self.slots.get(item_id)
+        if slot is not None:
+            if self.names[slot] == name:
+                return
+            self.remove(item_id)
+        grams = dish_trigrams(name)
+        if not grams:
+            return
+        slot = len(self.item_ids)
+        self.slots[item_id] = slot
+        self.item_ids.append(item_id)
+        self.names.append(name)
+        self.sizes.append(len(grams))
+        self.sizes_arr = None
+        for g in grams:
+            self.postings.setdefault(g, set()).add(slot)
+            self.arrays.pop(g, None)
+
+    def remove(self, item_id: Any) -> None:
+        slot = self.slots.pop(item_id, None)
+        if slot is None:
+            return
+        for g in dish_trigrams(self.names[slot]):
+            ids = self.postings.get(g)
+            if ids is not None:
+                ids.discard(slot)
+                self.arrays.pop(g, None)
+                if not ids:
+                    del self.postings[g]
+        # Slots are not reused; a zero size marks them dead
+        self.sizes[slot] = 0
+        self.sizes_arr = None
+
+    def _posting_array(self, gram: str):
+        arr = self.arrays.get(gram)
+        if arr is None:
+            ids = self.postings[gram]
+            arr = self.arrays[gram] = np.fromiter(ids, dtype=np.int64, count=len(ids))
+        return arr
+
+    def search(self, query: str, k: int = 5, threshold: float = 0.0) -> List[Tuple[float, Any, str]]:
+        """Return up to k (score, item_id, name) tuples with score >= threshold, best first."""
+        load_numpy()
+        q = dish_trigrams(query, strip_stopwords=True)
+        arrays = [self._posting_array(g) for g in q if g in self.postings]
+        if not arrays:
+            return []
+        if self.sizes_arr is None:
+            self.sizes_arr = np.asarray(self.sizes, dtype=np.float64)
+        hits = np.bincount(np.concatenate(arrays), minlength=len(self.sizes))
+        cand = np.flatnonzero(hits)
+        h = hits[cand].astype(np.float64)
+        size = self.sizes_arr[cand]
+        score = (h / size + 2.0 * h / (len(q) + size)) / 2.0
+        keep = score >= threshold
+        cand, score = cand[keep], score[keep]
+        if len(cand) > k:
+            top = np.argpartition(-score, k - 1)[:k]
+            cand, score = cand[top], score[top]
+        order = np.argsort(-score, kind="stable")
+        return [(round(float(score[i]), 4), self.item_ids[cand[i]], self.names[cand[i]]) for i in order]
 
 # ---------------- DB utils ----------------
 
+class MongoHealth:
+    """Circuit breaker and health record for the shared MongoClient.
+
+    A failed connect opens the circuit: for the next cooldown seconds get_mongo_client()
+    fails immediately instead of waiting out server selection, and a single request is then
+    let through to probe again. Once a client exists its background monitor reports
+    reachability (MongoTopologyListener), so an outage opens the circuit and a recovery
+    closes it without any request paying the timeout."""
+
+    def __init__(self, cooldown: float):
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_failure: Optional[float] = None
+        self.last_success: Optional[float] = None
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """May a request try to connect now? Claims the probe when the cooldown is over."""
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if not self.probing and time.time() - self.opened_at >= self.cooldown:
+                self.state = "half-open"
+                self.probing = True
+                return True
+            return False
+
+    def is_open(self) -> bool:
+        return self.state != "closed"
+
+    def success(self) -> None:
+        with self.lock:
+            if self.state != "closed":
+                log("MongoDB reachable again")
+            self.state = "closed"
+            self.failures = 0
+            self.probing = False
+            self.last_success = time.time()
+
+    def failure(self, error: Any) -> None:
+        with self.lock:
+            if self.state == "closed":
+                log("MongoDB unreachable, skipping it for", self.cooldown, "s:", error)
+            self.state = "open"
+            self.failures += 1
+            self.last_error = str(error) or error.__class__.__name__
+            self.last_failure = self.opened_at = time.time()
+            self.probing = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            retry_in = max(0.0, self.cooldown - (time.time() - self.opened_at)) if self.state == "open" else 0.0
+            return {
+                "state": self.state,
+                "connected": _mongo_client is not None,
+                "failures": self.failures,
+                "lastError": self.last_error,
+                "lastFailure": self.last_failure,
+                "lastSuccess": self.last_success,
+                "retryInSeconds": round(retry_in, 1),
+                "pool": {"maxPoolSize": MONGO_MAX_POOL, "minPoolSize": MONGO_MIN_POOL,
+                         "serverSelectionTimeoutMS": MONGO_TIMEOUT_MS},
+            }
+
+mongo_health = MongoHealth(MONGO_COOLDOWN)
+
+class MongoTopologyListener(monitoring.TopologyListener):
+    """Feeds the driver's server monitoring into mongo_health."""
+
+    def opened(self, event) -> None:
+        pass
+
+    def closed(self, event) -> None:
+        pass
+
+    def description_changed(self, event) -> None:
+        was_up = event.previous_description.has_writable_server()
+        is_up = event.new_description.has_writable_server()
+        if is_up and (not was_up or mongo_health.is_open()):
+            mongo_health.success()
+        elif was_up and not is_up:
+            mongo_health.failure("no writable MongoDB server")
+
 def mongo() -> MongoClient:
     if not MONGO_URI:
         raise RuntimeError("MONGO_URI missing")
-    return MongoClient(MONGO_URI, serverSelectionTimeoutMS=8000)
+    return MongoClient(MONGO_URI,
+                       serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+                       connectTimeoutMS=min(MONGO_TIMEOUT_MS, 5000),
+                       maxPoolSize=MONGO_MAX_POOL,
+                       minPoolSize=MONGO_MIN_POOL,
+                       event_listeners=[MongoTopologyListener()])
+
+# Process-wide clients. In one-shot mode they are built once and die with the
+# process; in --serve mode they stay warm across every request.
+_clients_lock = threading.Lock()
+# Blocking DDG/Gemini calls made from the async pipeline run here. A call that overruns its
+# deadline is abandoned, not killed; the clients carry their own timeouts so it still ends,
+# and one-shot runs leave through exit_process() instead of joining these workers at exit.
+UPSTREAM_POOL = ThreadPoolExecutor(max_workers=max(1, UPSTREAM_WORKERS), thread_name_prefix="upstream")
+_mongo_client: Optional[MongoClient] = None
+_gemini_model = None
+_gemini_ready = False
+_ddgs_session = None
+
+def get_mongo_client() -> MongoClient:
+    """Return the shared, pooled MongoClient, connecting (and pinging) on first use.
+    Raises at once while mongo_health has the circuit open; a failed connect is not
+    cached, so the request that probes after the cooldown retries it."""
+    global _mongo_client
+    client = _mongo_client
+    if client is not None:
+        if mongo_health.is_open():
+            raise RuntimeError(f"MongoDB unavailable: {mongo_health.last_error}")
+        return client
+    if not mongo_health.allow():
+        raise RuntimeError(f"MongoDB unavailable: {mongo_health.last_error}")
+    with _clients_lock:
+        if _mongo_client is None:
+            client = None
+            try:
+                client = mongo()
+                client.admin.command('ping')
+            except Exception as e:
+                if client is not None:
+                    client.close()
+                mongo_health.failure(e)
+                raise
+            _mongo_client = client
+            mongo_health.success()
+    return _mongo_client
+
+def get_gemini_model():
+    """Return the shared Gemini model (or None when unavailable)."""
+    global _gemini_model, _gemini_ready
+    if _gemini_ready:
+        return _gemini_model
+    with _clients_lock:
+        if not _gemini_ready:
+            _gemini_model = init_gemini()
+            _gemini_ready = True
+    return _gemini_model
+
+def load_ddgs():
+    """duckduckgo_search.DDGS, imported on the first web search (None when not installed)."""
+    global DDGS, _ddg_loaded
+    if not _ddg_loaded:
+        try:
+            from duckduckgo_search import DDGS as ddgs_class
+        except Exception:
+            ddgs_class = None
+        DDGS, _ddg_loaded = ddgs_class, True
+    return DDGS
+
+def load_genai():
+    """The google.generativeai module, imported when a model is first needed (None when not installed)."""
+    global genai, _genai_loaded
+    if not _genai_loaded:
+        try:
+            import google.generativeai as module
+        except Exception:
+            module = None
+        genai, _genai_loaded = module, True
+    return genai
+
+def load_numpy():
+    """The numpy module, imported by the first fuzzy search, portion count or forecast."""
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+def load_forecast():
+    """backend/forecast.py (which needs numpy), imported by the first forecast question."""
+    global forecast
+    if forecast is None:
+        load_numpy()
+        import forecast as module
+        forecast = module
+    return forecast
+
+def get_ddgs_session():
+    """Return the shared DDGS session (or None when duckduckgo_search is missing)."""
+    global _ddgs_session
+    if _ddgs_session is not None or not load_ddgs():
+        return _ddgs_session
+    with _clients_lock:
+        if _ddgs_session is None:
+            try:
+                _ddgs_session = DDGS(timeout=max(1, round(DDG_TIMEOUT)))
+            except TypeError:
+                _ddgs_session = DDGS()
+    return _ddgs_session
+
+_indexes_ready = False
+
+def ensure_indexes(db) -> None:
+    """Create the lookup indexes the assistant relies on (once per process)."""
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    try:
+        db["items"].create_index("nameKey")
+        db["items"].create_index("updatedAt")
+        db["ingredients"].create_index("updatedAt")
+    except Exception as e:
+        log("Index creation failed:", e)
+    try:
+        # Same spec as the Mongoose model; fails (and is logged) while case-variant duplicates exist
+        db["ingredients"].create_index(
+            "nameKey", unique=True, partialFilterExpression={"nameKey": {"$type": "string"}})
+    except Exception as e:
+        log("Ingredient nameKey index creation failed (run `npm run backfill:name-keys`):", e)
+    _indexes_ready = True
 
 def get_collections(client: MongoClient):
     db = client[MONGO_DB]
+    ensure_indexes(db)
     return db["ingredients"], db["items"]
 
+INVENTORY_FIELDS = {"name": 1, "unit": 1, "currentStock": 1, "quantity": 1, "isManuallyOutOfStock": 1, "updatedAt": 1}
+
+@timed("inventory")
 def fetch_inventory_map(ingredients_col) -> Dict[str, Dict[str, Any]]:
     inv = {}
-    if ingredients_col:
-        for doc in ingredients_col.find({}):
+    if ingredients_col is not None:
+        for doc in ingredients_col.find({}, INVENTORY_FIELDS):
             name = (doc.get("name") or "").strip().lower()
             if name:
                 inv[name] = doc
     return inv
 
+class InventorySnapshot:
+    """Lazily built, projected name -> ingredient map kept fresh by polling updatedAt.
+
+    A caller never sees data older than max_staleness seconds: past that, the next get()
+    pulls only ingredients modified since the newest updatedAt seen. Deletions are invisible
+    to that poll, so a full reload also happens every resync_interval seconds or whenever the
+    collection count drifts from the snapshot. Updates swap in a new dict, so readers can
+    iterate the map they got without locking."""
+
+    def __init__(self, max_staleness: float, resync_interval: float):
+        self.max_staleness = max_staleness
+        self.resync_interval = resync_interval
+        self.by_name: Dict[str, Dict[str, Any]] = {}
+        self.names_by_id: Dict[Any, str] = {}
+        self.last_updated = None
+        self.last_refresh = 0.0
+        self.last_resync = 0.0
+        self.built = False
+        self.lock = threading.Lock()
+
+    def _reload(self, ingredients_col, now: float) -> None:
+        by_name, names_by_id, newest = {}, {}, None
+        for doc in ingredients_col.find({}, INVENTORY_FIELDS):
+            name = (doc.get("name") or "").strip().lower()
+            # Every document is tracked by id so the count check below stays exact
+            names_by_id[doc["_id"]] = name
+            if name:
+                by_name[name] = doc
+            ts = doc.get("updatedAt")
+            if ts is not None and (newest is None or ts > newest):
+                newest = ts
+        self.by_name, self.names_by_id, self.last_updated = by_name, names_by_id, newest
+        self.built = True
+        self.last_resync = now
+
+    def _apply_changes(self, ingredients_col) -> None:
+        query = {"updatedAt": {"$gte": self.last_updated}} if self.last_updated is not None else {}
+        changed = list(ingredients_col.find(query, INVENTORY_FIELDS))
+        if not changed:
+            return
+        by_name, names_by_id = dict(self.by_name), dict(self.names_by_id)
+        for doc in changed:
+            old = names_by_id.get(doc["_id"])
+            if old and by_name.get(old, {}).get("_id") == doc["_id"]:
+                del by_name[old]
+            name = (doc.get("name") or "").strip().lower()
+            names_by_id[doc["_id"]] = name
+            if name:
+                by_name[name] = doc
+            ts = doc.get("updatedAt")
+            if ts is not None and (self.last_updated is None or ts > self.last_updated):
+                self.last_updated = ts
+        self.by_name, self.names_by_id = by_name, names_by_id
+
+    def get(self, ingredients_col) -> Dict[str, Dict[str, Any]]:
+        if ingredients_col is None:
+            return {}
+        now = time.time()
+        if self.built and now - self.last_refresh <= self.max_staleness:
+            stage_metrics.cache("inventory", True)
+            return self.by_name
+        with self.lock:
+            if self.built and now - self.last_refresh <= self.max_staleness:
+                stage_metrics.cache("inventory", True)
+                return self.by_name
+            stage_metrics.cache("inventory", False)
+            try:
+                with stage_metrics.span("inventory"):
+                    if not self.built or now - self.last_resync > self.resync_interval:
+                        self._reload(ingredients_col, now)
+                    else:
+                        self._apply_changes(ingredients_col)
+                        if ingredients_col.estimated_document_count() != len(self.names_by_id):
+                            self._reload(ingredients_col, now)
+                self.last_refresh = now
+            except Exception as e:
+                log("Inventory refresh failed:", e)
+            return self.by_name
+
+inventory_snapshot = InventorySnapshot(INVENTORY_MAX_STALENESS, INVENTORY_RESYNC)
+
+class ItemNameIndex:
+    """In-process nameKey -> _id map plus fuzzy trigram index over the items collection.
+
+    Built with one projected scan on first use, then kept fresh by pulling only items whose
+    updatedAt moved past the last one seen. Deletes and renames are caught on lookup, when the
+    mapped document is missing or no longer carries the key. The exact-key map is consulted
+    first only in --serve mode (enabled); a one-shot process goes straight to a single indexed
+    query and only builds the index when it needs the fuzzy fallback."""
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self.enabled = False
+        self.ids: Dict[str, Any] = {}
+        self.fuzzy = FuzzyDishMatcher()
+        self.last_updated = None
+        self.last_refresh = 0.0
+        self.built = False
+        self.lock = threading.Lock()
+
+    def _scan(self, items_col, query: Dict[str, Any]) -> None:
+        missing_keys = []
+        for doc in items_col.find(query, {"name": 1, "nameKey": 1, "updatedAt": 1}):
+            key = doc.get("nameKey")
+            if not key:
+                key = normalize_title_for_match(doc.get("name", ""))
+                missing_keys.append((doc["_id"], key))
+            if key:
+                self.ids[key] = doc["_id"]
+            self.fuzzy.add(doc["_id"], doc.get("name", ""))
+            ts = doc.get("updatedAt")
+            if ts is not None and (self.last_updated is None or ts > self.last_updated):
+                self.last_updated = ts
+        # Backfill legacy documents so the indexed query path finds them too
+        for _id, key in missing_keys:
+            try:
+                items_col.update_one({"_id": _id}, {"$set": {"nameKey": key}})
+            except Exception as e:
+                log("nameKey backfill failed:", e)
+
+    def refresh(self, items_col) -> None:
+        now = time.time()
+        if self.built and now - self.last_refresh < self.refresh_interval:
+            return
+        with self.lock:
+            if self.built and now - self.last_refresh < self.refresh_interval:
+                return
+            if not self.built:
+                self._scan(items_col, {})
+                self.built = True
+            elif self.last_updated is not None:
+                self._scan(items_col, {"updatedAt": {"$gte": self.last_updated}})
+            self.last_refresh = now
+
+    def add(self, key: str, _id: Any, name: str = "") -> None:
+        if key:
+            with self.lock:
+                self.ids[key] = _id
+                if name:
+                    self.fuzzy.add(_id, name)
+
+    def discard(self, key: str) -> None:
+        with self.lock:
+            _id = self.ids.pop(key, None)
+            if _id is not None:
+                self.fuzzy.remove(_id)
+
+    def discard_id(self, _id: Any) -> None:
+        with self.lock:
+            self.fuzzy.remove(_id)
+            for key in [k for k, v in self.ids.items() if v == _id]:
+                del self.ids[key]
+
+    def search(self, items_col, query: str, k: int = 5, threshold: float = 0.0) -> List[Tuple[float, Any, str]]:
+        self.refresh(items_col)
+        with self.lock:
+            return self.fuzzy.search(query, k, threshold)
+
+    def lookup(self, items_col, key: str) -> Optional[Any]:
+        self.refresh(items_col)
+        return self.ids.get(key)
+
+item_index = ItemNameIndex(ITEM_INDEX_REFRESH)
+
+def find_item_by_key(items_col, key: str, name: str = "") -> Optional[Dict[str, Any]]:
+    """Single indexed query on nameKey, with an anchored-regex fallback restricted to legacy
+    documents that have no nameKey yet."""
+    doc = items_col.find_one({"nameKey": key})
+    if doc or not name:
+        return doc
+    return items_col.find_one({
+        "nameKey": None,
+        "name": {"$regex": f"^\\s*{re.escape(name.strip())}\\s*$", "$options": "i"},
+    })
+
+@timed("lookup")
 def find_item_in_database(items_col, dish: str) -> Optional[Dict[str, Any]]:
-    """Find item in MongoDB items collection by name (case-insensitive)"""
+    """Find item in MongoDB items collection by normalized name"""
     if items_col is None:
         return None
     if not dish:
         return None
-    
-    # Try exact match first
-    doc = items_col.find_one({
-        "name": {"$regex": f"^\\s*{re.escape(dish)}\\s*$", "$options": "i"}
-    })
+
+    key = normalize_title_for_match(dish)
+    if not key:
+        return None
+
+    if item_index.enabled:
+        _id = item_index.lookup(items_col, key)
+        if _id is not None:
+            doc = items_col.find_one({"_id": _id})
+            if doc and (doc.get("nameKey") or normalize_title_for_match(doc.get("name", ""))) == key:
+                return doc
+            # Deleted or renamed since the index last saw it
+            item_index.discard(key)
+
+    doc = find_item_by_key(items_col, key, dish)
     if doc:
+        if item_index.enabled:
+            item_index.add(key, doc["_id"], doc.get("name", ""))
         return doc
-    
-    # Try fuzzy match
-    dish_normalized = normalize_title_for_match(dish)
-    for doc in items_col.find({}):
-        name = doc.get("name", "")
-        if normalize_title_for_match(name) == dish_normalized:
-            return doc
-    
+
+    # Near-miss ("a big cheeseburger please", typos): resolve locally before the web/LLM path
+    if FUZZY_THRESHOLD > 0:
+        for score, _id, name in item_index.search(items_col, dish, k=3, threshold=FUZZY_THRESHOLD):
+            doc = items_col.find_one({"_id": _id})
+            if doc:
+                log(f"Fuzzy match for '{dish}': {name} ({score})")
+                return doc
+            item_index.discard_id(_id)
     return None
 
+INGREDIENT_UNITS = {"g", "kg", "l", "ml", "piece", "unit"}
+
+def normalize_ingredient_unit(unit: Any) -> str:
+    """Map recipe units onto the Ingredient schema enum (scoops, tsp, tbsp, ... -> unit)."""
+    unit = str(unit or "unit").strip().lower()
+    return unit if unit in INGREDIENT_UNITS else "unit"
+
 def resolve_ingredient_object_id(ingredients_col, name: str) -> Optional[ObjectId]:
     if not name:
         return None
-    if ingredients_col is None:
-        return None
-    n = name.strip().lower()
-    doc = ingredients_col.find_one({"name": {"$regex": f"^\\s*{re.escape(n)}\\s*$", "$options": "i"}})
-    return doc.get("_id") if doc else None
-
-def add_ingredients_to_inventory(ingredients_col, recipe_ingredients: List[Dict[str, Any]]) -> None:
-    """Add recipe ingredients to MongoDB ingredients collection"""
+    return resolve_ingredient_ids(ingredients_col, [{"name": name}]).get(normalize_title_for_match(name))
+
+def resolve_ingredient_ids(ingredients_col, recipe_ingredients: List[Dict[str, Any]],
+                           create_missing: bool = False) -> Dict[str, ObjectId]:
+    """Resolve all recipe ingredients to ingredient _ids in bulk. Returns {nameKey: _id}.
+    One $in query on nameKey finds the existing ones; with create_missing, the rest are upserted
+    in a single unordered bulk_write keyed on nameKey, so concurrent saves cannot insert the same
+    ingredient twice. Unkeyed legacy documents fall back to one anchored-regex query."""
+    if ingredients_col is None or not recipe_ingredients:
+        return {}
+    wanted: Dict[str, Dict[str, Any]] = {}
+    for ing in recipe_ingredients:
+        name = str(ing.get("name", "")).strip()
+        key = normalize_title_for_match(name)
+        if key and key not in wanted:
+            wanted[key] = {"name": name, "unit": normalize_ingredient_unit(ing.get("unit"))}
+    if not wanted:
+        return {}
+
+    resolved: Dict[str, ObjectId] = {}
+    for doc in ingredients_col.find({"nameKey": {"$in": list(wanted)}}, {"nameKey": 1}):
+        resolved[doc["nameKey"]] = doc["_id"]
+
+    missing = [k for k in wanted if k not in resolved]
+    if missing:
+        # Legacy documents without nameKey: one case-insensitive query, then key them
+        pattern = "|".join(re.escape(wanted[k]["name"].lower()) for k in missing)
+        legacy = ingredients_col.find(
+            {"nameKey": None, "name": {"$regex": f"^\\s*(?:{pattern})\\s*$", "$options": "i"}},
+            {"name": 1})
+        for doc in legacy:
+            key = normalize_title_for_match(doc.get("name", ""))
+            if key in wanted and key not in resolved:
+                resolved[key] = doc["_id"]
+                try:
+                    ingredients_col.update_one({"_id": doc["_id"]}, {"$set": {"nameKey": key}})
+                except Exception as e:
+                    log("Ingredient nameKey backfill failed:", e)
+        missing = [k for k in missing if k not in resolved]
+
+    if missing and create_missing:
+        now = datetime.now(timezone.utc)
+        ops = [
+            UpdateOne({"nameKey": key}, {"$setOnInsert": {
+                "name": wanted[key]["name"],
+                "nameKey": key,
+                "unit": wanted[key]["unit"],
+                "currentStock": 0,  # Start with 0 stock
+                "pricePerUnit": 0,
+                "totalPurchasedQuantity": 0,
+                "totalPurchasedAmount": 0,
+                "lastPurchaseUnitPrice": 0,
+                "alertThreshold": 10,  # Default alert threshold
+                "isManuallyOutOfStock": False,
+                "createdAt": now,
+                "updatedAt": now,
+            }}, upsert=True)
+            for key in missing
+        ]
+        try:
+            result = ingredients_col.bulk_write(ops, ordered=False)
+            upserted = result.upserted_ids or {}
+        except BulkWriteError as e:
+            # Typically a duplicate name from a concurrent save; the re-query below picks it up
+            log("Ingredient bulk upsert partially failed:", e.details.get("writeErrors", [])[:1])
+            upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+        for index, _id in upserted.items():
+            resolved[missing[index]] = _id
+            log(f"Added ingredient to MongoDB: {wanted[missing[index]]['name']}")
+        # Keys matched instead of inserted (another request created them first)
+        raced = [k for k in missing if k not in resolved]
+        if raced:
+            for doc in ingredients_col.find({"nameKey": {"$in": raced}}, {"nameKey": 1}):
+                resolved[doc["nameKey"]] = doc["_id"]
+    return resolved
+
+def add_ingredients_to_inventory(ingredients_col, recipe_ingredients: List[Dict[str, Any]]) -> Optional[Dict[str, ObjectId]]:
+    """Add recipe ingredients to MongoDB ingredients collection.
+    Returns {nameKey: _id} for the recipe's ingredients, or None when adding is disabled."""
     # Respect environment flag to avoid polluting inventory
     if not AUTO_ADD_INGREDIENTS:
-        return
-    if not recipe_ingredients:
-        return
+        return None
     if ingredients_col is None:
-        return
-    
-    for ing in recipe_ingredients:
-        ing_name = str(ing.get("name", "")).strip()
-        if not ing_name:
-            continue
-            
-        ing_unit = ing.get("unit", "unit")
-        # Normalize units to match Ingredient schema
-        if ing_unit == "scoops":
-            ing_unit = "unit"  # Convert scoops to unit
-        elif ing_unit == "tsp" or ing_unit == "tbsp":
-            ing_unit = "unit"  # Convert tsp/tbsp to unit
-        elif ing_unit not in {"g", "kg", "l", "ml", "piece", "unit"}:
-            ing_unit = "unit"
-        
-        # Check if ingredient already exists in MongoDB
-        existing_doc = ingredients_col.find_one({
-            "name": {"$regex": f"^\\s*{re.escape(ing_name)}\\s*$", "$options": "i"}
-        })
-        
-        if not existing_doc:
-            # Add to MongoDB ingredients collection
-            try:
-                ingredient_doc = {
-                    "name": ing_name,
-                    "unit": ing_unit,
-                    "currentStock": 0,  # Start with 0 stock
-                    "pricePerUnit": 0,
-                    "totalPurchasedQuantity": 0,
-                    "totalPurchasedAmount": 0,
-                    "lastPurchaseUnitPrice": 0,
-                    "alertThreshold": 10,  # Default alert threshold
-                }
-                ingredients_col.insert_one(ingredient_doc)
-                log(f"Added ingredient to MongoDB: {ing_name}")
-            except Exception as e:
-                log(f"Failed to add ingredient {ing_name} to MongoDB: {e}")
+        return None
+    try:
+        return resolve_ingredient_ids(ingredients_col, recipe_ingredients, create_missing=True)
+    except Exception as e:
+        log(f"Failed to add ingredients to MongoDB: {e}")
+        return None
 
-def save_item_to_mongo(items_col, ingredients_col, item: Dict[str, Any]) -> str:
+@timed("save")
+def save_item_to_mongo(items_col, ingredients_col, item: Dict[str, Any],
+                       ingredient_ids: Optional[Dict[str, ObjectId]] = None) -> str:
     """Save item into MongoDB 'items' collection following the Mongoose schema shape.
-    Returns inserted _id as string (or existing id if upserted).
+    ingredient_ids ({nameKey: _id}, e.g. from add_ingredients_to_inventory) is resolved in bulk
+    when not given. Returns inserted _id as string (or existing id if upserted).
     """
     if items_col is None:
         # DB not available; skip persistence
@@ -180,7 +1042,7 @@ def save_item_to_mongo(items_col, ingredients_col, item: Dict[str, Any]) -> str:
         # Try to return existing id if present; otherwise, return empty string
         name = item.get("name")
         if name:
-            existing = items_col.find_one({"name": {"$regex": f"^\\s*{re.escape(name)}\\s*$", "$options": "i"}})
+            existing = find_item_by_key(items_col, normalize_title_for_match(name), name)
             if existing:
                 return str(existing.get("_id"))
         return ""
@@ -188,16 +1050,28 @@ def save_item_to_mongo(items_col, ingredients_col, item: Dict[str, Any]) -> str:
     if not name:
         raise RuntimeError("Cannot save item without a name")
 
-    # Check if exists (case-insensitive exact)
-    existing = items_col.find_one({"name": {"$regex": f"^\\s*{re.escape(name)}\\s*$", "$options": "i"}})
+    # Check if exists (normalized name)
+    name_key = normalize_title_for_match(name)
+    existing = find_item_by_key(items_col, name_key, name)
     if existing:
         return str(existing.get("_id"))
 
     # Map ingredients -> include ObjectId when resolvable
+    if ingredient_ids is None:
+        ingredient_ids = resolve_ingredient_ids(ingredients_col, item.get("ingredients", []) or [])
+    doc = item_document(item, ingredient_ids, datetime.now(timezone.utc))
+    res = items_col.insert_one(doc)
+    item_index.add(name_key, res.inserted_id, name)
+    dish_index.put(dict(doc, _id=res.inserted_id))
+    return str(res.inserted_id)
+
+def item_document(item: Dict[str, Any], ingredient_ids: Dict[str, ObjectId], now: datetime) -> Dict[str, Any]:
+    """Item in the Mongoose schema shape, recipe lines linked to ingredient _ids by nameKey."""
+    name = item.get("name")
     ing_docs = []
     for ing in item.get("ingredients", []) or []:
         ing_name = ing.get("name")
-        oid = resolve_ingredient_object_id(ingredients_col, ing_name)
+        oid = ingredient_ids.get(normalize_title_for_match(ing_name or ""))
         ing_docs.append({
             "ingredient": oid,  # may be None in Mongo, OK
             "name": ing_name,
@@ -205,8 +1079,9 @@ def save_item_to_mongo(items_col, ingredients_col, item: Dict[str, Any]) -> str:
             "unit": ing.get("unit") or "unit",
         })
 
-    doc = {
+    return {
         "name": name,
+        "nameKey": normalize_title_for_match(name),
         "description": item.get("description") or "",
         "instructions": item.get("instructions") or "",
         "price": float(item.get("price") or 0.0),
@@ -215,11 +1090,10 @@ def save_item_to_mongo(items_col, ingredients_col, item: Dict[str, Any]) -> str:
         "isAvailable": bool(item.get("isAvailable", True)),
         "soldCount": int(item.get("soldCount", 0)),
         "steps": [str(s) for s in (item.get("steps") or [])],
+        "createdAt": now,
+        "updatedAt": now,
     }
 
-    res = items_col.insert_one(doc)
-    return str(res.inserted_id)
-
 # ---------------- Helpers ----------------
 
 def log(*a):
@@ -241,46 +1115,74 @@ def guess_category(name: str) -> str:
 
 # ---------------- DuckDuckGo + Gemini ----------------
 
+def ddg_search_queries(query: str) -> List[str]:
+    # Search for recipe-specific content
+    return [
+        f"{query} recipe ingredients steps how to make",
+        f"{query} cooking instructions ingredients list",
+        f"{query} preparation method ingredients quantities"
+    ]
+
+def collect_recipe_snippets(rows, results: List[Dict[str, str]], max_results: int) -> bool:
+    """Append recipe-looking DDG rows to results; True once max_results is reached."""
+    for r in rows:
+        # Filter for recipe-related content
+        title = r.get("title") or ""
+        snippet = r.get("body") or r.get("snippet") or ""
+
+        # Only include results that seem recipe-related
+        if any(keyword in title.lower() or keyword in snippet.lower()
+               for keyword in ["recipe", "ingredients", "instructions", "steps", "how to", "preparation"]):
+            results.append({
+                "title": title,
+                "href": r.get("href") or "",
+                "snippet": snippet,
+            })
+
+            # Avoid duplicates
+            if len(results) >= max_results:
+                return True
+    return False
+
+@timed("search")
 def ddg_search_snippets(query: str, max_results=8):
     results = []
-    if not DDGS: return results
     try:
-        with DDGS() as ddgs:
-            # Search for recipe-specific content
-            search_queries = [
-                f"{query} recipe ingredients steps how to make",
-                f"{query} cooking instructions ingredients list",
-                f"{query} preparation method ingredients quantities"
-            ]
-            
-            for search_query in search_queries:
-                for r in ddgs.text(search_query, max_results=max_results//2, region="wt-wt"):
-                    # Filter for recipe-related content
-                    title = r.get("title") or ""
-                    snippet = r.get("body") or r.get("snippet") or ""
-                    
-                    # Only include results that seem recipe-related
-                    if any(keyword in title.lower() or keyword in snippet.lower() 
-                           for keyword in ["recipe", "ingredients", "instructions", "steps", "how to", "preparation"]):
-                        results.append({
-                            "title": title,
-                            "href": r.get("href") or "",
-                            "snippet": snippet,
-                        })
-                        
-                        # Avoid duplicates
-                        if len(results) >= max_results:
-                            break
-                if len(results) >= max_results:
-                    break
-                    
+        ddgs = get_ddgs_session()
+        if ddgs is None:
+            return results
+        for search_query in ddg_search_queries(query):
+            if collect_recipe_snippets(ddgs.text(search_query, max_results=max_results//2, region="wt-wt"),
+                                       results, max_results):
+                break
     except Exception as e:
         log("DDG error", e)
     return results
 
+async def ddg_search_snippets_async(query: str, max_results=8):
+    """Same results as ddg_search_snippets, but the three searches run concurrently."""
+    results = []
+    ddgs = get_ddgs_session()
+    if ddgs is None:
+        return results
+    loop = asyncio.get_running_loop()
+
+    def one(search_query: str):
+        try:
+            return list(ddgs.text(search_query, max_results=max_results//2, region="wt-wt"))
+        except Exception as e:
+            log("DDG error", e)
+            return []
+
+    with stage_metrics.span("search"):
+        batches = await asyncio.gather(*(loop.run_in_executor(UPSTREAM_POOL, one, q) for q in ddg_search_queries(query)))
+    for rows in batches:
+        if collect_recipe_snippets(rows, results, max_results):
+            break
+    return results
 
 def init_gemini():
-    if not genai or not GOOGLE_API_KEY:
+    if not GOOGLE_API_KEY or not load_genai():
         return None
     try:
         genai.configure(api_key=GOOGLE_API_KEY)
@@ -324,7 +1226,7 @@ def gemini_compose_recipe_from_web(model, dish: str, snippets):
                                  "- If web sources don't provide exact amounts, use standard recipe quantities\n\n"
                                  f"Web snippets:\n{json.dumps(snippets)}"}]}
     ]
-    resp = model.generate_content(prompt)
+    resp = generate_recipe_content(model, prompt)
     return parse_gemini_json(resp.text, dish)
 
 def gemini_compose_recipe_simple(model, dish: str):
@@ -342,61 +1244,804 @@ def gemini_compose_recipe_simple(model, dish: str):
                                  "- Make sure all ingredients have realistic quantities\n"
                                  "- Include cooking techniques and specific instructions"}]}
     ]
-    resp = model.generate_content(prompt)
+    resp = generate_recipe_content(model, prompt)
     return parse_gemini_json(resp.text, dish)
 
-def parse_gemini_json(txt: str, dish: str):
-    try:
-        data = json.loads(txt)
-    except Exception:
-        # Try to find JSON block in the response
-        m = re.search(r"\{[\s\S]*\}", txt)
-        if m:
-            try:
-                data = json.loads(m.group(0))
-            except Exception:
-                data = {}
-        else:
-            data = {}
-    
-    if not isinstance(data, dict):
-        log(f"Failed to parse JSON for {dish}, got: {txt[:200]}...")
-        return {"name": dish, "category": guess_category(dish), "ingredients": [], "steps": []}
-
+# "1/2", "1 1/2", "2-3" and "2,5" as Gemini sometimes writes them
+QUANTITY_RE = re.compile(r"^\s*(?:(?:(\d+)\s+)?(\d+)\s*/\s*(\d+)|(\d+(?:[.,]\d+)?))")
+FENCE_RE = re.compile(r"```(?:json|JSON)?\s*")
+RECIPE_KEYS = ("name", "category", "ingredients", "steps", "instructions")
+
+def parse_quantity(value: Any) -> float:
+    if isinstance(value, bool):
+        return 0.0
+    if isinstance(value, (int, float)):
+        return max(float(value), 0.0)
+    m = QUANTITY_RE.match(str(value or ""))
+    if not m:
+        return 0.0
+    if m.group(4):
+        return float(m.group(4).replace(",", "."))
+    whole, num, den = int(m.group(1) or 0), int(m.group(2)), int(m.group(3))
+    return whole + (num / den if den else 0.0)
+
+def recipe_unit(unit: Any) -> str:
+    """Ingredient schema unit for a recipe unit: spellings of g/kg/l/ml/piece are mapped,
+    anything else (tsp, tbsp, cups, pinch) becomes "unit"."""
+    unit = str(unit or "unit").strip().lower().rstrip(".")
+    if unit in INGREDIENT_UNITS:
+        return unit
+    return UNIT_ALIASES.get(unit, "unit")
+
+def clean_recipe_ingredients(raw_ings) -> List[Dict[str, Any]]:
     clean_ings = []
-    for ing in data.get("ingredients", []) or []:
+    for ing in raw_ings if isinstance(raw_ings, list) else []:
+        if not isinstance(ing, dict): continue
         name = str(ing.get("name") or "").strip()
         if not name: continue
-        try: 
-            qty = float(ing.get("quantity",0))
-        except: 
-            qty = 0.0
-        unit = (ing.get("unit") or "unit").strip()
-        if unit not in {"g","kg","l","ml","piece","unit"}: 
-            unit = "unit"
-        clean_ings.append({"name": name, "quantity": qty, "unit": unit})
+        clean_ings.append({"name": name, "quantity": parse_quantity(ing.get("quantity", 0)),
+                           "unit": recipe_unit(ing.get("unit"))})
+    return clean_ings
+
+class RecipeParseMetrics:
+    """Counters for how Gemini output was turned into recipes: decoded as-is, extracted from
+    prose / code fences, repaired, salvaged from truncated output, or lost."""
+
+    OUTCOMES = ("json", "extracted", "repaired", "truncated", "failed", "rejected")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {k: 0 for k in self.OUTCOMES}
+        self.categories_guessed = 0
+        self.ingredients_dropped = 0
+        self.json_mode_fallbacks = 0
+
+    def record(self, outcome: str, categories_guessed: int = 0, ingredients_dropped: int = 0) -> None:
+        with self.lock:
+            self.counts[outcome] += 1
+            self.categories_guessed += categories_guessed
+            self.ingredients_dropped += ingredients_dropped
+
+    def json_mode_fallback(self) -> None:
+        with self.lock:
+            self.json_mode_fallbacks += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counts, categoriesGuessed=self.categories_guessed,
+                        ingredientsDropped=self.ingredients_dropped, jsonModeFallbacks=self.json_mode_fallbacks)
+
+recipe_parse_metrics = RecipeParseMetrics()
+
+def generate_recipe_content(model, prompt, stream: bool = False):
+    """model.generate_content in JSON mode (response_mime_type) where the SDK and model accept
+    it, so the reply is a bare object; plain text once that model rejects it. A buffered call is
+    timed as an "llm" span; a streamed one is timed by its consumer (gemini_stream_recipe)."""
+    if stream:
+        return request_recipe_content(model, prompt, stream)
+    with stage_metrics.span("llm"):
+        return request_recipe_content(model, prompt, stream)
+
+# Older SDKs have no per-call request_options; flips to False the first time one rejects it
+_REQUEST_TIMEOUTS = True
+
+def call_gemini(model, prompt, **kwargs):
+    """model.generate_content bounded by ASSISTANT_LLM_TIMEOUT, so a hung call frees its worker."""
+    global _REQUEST_TIMEOUTS
+    if _REQUEST_TIMEOUTS:
+        try:
+            return model.generate_content(prompt, request_options={"timeout": LLM_TIMEOUT}, **kwargs)
+        except TypeError as e:
+            if "request_options" not in str(e):
+                raise
+            _REQUEST_TIMEOUTS = False
+    return model.generate_content(prompt, **kwargs)
+
+# Models (by name) that rejected JSON mode; asked for plain text from then on
+_plain_text_models = set()
+
+def model_key(model) -> str:
+    return getattr(model, "model_name", None) or f"{type(model).__name__}@{id(model)}"
+
+def json_mode_unsupported(e: Exception) -> bool:
+    """True only for the rejection of response_mime_type itself: an SDK whose GenerationConfig
+    has no such field, or a model answering that it does not support it. Timeouts, quota and
+    other errors must not switch JSON mode off."""
+    msg = str(e)
+    return "response_mime_type" in msg or "Unknown field for GenerationConfig" in msg
+
+def request_recipe_content(model, prompt, stream: bool):
+    key = model_key(model)
+    if JSON_MODE and key not in _plain_text_models:
+        try:
+            return call_gemini(model, prompt, stream=stream,
+                               generation_config={"response_mime_type": "application/json"})
+        except Exception as e:
+            if not json_mode_unsupported(e):
+                raise
+            _plain_text_models.add(key)
+            recipe_parse_metrics.json_mode_fallback()
+            log("Gemini JSON mode unavailable, asking for plain text:", e)
+    return call_gemini(model, prompt, stream=stream)
+
+def decode_recipe_json(txt: str, parser: Optional["PartialJSONObject"] = None) -> Tuple[Optional[Dict[str, Any]], str]:
+    """The recipe object in a Gemini reply and how it was found (a RecipeParseMetrics outcome).
+    Linear in the reply: one bracket-balanced scan (reusing the streaming parser when given)
+    instead of a greedy regex, then bounded fallbacks for prose the scan cannot skip."""
+    try:
+        data = json.loads(txt)
+        if isinstance(data, dict):
+            return data, "json"
+    except ValueError:
+        pass
+    if parser is None:
+        parser = PartialJSONObject()
+        parser.feed(txt)
+    if parser.complete:
+        return parser.object, "repaired" if parser.repaired else "extracted"
+    # An unbalanced "{" in the prose swallowed the object: try fenced blocks, then later braces
+    starts = [m.end() for m in FENCE_RE.finditer(txt)]
+    i = parser.start
+    while len(starts) < 32:
+        i = txt.find("{", i + 1)
+        if i < 0:
+            break
+        starts.append(i)
+    for start in starts:
+        candidate = PartialJSONObject()
+        candidate.feed(txt[start:])
+        if candidate.complete and ("ingredients" in candidate.object or "steps" in candidate.object):
+            return candidate.object, "repaired" if candidate.repaired else "extracted"
+    # Cut off mid-object (token limit, dropped stream): keep the keys that fully arrived
+    salvaged = parser.salvage(RECIPE_KEYS)
+    if salvaged.get("ingredients") or salvaged.get("steps"):
+        return salvaged, "truncated"
+    return None, "failed"
+
+@timed("parse")
+def parse_gemini_json(txt: str, dish: str, parser: Optional["PartialJSONObject"] = None) -> Tuple[Optional[Dict[str, Any]], str]:
+    """(validated recipe, RecipeParseMetrics outcome) from a Gemini reply; the recipe is None
+    when nothing usable could be recovered (never an empty recipe). A "truncated" recipe was
+    salvaged from a cut-off reply: it may be shown, but see recipe_is_complete."""
+    data, outcome = decode_recipe_json(txt or "", parser)
+    if data is None:
+        log(f"Failed to parse JSON for {dish}, got: {(txt or '')[:200]}...")
+        recipe_parse_metrics.record("failed")
+        return None, "failed"
+    recipe = normalize_recipe(data, dish)
+    if not recipe_is_usable(recipe):
+        log(f"Recipe for {dish} has no ingredients or steps")
+        recipe_parse_metrics.record("rejected")
+        return None, "rejected"
+    raw_ings = data.get("ingredients")
+    recipe_parse_metrics.record(
+        outcome,
+        categories_guessed=int(str(data.get("category") or "").strip().lower() not in ITEM_CATEGORIES),
+        ingredients_dropped=(len(raw_ings) if isinstance(raw_ings, list) else 0) - len(recipe["ingredients"]))
+    return recipe, outcome
+
+def normalize_recipe(data: Dict[str, Any], dish: str) -> Dict[str, Any]:
+    """Recipe dict in the shape the rest of the assistant uses (and the Item schema accepts):
+    clamped ingredient units and quantities, non-empty string steps (split from instructions
+    when missing), a category from the menu enum (guessed otherwise)."""
+    clean_ings = clean_recipe_ingredients(data.get("ingredients", []))
 
     steps = data.get("steps", []) or []
-    if not steps and data.get("instructions"):
+    if not isinstance(steps, list):
+        steps = [steps]
+    steps = [str(s).strip() for s in steps if isinstance(s, (str, int, float)) and str(s).strip()]
+    if not steps and isinstance(data.get("instructions"), str):
         # If no steps but instructions exist, split instructions into steps
-        instructions = data.get("instructions", "")
-        steps = [s.strip() for s in instructions.split('.') if s.strip()]
+        steps = [s.strip() for s in data["instructions"].split('.') if s.strip()]
 
+    name = data.get("name")
+    name = name.strip() if isinstance(name, str) and name.strip() else dish
+    category = str(data.get("category") or "").strip().lower()
     return {
-        "name": data.get("name", dish),
-        "category": data.get("category", guess_category(dish)),
+        "name": name,
+        "category": category if category in ITEM_CATEGORIES else guess_category(name),
         "ingredients": clean_ings,
-        "steps": [str(s) for s in steps]
+        "steps": steps
     }
 
+def gemini_stream_recipe(model, dish: str, snippets):
+    """Yield the raw text of a streamed Gemini recipe. Keys are requested in display order
+    (ingredients before steps) so the answer can be rendered while it is generated."""
+    grounding = ""
+    if snippets:
+        grounding = ("Use the following web snippets as references to create an accurate recipe.\n"
+                     "- If web sources don't provide exact amounts, use standard recipe quantities\n\n"
+                     f"Web snippets:\n{json.dumps(snippets)}\n\n")
+    prompt = [
+        {"role":"system","parts":[{"text":GEMINI_SYSTEM}]},
+        {"role":"user","parts":[{"text":f"Create a DETAILED and SPECIFIC recipe for '{dish}'.\n"
+                                 "Return STRICT JSON with keys in exactly this order: name (string), category (string),"
+                                 " ingredients (array of objects with name (string), quantity (number),"
+                                 " unit (one of: g, kg, l, piece, unit)), steps (string[]).\n\n"
+                                 "IMPORTANT REQUIREMENTS:\n"
+                                 "- Use EXACT quantities and SPECIFIC ingredient names\n"
+                                 "- Include detailed steps with cooking times and temperatures\n"
+                                 "- Provide 6-12 detailed steps with specific instructions\n"
+                                 "- Use precise measurements (e.g., 2.5 g, 0.5 l, 3 pieces)\n"
+                                 "- Make sure all ingredients have realistic quantities\n\n"
+                                 + grounding}]}
+    ]
+    # The span covers the whole stream, including the caller's rendering between chunks
+    with stage_metrics.span("llm"):
+        for chunk in generate_recipe_content(model, prompt, stream=True):
+            try:
+                text = chunk.text
+            except Exception:
+                continue
+            if text:
+                yield text
+
+class PartialJSONObject:
+    """Incremental scanner over a JSON object that arrives in chunks.
+
+    Anything before the first '{' (code fences, prose) is skipped, and a balanced span that
+    does not decode ("use {your} favourite cheese") is dropped and the scan resumes at the next
+    '{'. The scanner tracks string and nesting state across feeds and records where each
+    top-level key's value starts, so complete values can be decoded while the rest of the
+    object is still streaming."""
+
+    _decoder = json.JSONDecoder()
+    _trailing_comma = re.compile(r",(\s*[}\]])")
+    _structural = re.compile(r'[{}\[\]":,]')
+    _string_special = re.compile(r'["\\]')
+    _object_head = re.compile(r'\{\s*["}]')
+
+    def __init__(self):
+        self.text = ""
+        self._reset(0)
+
+    def _reset(self, pos: int) -> None:
+        self.pos = pos
+        self.start = -1
+        self.end = -1
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = -1
+        self.last_string: Optional[Tuple[int, int]] = None
+        self.keys: Dict[str, int] = {}
+        self.values: Dict[str, Any] = {}
+        self.arrays: Dict[str, Tuple[List[Any], int, bool]] = {}
+        self.object: Optional[Dict[str, Any]] = None
+        self.repaired = False
+
+    def feed(self, chunk: str) -> None:
+        self.text += chunk
+        while self._scan() and not self._decode_object():
+            self._reset(self.start + 1)
+
+    def _decode_object(self) -> bool:
+        """Decode the balanced span just closed; a trailing comma is the one repair tried."""
+        if not self._object_head.match(self.text, self.start):
+            return False  # "{chef's tip}": not even the start of a JSON object
+        span = self.text[self.start:self.end]
+        try:
+            obj = json.loads(span)
+        except ValueError:
+            try:
+                obj = json.loads(self._trailing_comma.sub(r"\1", span))
+                self.repaired = True
+            except ValueError:
+                return False
+        if not isinstance(obj, dict):
+            return False
+        self.object = obj
+        return True
+
+    def salvage(self, keys) -> Dict[str, Any]:
+        """The given top-level keys of an object that never closed: complete values as decoded,
+        arrays cut to their complete leading elements."""
+        out: Dict[str, Any] = {}
+        for key in keys:
+            value = self.value(key)
+            if value is None:
+                value = self.array_items(key) or None
+            if value is not None:
+                out[key] = value
+        return out
+
+    def _scan(self) -> bool:
+        """Advance over new text; True once the current top-level object has closed."""
+        t, n, i = self.text, len(self.text), self.pos
+        if self.start < 0:
+            j = t.find("{", i)
+            if j < 0:
+                self.pos = n
+                return False
+            self.start = i = j
+        # Jump between structural characters; plain text inside strings and prose costs nothing
+        while i < n and self.end < 0:
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                    i += 1
+                    continue
+                m = self._string_special.search(t, i)
+                if m is None:
+                    i = n
+                    break
+                i = m.start()
+                if t[i] == "\\":
+                    self.escape = True
+                else:
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = (self.string_start, i + 1)
+                i += 1
+                continue
+            m = self._structural.search(t, i)
+            if m is None:
+                i = n
+                break
+            i = m.start()
+            c = t[i]
+            if c == '"':
+                self.in_string = True
+                self.string_start = i
+            elif c in "{[":
+                self.depth += 1
+            elif c in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = i + 1
+            elif self.depth == 1:
+                if c == ":" and self.last_string:
+                    try:
+                        self.keys[json.loads(t[self.last_string[0]:self.last_string[1]])] = i + 1
+                    except Exception:
+                        pass
+                    self.last_string = None
+                elif c == ",":
+                    self.last_string = None
+            i += 1
+        self.pos = i
+        return self.end >= 0
+
+    @property
+    def complete(self) -> bool:
+        return self.end >= 0
+
+    def _skip_ws(self, i: int) -> int:
+        t = self.text
+        while i < len(t) and t[i] in " \t\r\n":
+            i += 1
+        return i
+
+    def _decode_at(self, i: int) -> Optional[Tuple[Any, int]]:
+        try:
+            obj, end = self._decoder.raw_decode(self.text, i)
+        except ValueError:
+            return None
+        # A bare number at the very end of the buffer may still be growing
+        if end >= len(self.text) and not self.complete:
+            return None
+        return obj, end
+
+    def value(self, key: str) -> Optional[Any]:
+        """The decoded value of a top-level key once it has fully arrived, else None."""
+        if key in self.values:
+            return self.values[key]
+        if key not in self.keys:
+            return None
+        hit = self._decode_at(self._skip_ws(self.keys[key]))
+        if hit is None:
+            return None
+        self.values[key] = hit[0]
+        return hit[0]
+
+    def has_key(self, key: str) -> bool:
+        return key in self.keys
+
+    def array_items(self, key: str) -> List[Any]:
+        """The complete leading elements of a top-level array value, while it is still open."""
+        if key not in self.keys:
+            return []
+        items, i, done = self.arrays.get(key, ([], -1, False))
+        if done:
+            return items
+        if i < 0:
+            i = self._skip_ws(self.keys[key])
+            if i >= len(self.text) or self.text[i] != "[":
+                return items
+            i += 1
+        while True:
+            i = self._skip_ws(i)
+            if i >= len(self.text):
+                break
+            if self.text[i] == "]":
+                done = True
+                break
+            hit = self._decode_at(i)
+            if hit is None:
+                break
+            items.append(hit[0])
+            i = self._skip_ws(hit[1])
+            if i < len(self.text) and self.text[i] == ",":
+                i += 1
+        self.arrays[key] = (items, i, done)
+        return items
+
+# ---------------- Recipe cache ----------------
+
+class RecipeCache:
+    """LRU + TTL cache for synthesized recipes and DDG snippets, keyed on the normalized dish.
+    Each kind ("recipe", "snippets") has its own TTL and its own size bound. When a path is
+    given the cache is loaded from a JSON file and written back so it survives restarts: puts
+    only mark it dirty; with a flush_delay a timer writes once per burst (serve mode), else
+    flush() writes once at exit."""
+
+    def __init__(self, path: Optional[str], max_entries: int, ttls: Dict[str, float]):
+        self.path = path or None
+        self.max_entries = max(1, max_entries)
+        self.ttls = dict(ttls)
+        self.entries: Dict[str, "OrderedDict[str, Tuple[float, Any]]"] = {k: OrderedDict() for k in ttls}
+        self.hits = {k: 0 for k in ttls}
+        self.misses = {k: 0 for k in ttls}
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.dirty = False
+        self.flush_delay = 0.0
+        self.timer: Optional[threading.Timer] = None
+        # Serialises writers so an older snapshot never replaces a newer file
+        self.write_lock = threading.Lock()
+
+    def _load(self) -> None:
+        self.loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            for kind, rows in (raw or {}).items():
+                if kind in self.entries:
+                    for key, ts, value in rows:
+                        self.entries[kind][key] = (float(ts), value)
+        except Exception as e:
+            log("Recipe cache load failed:", e)
+
+    def _schedule(self) -> None:
+        """Caller holds self.lock."""
+        self.dirty = True
+        if self.flush_delay > 0 and self.timer is None:
+            self.timer = threading.Timer(self.flush_delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self) -> None:
+        """Write the cache file if anything changed since the last write. The file is replaced
+        atomically from a temp file private to this process, so concurrent processes never
+        interleave their writes; the last one to finish wins."""
+        if not self.path:
+            return
+        with self.write_lock:
+            with self.lock:
+                self.timer = None
+                if not self.dirty:
+                    return
+                self.dirty = False
+                # Values are stored as private copies and never mutated, so a shallow snapshot will do
+                data = {kind: [[k, ts, v] for k, (ts, v) in od.items()] for kind, od in self.entries.items()}
+            tmp = None
+            try:
+                with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(self.path) or ".",
+                                                 prefix=".assistant_cache.", suffix=".tmp", delete=False) as f:
+                    tmp = f.name
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp, self.path)
+            except Exception as e:
+                log("Recipe cache write failed:", e)
+                if tmp:
+                    try:
+                        os.unlink(tmp)
+                    except OSError:
+                        pass
+
+    def get(self, kind: str, key: str) -> Optional[Any]:
+        if not key:
+            return None
+        with self.lock:
+            if not self.loaded:
+                self._load()
+            od = self.entries[kind]
+            hit = od.get(key)
+            if hit is not None and time.time() - hit[0] > self.ttls[kind]:
+                del od[key]
+                hit = None
+            if hit is None:
+                self.misses[kind] += 1
+                stage_metrics.cache(kind, False)
+                return None
+            od.move_to_end(key)
+            self.hits[kind] += 1
+            stage_metrics.cache(kind, True)
+            return copy.deepcopy(hit[1])
+
+    def put(self, kind: str, key: str, value: Any) -> None:
+        if not key:
+            return
+        with self.lock:
+            if not self.loaded:
+                self._load()
+            od = self.entries[kind]
+            od[key] = (time.time(), copy.deepcopy(value))
+            od.move_to_end(key)
+            while len(od) > self.max_entries:
+                od.popitem(last=False)
+            self._schedule()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self.lock:
+            return {kind: {"hits": self.hits[kind], "misses": self.misses[kind], "size": len(od)}
+                    for kind, od in self.entries.items()}
+
+recipe_cache = RecipeCache(CACHE_PATH, CACHE_SIZE, {"recipe": RECIPE_TTL, "snippets": SNIPPET_TTL})
+# Library callers exit normally; the CLI paths flush in exit_process (os._exit skips atexit)
+atexit.register(recipe_cache.flush)
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key: the first caller (leader) runs fn, callers
+    arriving while it is in flight wait and receive the leader's result (or exception).
+    Nothing is remembered once the call finishes; that is the recipe cache's job."""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error: Optional[BaseException] = None
+            self.waiters = 0
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: Dict[str, "SingleFlight._Call"] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn) -> Tuple[Any, bool]:
+        """Returns (result, shared); shared is True when another caller's run was reused."""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = SingleFlight._Call()
+                self.leaders += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"leaders": self.leaders, "coalesced": self.coalesced, "inFlight": len(self.calls)}
+
+# Concurrent misses for the same dish share one search + LLM + save
+synthesis_flights = SingleFlight()
+
+# ---------------- Intent ----------------
+
+def keyword_pattern(words: List[str]) -> "re.Pattern":
+    """One compiled alternation equivalent to any(w in text for w in words)."""
+    return re.compile("|".join(re.escape(w) for w in sorted(set(words), key=len, reverse=True)))
+
+RESTAURANT_RE = keyword_pattern(RESTAURANT_KEYWORDS)
+INVENTORY_RE = keyword_pattern(INVENTORY_PHRASES)
+STAPLES_RE = keyword_pattern(INVENTORY_STAPLES)
+INVENTORY_ENTITY_RE = re.compile(
+    r"how (?:much|many) ([a-zA-Z\s]+?) do i have|([a-zA-Z\s]+?) buckets|([a-zA-Z\s]+?) quantity")
+DISH_NAME_RES = [re.compile(r"ingredients of ([a-zA-Z\s]+)"), re.compile(r"recipe for ([a-zA-Z\s]+)")]
+DISH_VERB_RE = re.compile(r"(?:make|prepare|cook|bake) ([a-zA-Z\s]+)$")
+ENTITY_TOKEN_RE = re.compile(r"[a-z0-9]+")
+# "how many margheritas can we still make", "can we still make pancakes tonight"
+CAPACITY_RES = [
+    re.compile(r"how many (?:portions of |servings of |orders of |more )?([a-z\s]+?) (?:can|could) (?:we|i) (?:still )?(?:make|cook|prepare|bake|serve|sell)"),
+    re.compile(r"(?:can|could) we (?:still )?(?:make|cook|prepare|bake|serve) (?:an? |any |more )?([a-z\s]+?)(?: tonight| today| now| anymore)?$"),
+]
+# "what's about to 86 tonight", "which dishes are running low"
+RUNNING_LOW_RE = re.compile(r"\b86(?:'d|ed)?\b|eighty[- ]six|running (?:out|low)|about to run out|what (?:can't|cannot) we make")
+# "what's the food cost of a bacon burger", "margin on the caesar salad", "how much does a latte cost us"
+COST_RES = [
+    re.compile(r"(?:food |plate |ingredient |recipe )?cost (?:of|for) (?:an? |the |one |each )?([a-z\s]+?)$"),
+    re.compile(r"(?:margin|markup|profit) (?:on|of|for) (?:an? |the |one |each )?([a-z\s]+?)$"),
+    re.compile(r"how much does (?:an? |the |one |each )?([a-z\s]+?) cost (?:us|to make)"),
+]
+# "which dishes have the lowest margin", "least profitable items"
+MARGIN_LIST_RE = re.compile(r"(?:lowest|worst|smallest|thinnest) (?:food cost )?margins?|least profitable")
+# "what do I need to order for the weekend", "shopping list for tomorrow", "what needs reordering"
+ORDER_RE = re.compile(r"what (?:do|should|must) (?:i|we) (?:need to |have to )?(?:re)?(?:order|buy|stock|purchase)"
+                      r"|(?:what|which \w+) (?:needs?|have|has) (?:to be )?(?:re)?order(?:ed|ing)?|what to (?:re)?order"
+                      r"|(?:re)?order(?:ing)? list|shopping list|purchase list|reorder points?")
+ORDER_HORIZON_RE = re.compile(r"\b(?:(next|this|the) )?(weekend|week)\b|\b(tonight|today|tomorrow)\b"
+                              r"|\b(monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b|\b(\d+) days?\b")
+# "how long will the flour last", "days of cover for milk"; bare "days of cover" lists the shortest
+COVER_RES = [
+    re.compile(r"how long (?:will|would|does|do|can) (?:the |our |my )?([a-z\s]+?) (?:last|hold out)"),
+    re.compile(r"days? of (?:cover|stock) (?:for|of|on) (?:the |our |my )?([a-z\s]+?)$"),
+]
+COVER_LIST_RE = re.compile(r"days? of (?:cover|stock)|(?:lowest|least|shortest) cover")
+# "which dishes use mushrooms", "what can I cook with cheese", "dishes containing basil"
+USES_RES = [
+    re.compile(r"(?:which|what) (?:dishes|items|recipes|meals|plates)(?: on the menu)? (?:use|uses|contain|contains|have|need|needs|are made with) (?:any )?([a-z\s]+?)$"),
+    re.compile(r"what (?:can|could) (?:i|we) (?:cook|make|prepare|bake|serve) with (?:the |our |my |some )?([a-z\s]+?)$"),
+    re.compile(r"(?:dishes|items|recipes) (?:with|using|containing|that use) (?:the |any )?([a-z\s]+?)$"),
+    re.compile(r"what uses (?:the |our |any )?([a-z\s]+?)$"),
+]
+# "what breaks if we run out of cheese", "what happens if the tomatoes run out"
+IMPACT_RES = [
+    re.compile(r"if (?:we|i) (?:run|ran|are|were) out of (?:the |our |any )?([a-z\s]+?)$"),
+    re.compile(r"if (?:the |our )?([a-z\s]+?) (?:runs|run|ran) out$"),
+    re.compile(r"(?:impact of running out of|depends? on) (?:the |our |any )?([a-z\s]+?)$"),
+]
+
+class QueryIntent(NamedTuple):
+    restaurant: bool          # passes the keyword gate
+    inventory: bool           # explicit stock / quantity question
+    entity: Optional[str]     # ingredient named by an inventory question
+    dish: Optional[str]       # dish named by a recipe question
+    capacity: Optional[str]   # dish named by a "how many can we make" question
+    running_low: bool         # menu-wide "what is about to run out" question
+    cost: Optional[str]       # dish named by a "food cost / margin of X" question
+    margins: bool             # menu-wide "lowest margins" question
+    order: Optional[str]      # horizon of a "what do I need to order" question ("" = default)
+    cover: Optional[str]      # ingredient named by a "how long will X last" question
+    cover_list: bool          # inventory-wide "days of cover" question
+    uses: Optional[str]       # ingredient named by a "which dishes use X" question
+    impact: Optional[str]     # ingredient named by a "what breaks if we run out of X" question
+
+def extract_inventory_entity(ql: str) -> Optional[str]:
+    """Ingredient noun of a lowercased inventory question (very rough heuristic)."""
+    m = INVENTORY_ENTITY_RE.search(ql)
+    if m:
+        for g in m.groups():
+            if g:
+                return g.strip()
+    # fallback: look for known words like water, oil, sugar, flour...
+    found = set(STAPLES_RE.findall(ql))
+    return next((k for k in INVENTORY_STAPLES if k in found), None)
+
+def extract_dish_name(ql: str) -> Optional[str]:
+    """Dish named by a lowercased recipe question."""
+    m = DISH_NAME_RES[0].search(ql) or DISH_NAME_RES[1].search(ql)
+    if m:
+        return m.group(1).strip()
+    # last resort: pick the last wordish phrase
+    m = DISH_VERB_RE.search(ql)
+    if m:
+        return m.group(1).strip()
+    return None
+
+def first_group(patterns: List["re.Pattern"], text: str) -> Optional[str]:
+    """Stripped first group of the first pattern that matches, or None."""
+    for pattern in patterns:
+        m = pattern.search(text)
+        if m:
+            return m.group(1).strip() or None
+    return None
+
+def classify_query(query: str) -> QueryIntent:
+    """Single pass of precompiled patterns over the question: gate, intent and entities."""
+    ql = (query or "").lower()
+    inventory = INVENTORY_RE.search(ql) is not None
+    bare = ql.strip().rstrip("?!. ")
+    uses = first_group(USES_RES, bare)
+    impact = None if uses else first_group(IMPACT_RES, bare)
+    # "what can we make with cheese" is a uses question, not "how many 'with cheese' can we make"
+    capacity = None if uses or impact else first_group(CAPACITY_RES, bare)
+    running_low = RUNNING_LOW_RE.search(ql) is not None
+    cost = first_group(COST_RES, bare)
+    margins = MARGIN_LIST_RE.search(ql) is not None
+    order = None
+    if ORDER_RE.search(ql):
+        m = ORDER_HORIZON_RE.search(ql)
+        order = m.group(0) if m else ""
+    cover = first_group(COVER_RES, bare)
+    cover_list = not cover and COVER_LIST_RE.search(ql) is not None
+    restaurant = (RESTAURANT_RE.search(ql) is not None or bool(capacity) or running_low
+                  or bool(cost) or margins or order is not None or bool(cover) or cover_list
+                  or bool(uses) or bool(impact))
+    return QueryIntent(restaurant, inventory, extract_inventory_entity(ql) if inventory else None,
+                       extract_dish_name(ql), capacity, running_low, cost, margins, order, cover, cover_list,
+                       uses, impact)
+
+class IngredientEntityIndex:
+    """Word index over inventory names for resolving the ingredient an inventory question names.
+
+    Same answer as scanning the names in order for the first one where the candidate is a
+    substring of the name or the name a substring of the candidate, except that matches have
+    to line up with word boundaries ("mato" no longer finds "tomato", nor "tea" "steak").
+    "Name in candidate" becomes dictionary lookups of the candidate's word runs; "candidate in
+    name" walks the shortest word-prefix posting list in order and stops at the first hit."""
+
+    def __init__(self, names: List[str]):
+        self.names = list(names)
+        self.by_words: Dict[str, int] = {}
+        self.by_prefix: Dict[str, List[int]] = {}
+        for pos, name in enumerate(self.names):
+            words = ENTITY_TOKEN_RE.findall(name)
+            self.by_words.setdefault(" ".join(words), pos)
+            for w in set(words):
+                for i in range(1, len(w) + 1):
+                    # Positions are appended in name order, so every posting list stays sorted
+                    self.by_prefix.setdefault(w[:i], []).append(pos)
+
+    def _starts_word(self, cand: str, name: str) -> bool:
+        i = name.find(cand)
+        while i != -1:
+            if i == 0 or not name[i - 1].isalnum():
+                return True
+            i = name.find(cand, i + 1)
+        return False
+
+    def match(self, cand: str) -> Optional[str]:
+        words = ENTITY_TOKEN_RE.findall(cand)
+        if not words:
+            return None
+        # name in cand: some run of the candidate's words is a whole name
+        best = len(self.names)
+        for i in range(len(words)):
+            for j in range(i + 1, len(words) + 1):
+                pos = self.by_words.get(" ".join(words[i:j]))
+                if pos is not None and pos < best:
+                    best = pos
+        # cand in name: every candidate word starts a word of the name
+        postings = min((self.by_prefix.get(w, []) for w in words), key=len)
+        for pos in postings:
+            if pos >= best:
+                break
+            if self._starts_word(cand, self.names[pos]):
+                best = pos
+                break
+        return self.names[best] if best < len(self.names) else None
+
+# Index of the last inventory map seen; snapshots are replaced, never mutated, so identity
+# tells whether it is still current.
+_entity_index: Tuple[Optional[Dict[str, Any]], Optional[IngredientEntityIndex]] = (None, None)
+
+def entity_index_for(inventory_map: Dict[str, Dict[str, Any]]) -> IngredientEntityIndex:
+    global _entity_index
+    cached_map, index = _entity_index
+    if cached_map is not inventory_map or index is None:
+        index = IngredientEntityIndex(list(inventory_map.keys()))
+        _entity_index = (inventory_map, index)
+    return index
+
 # ---------------- Inventory ----------------
 
+def in_stock(doc: Dict[str, Any]) -> bool:
+    """Listed, not marked out of stock by hand, and with something left."""
+    qty = doc.get("currentStock")
+    if qty is None:
+        qty = doc.get("quantity")  # fallback if legacy field exists
+    try:
+        qty = float(qty or 0)
+    except (TypeError, ValueError):
+        qty = 0.0
+    return not doc.get("isManuallyOutOfStock") and qty > 0
+
 def compare_with_inventory(recipe_ings, inventory_map):
     have_all, have_none, missing = True, True, []
     for ing in recipe_ings:
         n = normalize_name(ing.get("name",""))
         if not n: continue
-        if n in inventory_map:
+        doc = inventory_map.get(n)
+        if doc is not None and in_stock(doc):
             have_none = False
         else:
             have_all = False
@@ -404,37 +2049,21 @@ def compare_with_inventory(recipe_ings, inventory_map):
     status = "all" if have_all else ("none" if have_none else "some")
     return status, missing
 
-def handle_inventory_question(query: str, inventory_map: Dict[str, Dict[str, Any]]) -> Optional[str]:
+def handle_inventory_question(query: str, inventory_map: Dict[str, Dict[str, Any]],
+                              intent: Optional[QueryIntent] = None) -> Optional[str]:
     """Handle questions like 'how much water do I have' or 'oil buckets'."""
-    q = query.lower()
-    
+    intent = intent or classify_query(query)
+
     # Only handle explicit inventory questions, not recipe requests
-    if not any(phrase in q for phrase in ["how much", "how many", "buckets", "quantity", "stock", "inventory"]):
+    if not intent.inventory:
         return None
 
-    # extract a candidate noun (very rough heuristic)
-    m = re.search(r"how (?:much|many) ([a-zA-Z\s]+?) do i have|([a-zA-Z\s]+?) buckets|([a-zA-Z\s]+?) quantity", q)
-    cand = None
-    if m:
-        for g in m.groups():
-            if g:
-                cand = g.strip()
-                break
-    if not cand:
-        # fallback: look for known words like water, oil, sugar, flour...
-        for k in ["water", "oil", "flour", "sugar", "salt", "coffee", "tea", "milk", "eggs"]:
-            if k in q:
-                cand = k
-                break
+    cand = intent.entity
     if not cand:
         return None
 
     # find best match in inventory map (contains/startswith)
-    target = None
-    for name in inventory_map.keys():
-        if cand in name or name in cand:
-            target = name
-            break
+    target = entity_index_for(inventory_map).match(cand)
     if not target:
         return f"I couldn't find '{cand}' in the inventory."
 
@@ -446,6 +2075,654 @@ def handle_inventory_question(query: str, inventory_map: Dict[str, Dict[str, Any
     unit = (doc.get("unit") or "unit")
     return f"Inventory: {doc.get('name')} — {qty} {unit}."
 
+# ---------------- Availability ----------------
+
+# Mirrors services/unitUtils.js so portions agree with InventoryService.checkIngredientAvailability
+UNIT_SYNONYMS = {
+    "g": ["g", "gram", "grams"],
+    "kg": ["kg", "kilogram", "kilograms"],
+    "l": ["l", "liter", "liters", "litre", "litres"],
+    "ml": ["ml", "milliliter", "millilitre", "milliliters", "millilitres"],
+    "piece": ["slice", "slices", "bag", "bags", "piece", "pieces", "pc", "pcs", "unit", "units"],
+}
+# Spelling -> Ingredient schema unit; "unit(s)" stays "unit" rather than counting as pieces
+UNIT_ALIASES = {syn: unit for unit, syns in UNIT_SYNONYMS.items() for syn in syns}
+UNIT_ALIASES.update({"unit": "unit", "units": "unit"})
+UNIT_BASES = {"g": ("g", 1.0), "kg": ("g", 1000.0), "ml": ("l", 0.001), "l": ("l", 1.0), "piece": ("piece", 1.0)}
+BASE_CODES = {"g": 0, "l": 1, "piece": 2, "unit": 3}
+
+def normalize_unit(raw_unit: Any) -> str:
+    unit = str(raw_unit or "").strip().lower()
+    if not unit:
+        return "unit"
+    for canonical, synonyms in UNIT_SYNONYMS.items():
+        if unit in synonyms:
+            return canonical
+    return "unit"
+
+def unit_info(raw_unit: Any) -> Tuple[str, float]:
+    """(base unit, factor to base) as in unitUtils.unitInfo."""
+    return UNIT_BASES.get(normalize_unit(raw_unit), ("unit", 1.0))
+
+def convert_to_ingredient_unit(requirement_unit: Any, ingredient_unit: Any, quantity: float) -> float:
+    req_base, req_factor = unit_info(requirement_unit)
+    ing_base, ing_factor = unit_info(ingredient_unit)
+    if req_base == ing_base:
+        return quantity * req_factor / ing_factor
+    # Not convertible with our simple set; assume requirement already matches ingredient unit
+    return quantity
+
+class MenuAvailability:
+    """Max producible portions for every menu item, computed in one vectorized pass.
+
+    The recipe matrix (items x ingredients) is kept in CSR form: per recipe line the
+    ingredient reference, the quantity in its base unit and the base unit itself. It is
+    rebuilt only when the items collection changes (count or newest updatedAt, checked at
+    most every refresh_interval seconds). Stock comes from the inventory snapshot; each new
+    snapshot resolves the references to columns once, and portions are
+    floor(min(stock / need)) per item via np.minimum.reduceat. Ingredients that are missing,
+    marked out of stock by hand or have no stock left give 0 portions; items with no recipe
+    lines are unlimited (inf)."""
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.signature = None
+        self.last_check = 0.0
+        self.version = 0
+        self.item_ids: List[Any] = []
+        self.row_of: Dict[Any, int] = {}
+        self.name_index = IngredientEntityIndex([])
+        self.row_of_name: Dict[str, int] = {}
+        self.item_names: List[str] = []
+        # NumPy arrays, set by the first _load (numpy is imported lazily)
+        self.available = None
+        self.row_start = None
+        self.refs: List[Tuple[Any, str]] = []
+        self.ref_idx = None
+        self.qty = None         # quantity as written on the recipe
+        self.qty_base = None    # quantity in its base unit
+        self.req_base = None
+        self.result = None
+        self.result_key = None
+
+    def _signature(self, items_col):
+        newest = items_col.find_one({}, {"updatedAt": 1}, sort=[("updatedAt", -1)])
+        return items_col.estimated_document_count(), (newest or {}).get("updatedAt")
+
+    def _load(self, items_col) -> None:
+        ids, names, available, row_start = [], [], [], [0]
+        refs, ref_of = [], {}
+        ref_idx, qty, qty_base, req_base = [], [], [], []
+        for doc in items_col.find({}, {"name": 1, "ingredients": 1, "isAvailable": 1}):
+            ids.append(doc["_id"])
+            names.append(doc.get("name") or "")
+            available.append(doc.get("isAvailable", True) is not False)
+            for ing in doc.get("ingredients") or []:
+                if not isinstance(ing, dict):
+                    continue
+                ref = (ing.get("ingredient"), (ing.get("name") or "").strip().lower())
+                if ref[0] is None and not ref[1]:
+                    continue
+                if ref not in ref_of:
+                    ref_of[ref] = len(refs)
+                    refs.append(ref)
+                try:
+                    q = float(ing.get("quantity") or 0)
+                except (TypeError, ValueError):
+                    q = 0.0
+                base, factor = unit_info(ing.get("unit"))
+                ref_idx.append(ref_of[ref])
+                qty.append(q)
+                qty_base.append(q * factor)
+                req_base.append(BASE_CODES[base])
+            row_start.append(len(ref_idx))
+        self.item_ids, self.item_names = ids, names
+        self.row_of = {_id: row for row, _id in enumerate(ids)}
+        # Short forms ("margherita" for "Pizza Margherita") that the fuzzy matcher scores too low
+        self.name_index = IngredientEntityIndex([n.strip().lower() for n in names])
+        self.row_of_name: Dict[str, int] = {}
+        for row, n in enumerate(self.name_index.names):
+            self.row_of_name.setdefault(n, row)
+        self.available = np.array(available, dtype=bool)
+        self.row_start = np.array(row_start, dtype=np.int64)
+        self.refs = refs
+        self.ref_idx = np.array(ref_idx, dtype=np.int64)
+        self.qty = np.array(qty, dtype=float)
+        self.qty_base = np.array(qty_base, dtype=float)
+        self.req_base = np.array(req_base, dtype=np.int8)
+        self.version += 1
+
+    def refresh(self, items_col) -> None:
+        now = time.time()
+        if self.signature is not None and now - self.last_check < self.refresh_interval:
+            return
+        with self.lock:
+            if self.signature is not None and now - self.last_check < self.refresh_interval:
+                return
+            load_numpy()
+            signature = self._signature(items_col)
+            if signature != self.signature:
+                self._load(items_col)
+                self.signature = signature
+            self.last_check = now
+
+    def compute(self, items_col, ingredients_col) -> Dict[str, Any]:
+        """{"portions", "limiting" (column per item, -1 when unlimited), "columns"} for the menu."""
+        self.refresh(items_col)
+        inventory_map = inventory_snapshot.get(ingredients_col)
+        result = self.result
+        if result is not None and self.result_key == (self.version, id(inventory_map)) and result["map"] is inventory_map:
+            return result
+
+        docs = list(inventory_map.values())
+        col_by_id = {d["_id"]: i for i, d in enumerate(docs) if d.get("_id") is not None}
+        col_by_name = {name: i for i, name in enumerate(inventory_map.keys())}
+        stock = np.array([float(d.get("currentStock") if d.get("currentStock") is not None else d.get("quantity") or 0)
+                          for d in docs], dtype=float)
+        out = np.array([bool(d.get("isManuallyOutOfStock")) for d in docs], dtype=bool)
+        infos = [unit_info(d.get("unit")) for d in docs]
+        ing_base = np.array([BASE_CODES[b] for b, _ in infos], dtype=np.int8)
+        ing_factor = np.array([f for _, f in infos], dtype=float)
+
+        col_of_ref = np.array([col_by_id.get(oid, col_by_name.get(name, -1)) if oid is not None
+                               else col_by_name.get(name, -1) for oid, name in self.refs], dtype=np.int64)
+        n_items = len(self.item_ids)
+        portions = np.full(n_items, np.inf)
+        limiting = np.full(n_items, -1, dtype=np.int64)
+        if len(self.ref_idx) and len(docs):
+            cols = col_of_ref[self.ref_idx]
+            found = cols >= 0
+            c = np.where(found, cols, 0)
+            need = np.where(self.req_base == ing_base[c], self.qty_base / ing_factor[c], self.qty)
+            have = np.clip(stock[c], 0, None)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = np.where(need > 0, have / need, np.inf)
+            ratio = np.where(found & ~out[c], ratio, 0.0)
+            # Tolerate float noise such as 0.3 / 0.1 = 2.9999...
+            ratio = np.floor(ratio + 1e-9)
+            counts = np.diff(self.row_start)
+            rows = np.flatnonzero(counts)
+            portions[rows] = np.minimum.reduceat(ratio, self.row_start[rows])
+            # First recipe line that attains each item's minimum is its limiting ingredient
+            line_rows = np.repeat(np.arange(n_items), counts)
+            hit = np.flatnonzero(ratio == portions[line_rows])
+            first_rows, first = np.unique(line_rows[hit], return_index=True)
+            limiting[first_rows] = np.where(found[hit[first]], cols[hit[first]], -2)
+        elif len(self.ref_idx):
+            counts = np.diff(self.row_start)
+            portions[counts > 0] = 0
+            limiting[counts > 0] = -2
+
+        result = {"map": inventory_map, "portions": portions, "limiting": limiting, "columns": docs}
+        self.result, self.result_key = result, (self.version, id(inventory_map))
+        return result
+
+    def _limit_note(self, result, row: int) -> str:
+        col = int(result["limiting"][row])
+        if col == -2:
+            return "an ingredient is not in the inventory"
+        if col < 0:
+            return ""
+        doc = result["columns"][col]
+        if doc.get("isManuallyOutOfStock"):
+            return f"{doc.get('name')} is marked out of stock"
+        qty = doc.get("currentStock")
+        if qty is None:
+            qty = doc.get("quantity")
+        return f"{doc.get('name')}: {qty} {doc.get('unit') or 'unit'} left"
+
+    def find_item_id(self, items_col, dish: str) -> Optional[Any]:
+        """Menu item whose name contains the dish on word boundaries, earliest first."""
+        self.refresh(items_col)
+        name = self.name_index.match(dish.strip().lower())
+        if name is None:
+            return None
+        return self.item_ids[self.row_of_name[name]]
+
+    def portions_reply(self, items_col, ingredients_col, item_id: Any) -> Optional[str]:
+        result = self.compute(items_col, ingredients_col)
+        row = self.row_of.get(item_id)
+        if row is None:
+            # Saved after the last refresh
+            self.last_check = 0.0
+            result = self.compute(items_col, ingredients_col)
+            row = self.row_of.get(item_id)
+            if row is None:
+                return None
+        name = self.item_names[row]
+        portions = result["portions"][row]
+        if not self.available[row]:
+            return f"{name} is marked unavailable on the menu."
+        if np.isinf(portions):
+            return f"{name} has no ingredients recorded, so stock does not limit it."
+        note = self._limit_note(result, row)
+        if portions <= 0:
+            return f"We can't make {name} right now ({note})."
+        return f"We can still make {int(portions)} portion(s) of {name} (limited by {note})."
+
+    def running_low_reply(self, items_col, ingredients_col, threshold: int) -> str:
+        result = self.compute(items_col, ingredients_col)
+        portions = result["portions"]
+        low = np.flatnonzero(self.available & (portions <= threshold))
+        if not len(low):
+            return f"Nothing is about to run out: every dish can still be made more than {threshold} times."
+        low = low[np.argsort(portions[low], kind="stable")]
+        lines = [f"About to run out ({threshold} portions or fewer left):"]
+        for row in low[:15]:
+            note = self._limit_note(result, int(row))
+            lines.append(f"- {self.item_names[row]}: {int(portions[row])}" + (f" ({note})" if note else ""))
+        if len(low) > 15:
+            lines.append(f"...and {len(low) - 15} more.")
+        return "\n".join(lines)
+
+menu_availability = MenuAvailability(ITEM_INDEX_REFRESH)
+
+def singular_forms(dish: str) -> List[str]:
+    """The dish as asked plus a singular guess for its last word ("margheritas" -> "margherita")."""
+    words = dish.split()
+    if not words:
+        return []
+    last = words[-1]
+    if last.endswith("ies") and len(last) > 4:
+        alt = last[:-3] + "y"
+    elif last.endswith(("ches", "shes", "xes", "sses")):
+        alt = last[:-2]
+    elif last.endswith("s") and not last.endswith("ss"):
+        alt = last[:-1]
+    else:
+        return [dish]
+    return [dish, " ".join(words[:-1] + [alt])]
+
+def find_menu_item_id(items_col, dish: str) -> Optional[Any]:
+    """_id of the menu item a question names: exact/fuzzy match first, then word-boundary containment."""
+    forms = singular_forms(dish)
+    for form in forms:
+        found = find_item_in_database(items_col, form)
+        if found:
+            return found["_id"]
+    for form in forms:
+        item_id = menu_availability.find_item_id(items_col, form)
+        if item_id is not None:
+            return item_id
+    return None
+
+def handle_availability_question(intent: QueryIntent, items_col, ingredients_col) -> Optional[str]:
+    """Answer "how many X can we make" / "what's about to 86" from the portions engine."""
+    if items_col is None:
+        return None
+    try:
+        if intent.running_low and not intent.capacity:
+            return menu_availability.running_low_reply(items_col, ingredients_col, LOW_PORTIONS)
+        if intent.capacity:
+            item_id = find_menu_item_id(items_col, intent.capacity)
+            reply = menu_availability.portions_reply(items_col, ingredients_col, item_id) if item_id is not None else None
+            return reply or f"I couldn't find '{intent.capacity}' on the menu."
+    except Exception as e:
+        log("Availability check failed:", e)
+    return None
+
+# ---------------- Dish index ----------------
+
+DISH_INDEX_FIELDS = {"name": 1, "isAvailable": 1, "updatedAt": 1, "ingredients.ingredient": 1, "ingredients.name": 1}
+
+class DishIngredientIndex:
+    """Inverted index ingredient -> menu items, for "which dishes use X" and "what breaks if we
+    run out of X" without scanning every item's ingredients array.
+
+    Items are keyed under each recipe line's ingredient ObjectId and its normalized name
+    (legacy lines may carry only one of them). Built with one projected scan on first use,
+    then kept fresh like ItemNameIndex: items whose updatedAt moved past the newest seen are
+    re-indexed, a count drift (deletes) triggers a full rebuild, and items saved by this
+    process are put() straight away. The fuzzy name matcher is rebuilt only when an ingredient
+    name appears or disappears, not on every re-indexed item."""
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.by_ingredient: Dict[Any, set] = {}
+        self.by_name: Dict[str, set] = {}
+        self.items: Dict[Any, Tuple[str, bool, List[Any], List[str]]] = {}
+        self.names = IngredientEntityIndex([])
+        self.last_updated = None
+        self.last_refresh = 0.0
+        self.built = False
+
+    @staticmethod
+    def _discard(postings: Dict[Any, set], key: Any, item_id: Any) -> bool:
+        """Drop item_id from a posting set; True when that left the key with no items."""
+        items = postings.get(key)
+        if items is None:
+            return False
+        items.discard(item_id)
+        if items:
+            return False
+        del postings[key]
+        return True
+
+    def _unlink(self, item_id: Any) -> set:
+        """Forget an item; returns the names no other item uses."""
+        old = self.items.pop(item_id, None)
+        if old is None:
+            return set()
+        for ing in old[2]:
+            self._discard(self.by_ingredient, ing, item_id)
+        return {name for name in old[3] if self._discard(self.by_name, name, item_id)}
+
+    def _put(self, doc: Dict[str, Any]) -> bool:
+        """(Re-)index one item; True when the set of ingredient names changed."""
+        item_id = doc["_id"]
+        dropped = self._unlink(item_id)
+        added = set()
+        ids, names = [], []
+        for line in doc.get("ingredients") or []:
+            if not isinstance(line, dict):
+                continue
+            ing = line.get("ingredient")
+            name = normalize_name(line.get("name") or "")
+            if ing is not None:
+                ids.append(ing)
+                self.by_ingredient.setdefault(ing, set()).add(item_id)
+            if name:
+                names.append(name)
+                if name not in self.by_name:
+                    added.add(name)
+                self.by_name.setdefault(name, set()).add(item_id)
+        self.items[item_id] = (doc.get("name") or "", doc.get("isAvailable", True) is not False, ids, names)
+        ts = doc.get("updatedAt")
+        if ts is not None and (self.last_updated is None or ts > self.last_updated):
+            self.last_updated = ts
+        # A name dropped and re-added by the same item is no change
+        return bool(dropped ^ added)
+
+    def _rebuild(self, items_col) -> None:
+        self.by_ingredient, self.by_name, self.items, self.last_updated = {}, {}, {}, None
+        for doc in items_col.find({}, DISH_INDEX_FIELDS):
+            self._put(doc)
+        self.names = IngredientEntityIndex(sorted(self.by_name))
+        self.built = True
+
+    def refresh(self, items_col) -> None:
+        now = time.time()
+        if self.built and now - self.last_refresh < self.refresh_interval:
+            return
+        with self.lock:
+            if self.built and now - self.last_refresh < self.refresh_interval:
+                return
+            if not self.built:
+                self._rebuild(items_col)
+            else:
+                query = {"updatedAt": {"$gte": self.last_updated}} if self.last_updated is not None else {}
+                # $gte re-reads the newest item every time; that is cheap, re-matching names is not
+                names_changed = False
+                for doc in items_col.find(query, DISH_INDEX_FIELDS):
+                    names_changed |= self._put(doc)
+                if items_col.estimated_document_count() != len(self.items):
+                    self._rebuild(items_col)
+                elif names_changed:
+                    self.names = IngredientEntityIndex(sorted(self.by_name))
+            self.last_refresh = now
+
+    def put(self, doc: Dict[str, Any]) -> None:
+        """Index an item this process just wrote."""
+        with self.lock:
+            if self.built and self._put(doc):
+                self.names = IngredientEntityIndex(sorted(self.by_name))
+
+    def dishes_using(self, items_col, ingredient_id: Any = None, name: str = "") -> List[Tuple[Any, str, bool]]:
+        """(item _id, name, isAvailable) of every item with a line for the ingredient, by name."""
+        self.refresh(items_col)
+        with self.lock:
+            ids = set(self.by_ingredient.get(ingredient_id, ())) if ingredient_id is not None else set()
+            # Lines named "cheddar cheese" count for "cheese" only through their ObjectId
+            for key in singular_forms(normalize_name(name)):
+                named = self.by_name.get(key) or self.by_name.get(self.names.match(key) or "")
+                if named:
+                    ids |= named
+                    break
+            rows = [(item_id, self.items[item_id][0], self.items[item_id][1]) for item_id in ids if item_id in self.items]
+        return sorted(rows, key=lambda r: r[1].lower())
+
+dish_index = DishIngredientIndex(ITEM_INDEX_REFRESH)
+
+def resolve_ingredient(ingredients_col, cand: str) -> Tuple[Optional[Any], str]:
+    """(_id, display name) of the inventory ingredient a question names; (None, cand) if unknown."""
+    inventory_map = inventory_snapshot.get(ingredients_col)
+    target = None
+    if inventory_map:
+        index = entity_index_for(inventory_map)
+        target = next((t for t in map(index.match, singular_forms(cand)) if t), None)
+    if not target:
+        return None, cand
+    doc = inventory_map[target]
+    return doc.get("_id"), doc.get("name") or target
+
+def handle_dish_index_question(intent: QueryIntent, items_col, ingredients_col) -> Optional[str]:
+    """Answer "which dishes use X" and "what breaks if we run out of X" from the inverted index."""
+    if items_col is None:
+        return None
+    cand = intent.uses or intent.impact
+    try:
+        ingredient_id, name = resolve_ingredient(ingredients_col, cand)
+        rows = dish_index.dishes_using(items_col, ingredient_id, name)
+    except Exception as e:
+        log("Dish index lookup failed:", e)
+        return None
+    if not rows:
+        return f"No dish on the menu uses {name}."
+    on_menu = [r[1] for r in rows if r[2]]
+    off_menu = [r[1] for r in rows if not r[2]]
+    if intent.impact:
+        if not on_menu:
+            return f"Running out of {name} would not affect the menu: {', '.join(off_menu)} already unavailable."
+        text = f"Running out of {name} would take {len(on_menu)} dish(es) off the menu: {', '.join(on_menu)}."
+    else:
+        text = f"Dishes using {name} ({len(rows)}): {', '.join(on_menu) or 'none on the menu right now'}."
+    if off_menu:
+        text += f" Already unavailable: {', '.join(off_menu)}."
+    return text
+
+# ---------------- Costs ----------------
+# Per-portion food cost and margin are materialized by backend/services/costService.js into the
+# itemcosts collection (batch job + refresh on purchases); live computation is only the fallback.
+
+COST_FIELDS = {"name": 1, "price": 1, "ingredients": 1}
+
+def compute_item_cost(item: Dict[str, Any], ingredients_col) -> Dict[str, Any]:
+    """Same figures as CostService.computeItemCost, for items the cost table has not caught up with."""
+    ids = [line.get("ingredient") for line in item.get("ingredients") or [] if line.get("ingredient") is not None]
+    by_id = {d["_id"]: d for d in ingredients_col.find({"_id": {"$in": ids}}, {"name": 1, "unit": 1, "pricePerUnit": 1})} if ids else {}
+    cost, lines = 0.0, []
+    for line in item.get("ingredients") or []:
+        doc = by_id.get(line.get("ingredient"))
+        unit_cost = float((doc or {}).get("pricePerUnit") or 0)
+        qty = float(line.get("quantity") or 0)
+        if doc:
+            qty = convert_to_ingredient_unit(line.get("unit"), doc.get("unit"), qty)
+        cost += qty * unit_cost
+        lines.append({"name": line.get("name") or (doc or {}).get("name") or "", "cost": qty * unit_cost,
+                      "missingPrice": not doc or unit_cost <= 0})
+    price = float(item.get("price") or 0)
+    return {"name": item.get("name"), "price": price, "cost": round(cost, 2), "margin": round(price - cost, 2),
+            "marginPct": round((price - cost) / price * 100, 2) if price > 0 else None, "lines": lines}
+
+def format_item_cost(row: Dict[str, Any]) -> str:
+    name = row.get("name") or "This dish"
+    text = f"Food cost of {name}: {float(row.get('cost') or 0):.2f} per portion."
+    if row.get("price"):
+        text += f" Price {float(row['price']):.2f}, margin {float(row.get('margin') or 0):.2f}"
+        text += f" ({row['marginPct']:.1f}%)." if row.get("marginPct") is not None else "."
+    lines = row.get("lines") or []
+    priced = sorted((l for l in lines if not l.get("missingPrice")), key=lambda l: -float(l.get("cost") or 0))
+    if priced:
+        text += " Biggest costs: " + ", ".join(f"{l.get('name')} {float(l.get('cost') or 0):.2f}" for l in priced[:3]) + "."
+    missing = [l.get("name") for l in lines if l.get("missingPrice")]
+    if missing:
+        text += " No price yet for " + ", ".join(missing) + " (counted as 0)."
+    return text
+
+def handle_cost_question(intent: QueryIntent, items_col, ingredients_col) -> Optional[str]:
+    """Answer "what's the food cost / margin of X" and "lowest margins" from the itemcosts table."""
+    if items_col is None:
+        return None
+    costs_col = items_col.database["itemcosts"]
+    try:
+        if intent.margins and not intent.cost:
+            rows = list(costs_col.find({"price": {"$gt": 0}}, {"name": 1, "cost": 1, "price": 1, "marginPct": 1})
+                        .sort("marginPct", 1).limit(10))
+            if not rows:
+                return "No cost figures yet (run `npm run costs:rebuild`)."
+            out = ["Lowest margins:"]
+            out += [f"- {r.get('name')}: cost {float(r.get('cost') or 0):.2f} / price {float(r.get('price') or 0):.2f}"
+                    f" ({float(r.get('marginPct') or 0):.1f}%)" for r in rows]
+            return "\n".join(out)
+        if intent.cost:
+            item_id = find_menu_item_id(items_col, intent.cost)
+            if item_id is None:
+                return f"I couldn't find '{intent.cost}' on the menu."
+            row = costs_col.find_one({"item": item_id})
+            if row is None:
+                item = items_col.find_one({"_id": item_id}, COST_FIELDS)
+                if item is None:
+                    return None
+                row = compute_item_cost(item, ingredients_col)
+            return format_item_cost(row)
+    except Exception as e:
+        log("Cost lookup failed:", e)
+    return None
+
+# ---------------- Forecast ----------------
+# Consumption forecasts from backend/forecast.py, rebuilt once per service day (02:00 start);
+# stock comes from the live inventory snapshot.
+
+consumption_forecast = None
+_forecast_lock = threading.Lock()
+
+def forecast_cache():
+    """The process-wide ForecastCache, created (and forecast.py imported) on first use."""
+    global consumption_forecast
+    if consumption_forecast is None:
+        with _forecast_lock:
+            if consumption_forecast is None:
+                consumption_forecast = load_forecast().ForecastCache(FORECAST_HISTORY, FORECAST_METHOD,
+                                                                     FORECAST_ALPHA, FORECAST_WINDOW)
+    return consumption_forecast
+
+def forecast_stats() -> Dict[str, Any]:
+    """ForecastCache.stats(), without importing numpy when no forecast was asked for yet."""
+    if consumption_forecast is None:
+        return {"builds": 0, "hits": 0, "ingredients": 0, "serviceDay": None, "lastBuildMs": 0.0}
+    return consumption_forecast.stats()
+
+def format_qty(value: float) -> str:
+    return f"{value:.2f}".rstrip("0").rstrip(".") or "0"
+
+def format_cover(days: float) -> str:
+    if np.isinf(days):
+        return f"over {forecast.COVER_LIMIT} days"
+    return "less than a day" if days < 1 else f"{int(days)} day(s)"
+
+def order_horizon(phrase: str, today: int) -> Tuple[int, str]:
+    """(last service day to cover, label) for the horizon phrase of an order question."""
+    m = ORDER_HORIZON_RE.search(phrase or "")
+    wd = int(forecast.weekday_of(today))
+    if not m:
+        return today + ORDER_DAYS, f"the next {ORDER_DAYS} days"
+    which, span, near, weekday, n = m.groups()
+    if span == "weekend":
+        end = today + (6 - wd)
+        if which == "next" and wd >= 5:
+            end += 7
+        return end, "the weekend (through Sunday)"
+    if span == "week":
+        if which in ("this", "the"):
+            return today + (6 - wd), "this week (through Sunday)"
+        return today + 7, "the next 7 days"
+    if near == "tomorrow":
+        return today + 1, "tomorrow"
+    if near:
+        return today, "today"
+    if weekday:
+        target = forecast.WEEKDAY_NAMES.index(weekday.capitalize())
+        return today + (target - wd) % 7, f"{weekday.capitalize()}"
+    days = max(int(n), 1)
+    return today + days, f"the next {days} days"
+
+def forecast_with_stock(ingredients_col):
+    """(forecast, inventory docs aligned with forecast.ids, stock array, fraction of today left)."""
+    today, today_left = forecast.service_day()
+    tx_col = ingredients_col.database["inventorytransactions"]
+    with stage_metrics.span("forecast"):
+        model, hit = forecast_cache().get(tx_col, today)
+    stage_metrics.cache("forecast", hit)
+    by_id = {doc["_id"]: doc for doc in inventory_snapshot.get(ingredients_col).values()}
+    docs = [by_id.get(ing) for ing in model.ids]
+    stock = np.array([0.0 if doc is None or doc.get("isManuallyOutOfStock")
+                      else float(doc.get("currentStock") or doc.get("quantity") or 0) for doc in docs])
+    return model, docs, stock, today_left
+
+def order_reply(intent: QueryIntent, ingredients_col) -> str:
+    model, docs, stock, today_left = forecast_with_stock(ingredients_col)
+    if not model.ids:
+        return f"No usage recorded in the last {FORECAST_HISTORY} days, so there is nothing to forecast from yet."
+    end, label = order_horizon(intent.order, model.day)
+    plan = model.plan(stock, end, today_left, LEAD_DAYS, SAFETY_Z)
+    rows = np.flatnonzero((plan["order"] > 0) & np.array([doc is not None for doc in docs]))
+    if not len(rows):
+        return f"Nothing to order for {label}: stock covers the forecast for every ingredient."
+    rows = rows[np.argsort(plan["cover"][rows], kind="stable")]
+    lines = [f"To order for {label} (forecast from the last {model.history_days} days of usage):"]
+    for row in rows[:25]:
+        doc = docs[row]
+        unit = doc.get("unit") or "unit"
+        line = (f"- {doc.get('name')}: {format_qty(plan['order'][row])} {unit} (have {format_qty(stock[row])},"
+                f" expect to use {format_qty(plan['need'][row])}, lasts {format_cover(plan['cover'][row])})")
+        if plan["cover"][row] < LEAD_DAYS:
+            line += " - runs out before an order placed now arrives"
+        lines.append(line)
+    if len(rows) > 25:
+        lines.append(f"...and {len(rows) - 25} more.")
+    return "\n".join(lines)
+
+def cover_reply(intent: QueryIntent, ingredients_col) -> str:
+    model, docs, stock, today_left = forecast_with_stock(ingredients_col)
+    plan = model.plan(stock, model.day, today_left, LEAD_DAYS, SAFETY_Z)
+    if intent.cover:
+        inventory_map = inventory_snapshot.get(ingredients_col)
+        target = entity_index_for(inventory_map).match(intent.cover)
+        if not target:
+            return f"I couldn't find '{intent.cover}' in the inventory."
+        doc = inventory_map[target]
+        row = model.row_of.get(doc["_id"])
+        if row is None or model.level[row] <= 0:
+            return f"{doc.get('name')} has no recorded usage in the last {FORECAST_HISTORY} days."
+        unit = doc.get("unit") or "unit"
+        return (f"{doc.get('name')}: {format_qty(stock[row])} {unit} left, enough for {format_cover(plan['cover'][row])}"
+                f" at about {format_qty(model.level[row])} {unit} a day (reorder point {format_qty(plan['reorderPoint'][row])} {unit}).")
+    rows = np.flatnonzero(np.isfinite(plan["cover"]) & np.array([doc is not None for doc in docs]))
+    if not len(rows):
+        return f"Every ingredient with recorded usage has more than {forecast.COVER_LIMIT} days of cover."
+    rows = rows[np.argsort(plan["cover"][rows], kind="stable")]
+    lines = ["Shortest cover at the forecast usage:"]
+    for row in rows[:15]:
+        note = " (below reorder point)" if plan["belowReorder"][row] else ""
+        lines.append(f"- {docs[row].get('name')}: {format_cover(plan['cover'][row])}{note}")
+    return "\n".join(lines)
+
+def handle_forecast_question(intent: QueryIntent, ingredients_col) -> Optional[str]:
+    """Answer "what do I need to order for X" and "how long will X last" from the forecast."""
+    if ingredients_col is None:
+        return None
+    try:
+        load_forecast()
+        if intent.order is not None:
+            return order_reply(intent, ingredients_col)
+        if intent.cover or intent.cover_list:
+            return cover_reply(intent, ingredients_col)
+    except Exception as e:
+        log("Forecast failed:", e)
+    return None
+
 # ---------------- Format answer ----------------
 
 def create_basic_recipe(dish_name: str) -> Dict[str, Any]:
@@ -458,143 +2735,750 @@ def create_basic_recipe(dish_name: str) -> Dict[str, Any]:
         "steps": []
     }
 
-def build_final_answer(recipe, status_tuple):
-    status, missing = status_tuple
-    lines = []
-    lines.append(f"**{recipe.get('name','Recipe')}**")
-    lines.append(f"**Category:** {recipe.get('category','plate').title()}")
+def format_recipe_header(recipe) -> List[str]:
+    return [
+        f"**{recipe.get('name','Recipe')}**",
+        f"**Category:** {recipe.get('category','plate').title()}",
+    ]
 
-    lines.append("\n**Ingredients:**")
-    for ing in recipe.get("ingredients",[]):
+def format_ingredients(ingredients) -> List[str]:
+    lines = ["\n**Ingredients:**"]
+    for ing in ingredients:
         lines.append(f"- {ing['quantity']} {ing['unit']} {ing['name']}")
+    return lines
 
-    lines.append("\n**Preparation Steps:**")
-    for i,s in enumerate(recipe.get("steps",[]),1):
-        lines.append(f"{i}. {s}")
+def format_steps(steps, start: int = 1) -> List[str]:
+    return [f"{i}. {s}" for i, s in enumerate(steps, start)]
 
-    lines.append("\n**Inventory Status:**")
+def format_inventory_status(status_tuple) -> List[str]:
+    status, missing = status_tuple
+    lines = ["\n**Inventory Status:**"]
     if status=="all":
         lines.append("All ingredients are available.")
     elif status=="none":
         lines.append("No ingredients available, reorder required.")
     else:
         lines.append(f"Some ingredients missing: {', '.join(missing)}. You should reorder.")
+    return lines
 
+def build_final_answer(recipe, status_tuple):
+    lines = []
+    lines.extend(format_recipe_header(recipe))
+    lines.extend(format_ingredients(recipe.get("ingredients",[])))
+    lines.append("\n**Preparation Steps:**")
+    lines.extend(format_steps(recipe.get("steps",[])))
+    lines.extend(format_inventory_status(status_tuple))
     return "\n".join(lines)
 
+class AnswerWriter:
+    """Emits the same markdown as build_final_answer, section by section, as each part of
+    the recipe becomes known. The concatenated chunks equal the buffered answer."""
+
+    def __init__(self, emit):
+        self.emit = emit
+        self.parts: List[str] = []
+        self.header_sent = False
+        self.ingredients_sent = False
+        self.steps_sent = 0
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def lines(self, lines: List[str]) -> None:
+        if not lines:
+            return
+        chunk = ("\n" if self.parts else "") + "\n".join(lines)
+        self.parts.append(chunk)
+        self.emit(chunk)
+
+    def progress(self, recipe: Dict[str, Any], ingredients_final: bool) -> None:
+        """Send whatever is newly known, keeping header -> ingredients -> steps order."""
+        if not self.header_sent:
+            if not recipe.get("name"):
+                return
+            self.lines(format_recipe_header(recipe))
+            self.header_sent = True
+        if not self.ingredients_sent:
+            if not ingredients_final:
+                return
+            self.lines(format_ingredients(recipe.get("ingredients", [])) + ["\n**Preparation Steps:**"])
+            self.ingredients_sent = True
+        steps = recipe.get("steps", [])
+        if len(steps) > self.steps_sent:
+            self.lines(format_steps(steps[self.steps_sent:], self.steps_sent + 1))
+            self.steps_sent = len(steps)
+
+    def finish_recipe(self, recipe: Dict[str, Any]) -> None:
+        self.progress(recipe, ingredients_final=True)
+
+    def inventory(self, status_tuple) -> None:
+        self.lines(format_inventory_status(status_tuple))
+
 # ---------------- Main ----------------
 
-def main(user_query: str) -> str:
-    if not any(k in user_query.lower() for k in RESTAURANT_KEYWORDS):
-        return "I only handle restaurant questions (recipes, ingredients, inventory)."
+OFF_TOPIC_REPLY = "I only handle restaurant questions (recipes, ingredients, inventory)."
 
-    # DB
+def connect_collections():
+    """(ingredients_col, items_col) from the shared client, or (None, None) when Mongo is down."""
     try:
-        client = mongo(); client.admin.command('ping')
-        ingredients_col, items_col = get_collections(client)
+        with stage_metrics.span("connect"):
+            return get_collections(get_mongo_client())
     except Exception:
-        ingredients_col, items_col, client = None, None, None
+        return None, None
+
+def recipe_from_item(found: Dict[str, Any]) -> Dict[str, Any]:
+    """Build a recipe object compatible with our structure from an items document"""
+    recipe = {
+        "name": found.get("name"),
+        "category": found.get("category") or guess_category(found.get("name", "")),
+        "instructions": found.get("instructions") or ("\n".join(found.get("steps") or [])),
+        "steps": found.get("steps") or [],
+        # MongoDB stores ingredients as objects with name, quantity, unit
+        "ingredients": []
+    }
+    # Convert MongoDB ingredient docs to structured {name, quantity, unit}
+    structured_ings = []
+    for ing in found.get("ingredients", []) or []:
+        if isinstance(ing, dict):
+            nm = ing.get("name") or ing.get("ingredient") or ""
+            structured_ings.append({
+                "name": nm,
+                "quantity": float(ing.get("quantity") or 0.0),
+                "unit": ing.get("unit") or "unit",
+            })
+        else:
+            structured_ings.append({"name": str(ing), "quantity": 0.0, "unit": "unit"})
+    recipe["ingredients"] = structured_ings
+    return recipe
 
-    inventory_map = fetch_inventory_map(ingredients_col)
-    model = init_gemini()
+def answer_with_inventory(recipe: Dict[str, Any], ingredients_col, add_missing: bool = True) -> str:
+    # Add recipe ingredients to inventory
+    if add_missing:
+        add_ingredients_to_inventory(ingredients_col, recipe.get("ingredients", []))
 
-    # Pure inventory question?
-    inv_reply = handle_inventory_question(user_query, inventory_map)
+    # Inventory check
+    status = compare_with_inventory(recipe.get("ingredients", []), inventory_snapshot.get(ingredients_col))
+    return build_final_answer(recipe, status)
+
+def recipe_is_usable(recipe: Optional[Dict[str, Any]]) -> bool:
+    """Worth showing: has ingredients or steps."""
+    return bool(recipe) and bool(recipe.get("ingredients") or recipe.get("steps"))
+
+def recipe_is_complete(recipe: Optional[Dict[str, Any]], outcome: str) -> bool:
+    """Safe to cache and save as a menu item: both ingredients and steps, and not salvaged
+    from a reply that was cut off."""
+    return bool(recipe) and outcome != "truncated" and bool(recipe.get("ingredients")) and bool(recipe.get("steps"))
+
+INCOMPLETE_RECIPE_NOTE = ("\n_Note: this recipe may be incomplete (the generated answer was cut short), "
+                          "so it was not saved to the menu. Ask again for a full version._")
+
+class Synthesis(NamedTuple):
+    recipe: Optional[Dict[str, Any]]
+    error: Optional[str]  # reply to show when there is no recipe
+    complete: bool        # recipe_is_complete: cached here, and may be saved
+
+def synthesize_recipe(dish: str, model=None) -> Synthesis:
+    """Cached synthesis, else Web search + Gemini synthesis. The model is only resolved
+    (SDKs imported) on a cache miss when not passed in. Only complete recipes are cached;
+    an incomplete one is returned for display with complete=False."""
+    cache_key = normalize_title_for_match(dish)
+    recipe = recipe_cache.get("recipe", cache_key)
+    if recipe is not None:
+        log(f"Recipe cache hit for {dish}")
+        return Synthesis(recipe, None, True)
+
+    if model is None:
+        model = get_gemini_model()
+    if model is None:
+        # No model available - return error message
+        return Synthesis(None, f"Sorry, I couldn't generate a recipe for '{dish}'. The AI service is currently unavailable.", False)
+
+    if ASYNC_PIPELINE:
+        recipe, outcome = asyncio.run(synthesize_recipe_async(dish, model, cache_key))
+    else:
+        recipe, outcome = synthesize_recipe_serial(dish, model, cache_key)
+    if not recipe_is_usable(recipe):
+        # Last resort: return error message
+        return Synthesis(None, f"Sorry, I couldn't generate a recipe for '{dish}'. Please try a different dish or check your internet connection.", False)
+    complete = recipe_is_complete(recipe, outcome)
+    if complete:
+        recipe_cache.put("recipe", cache_key, recipe)
+    else:
+        log(f"Recipe for {dish} is incomplete ({outcome}); not caching or saving it")
+    return Synthesis(recipe, None, complete)
+
+def synthesize_recipe_serial(dish: str, model, cache_key: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """Original one-after-another path: DDG searches, then Gemini, then a Gemini retry.
+    Returns (recipe, parse outcome)."""
+    ddg_snippets = recipe_cache.get("snippets", cache_key)
+    if ddg_snippets is None:
+        ddg_snippets = ddg_search_snippets(dish)
+        if ddg_snippets:
+            recipe_cache.put("snippets", cache_key, ddg_snippets)
+    try:
+        # First try to get recipe from web search
+        if ddg_snippets:
+            return gemini_compose_recipe_from_web(model, dish, ddg_snippets)
+        # If no web results, use Gemini's own knowledge
+        return gemini_compose_recipe_simple(model, dish)
+    except Exception as e:
+        log(f"Web search failed for {dish}: {e}")
+        # If web search fails, use Gemini's own knowledge
+        try:
+            return gemini_compose_recipe_simple(model, dish)
+        except Exception as e2:
+            log(f"Gemini simple recipe failed for {dish}: {e2}")
+            return None, "failed"
+
+async def synthesize_recipe_async(dish: str, model, cache_key: str) -> Tuple[Optional[Dict[str, Any]], str]:
+    """Concurrent synthesis bounded by ASSISTANT_TOTAL_BUDGET; returns (recipe, parse outcome).
+
+    The snippet-free Gemini call starts immediately (when speculative) while the three DDG
+    searches run side by side under ASSISTANT_DDG_TIMEOUT. Once snippets arrive the grounded
+    call starts too, and the first complete recipe wins. Each Gemini call gets
+    ASSISTANT_LLM_TIMEOUT; an incomplete or failed answer waits for the other, and the first
+    usable but incomplete one is the fallback."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + TOTAL_BUDGET
+    stage_deadlines: Dict[Any, float] = {}
+    llm_calls = set()
+
+    def start_llm(fn, *args) -> None:
+        # Run in a copy of this task's context so the call's spans land in the request trace
+        fut = loop.run_in_executor(UPSTREAM_POOL, contextvars.copy_context().run, fn, *args)
+        stage_deadlines[fut] = min(deadline, loop.time() + LLM_TIMEOUT)
+        llm_calls.add(fut)
+
+    simple_started = SPECULATIVE_LLM
+    if SPECULATIVE_LLM:
+        start_llm(gemini_compose_recipe_simple, model, dish)
+
+    search = None
+    ddg_snippets = recipe_cache.get("snippets", cache_key)
+    if ddg_snippets is None:
+        search = asyncio.ensure_future(ddg_search_snippets_async(dish))
+        stage_deadlines[search] = min(deadline, loop.time() + DDG_TIMEOUT)
+    elif ddg_snippets:
+        start_llm(gemini_compose_recipe_from_web, model, dish, ddg_snippets)
+    if search is None and not llm_calls:
+        start_llm(gemini_compose_recipe_simple, model, dish)
+        simple_started = True
+
+    fallback = (None, "failed")
+    try:
+        while llm_calls or search is not None:
+            waiting = llm_calls | ({search} if search is not None else set())
+            timeout = min(stage_deadlines[f] for f in waiting) - loop.time()
+            done = set()
+            if timeout > 0:
+                done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if search is not None and (search in done or stage_deadlines[search] <= loop.time()):
+                ddg_snippets = []
+                if search in done:
+                    ddg_snippets = search.result() or []
+                else:
+                    log(f"DDG search timed out for {dish}")
+                    search.cancel()
+                search = None
+                if ddg_snippets:
+                    recipe_cache.put("snippets", cache_key, ddg_snippets)
+                    start_llm(gemini_compose_recipe_from_web, model, dish, ddg_snippets)
+                elif not simple_started:
+                    start_llm(gemini_compose_recipe_simple, model, dish)
+                    simple_started = True
+
+            for fut in done & llm_calls:
+                llm_calls.discard(fut)
+                try:
+                    recipe, outcome = fut.result()
+                except Exception as e:
+                    log(f"Gemini recipe failed for {dish}: {e}")
+                    continue
+                if recipe_is_complete(recipe, outcome):
+                    return recipe, outcome
+                if fallback[0] is None and recipe_is_usable(recipe):
+                    fallback = (recipe, outcome)
+
+            # Drop calls that overran their own stage deadline
+            now = loop.time()
+            for fut in [f for f in llm_calls if stage_deadlines[f] <= now]:
+                log(f"Gemini call timed out for {dish}")
+                fut.cancel()
+                llm_calls.discard(fut)
+
+            if not llm_calls and search is None and not simple_started and deadline - loop.time() > 0:
+                # Grounded call failed; retry from Gemini's own knowledge
+                start_llm(gemini_compose_recipe_simple, model, dish)
+                simple_started = True
+    finally:
+        for fut in llm_calls:
+            fut.cancel()
+        if search is not None:
+            search.cancel()
+    return fallback
+
+def save_new_recipe(dish: str, recipe: Dict[str, Any], items_col, ingredients_col) -> None:
+    """Add the recipe's ingredients to inventory and save the item, resolving ingredients once.
+    Callers pass only complete recipes (Synthesis.complete)."""
+    if not (recipe and recipe.get("ingredients") and recipe.get("steps")):
+        log(f"Not saving '{dish}': the recipe needs both ingredients and steps")
+        return
+    ingredient_ids = add_ingredients_to_inventory(ingredients_col, recipe.get("ingredients", []))
+    try:
+        item_id = save_item_to_mongo(items_col, ingredients_col, recipe, ingredient_ids)
+        if item_id:
+            log(f"Successfully saved recipe '{dish}' to database with ID: {item_id}")
+        else:
+            log(f"Recipe '{dish}' already exists in database or save was skipped")
+    except Exception as _e:
+        log("Mongo save item failed:", _e)
+
+def answer_new_dish(dish: str, items_col, ingredients_col, model=None) -> str:
+    """Not found in database -> synthesize, save and answer. Concurrent questions about the
+    same dish share one synthesis and one save."""
+    def synthesize_and_save():
+        synthesis = synthesize_recipe(dish, model)
+        if synthesis.complete:
+            save_new_recipe(dish, synthesis.recipe, items_col, ingredients_col)
+        return synthesis
+
+    synthesis, shared = synthesis_flights.do(normalize_title_for_match(dish), synthesize_and_save)
+    recipe = synthesis.recipe
+    if recipe is None:
+        return synthesis.error
+    if shared:
+        log(f"Coalesced request for {dish} onto an in-flight synthesis")
+        recipe = copy.deepcopy(recipe)
+    reply = answer_with_inventory(recipe, ingredients_col, add_missing=False)
+    return reply if synthesis.complete else reply + INCOMPLETE_RECIPE_NOTE
+
+def answer_directly(user_query: str, intent: QueryIntent, items_col, ingredients_col) -> Optional[str]:
+    """Availability, cost, dish-index, forecast and inventory questions answered straight from the database, or None."""
+    if intent.cost or intent.margins:
+        reply = handle_cost_question(intent, items_col, ingredients_col)
+        if reply:
+            return reply
+    if intent.capacity or intent.running_low:
+        reply = handle_availability_question(intent, items_col, ingredients_col)
+        if reply:
+            return reply
+    if intent.uses or intent.impact:
+        reply = handle_dish_index_question(intent, items_col, ingredients_col)
+        if reply:
+            return reply
+    if intent.order is not None or intent.cover or intent.cover_list:
+        reply = handle_forecast_question(intent, ingredients_col)
+        if reply:
+            return reply
+    if intent.inventory:
+        return handle_inventory_question(user_query, inventory_snapshot.get(ingredients_col), intent)
+    return None
+
+def main(user_query: str) -> str:
+    with stage_metrics.request(user_query) as req:
+        return answer_query(user_query, req)
+
+def answer_query(user_query: str, req) -> str:
+    """main() without the request span; req.route records how the question was answered."""
+    intent = classify_query(user_query)
+    if not intent.restaurant:
+        req.route = "offtopic"
+        return OFF_TOPIC_REPLY
+
+    # DB
+    ingredients_col, items_col = connect_collections()
+
+    # Pure inventory / availability question?
+    inv_reply = answer_directly(user_query, intent, items_col, ingredients_col)
     if inv_reply:
+        req.route = "direct"
         return inv_reply
 
-    # Try to detect a dish/recipe name
-    def find_dish_name_from_query(q: str) -> Optional[str]:
-        ql = q.lower()
-        # common patterns
-        m = re.search(r"ingredients of ([a-zA-Z\s]+)", ql) or re.search(r"recipe for ([a-zA-Z\s]+)", ql)
-        if m:
-            return m.group(1).strip()
-        # last resort: pick the last wordish phrase
-        m = re.search(r"(?:make|prepare|cook|bake) ([a-zA-Z\s]+)$", ql)
-        if m:
-            return m.group(1).strip()
-        return None
-
-    dish = find_dish_name_from_query(user_query) or user_query.strip()
+    dish = intent.dish or user_query.strip()
 
     # 1) If dish exists in database -> return it directly
     found = find_item_in_database(items_col, dish)
     if found:
-        # Build a recipe object compatible with our structure
-        recipe = {
-            "name": found.get("name"),
-            "category": found.get("category") or guess_category(found.get("name", "")),
-            "instructions": found.get("instructions") or ("\n".join(found.get("steps") or [])),
-            "steps": found.get("steps") or [],
-            # MongoDB stores ingredients as objects with name, quantity, unit
-            "ingredients": []
-        }
-        # Convert MongoDB ingredient docs to structured {name, quantity, unit}
-        structured_ings = []
-        for ing in found.get("ingredients", []) or []:
-            if isinstance(ing, dict):
-                nm = ing.get("name") or ing.get("ingredient") or ""
-                structured_ings.append({
-                    "name": nm,
-                    "quantity": float(ing.get("quantity") or 0.0),
-                    "unit": ing.get("unit") or "unit",
-                })
+        req.route = "database"
+        return answer_with_inventory(recipe_from_item(found), ingredients_col)
+
+    # 2) Not found in database -> Web search + Gemini synthesis
+    req.route = "synthesized"
+    return answer_new_dish(dish, items_col, ingredients_col)
+
+# ---------------- Streaming ----------------
+
+def stream_synthesized_recipe(dish: str, model, cache_key: str, out: AnswerWriter) -> Synthesis:
+    """Stream a Gemini recipe into out as it is generated; returns the final parsed recipe.
+    Falls back to the buffered pipeline when streaming fails before anything was shown.
+    Only a complete recipe is cached."""
+    started = time.time()
+    ddg_snippets = recipe_cache.get("snippets", cache_key)
+    if ddg_snippets is None:
+        try:
+            ddg_snippets = asyncio.run(asyncio.wait_for(ddg_search_snippets_async(dish), DDG_TIMEOUT))
+        except asyncio.TimeoutError:
+            log(f"DDG search timed out for {dish}")
+            ddg_snippets = []
+        if ddg_snippets:
+            recipe_cache.put("snippets", cache_key, ddg_snippets)
+
+    parser = PartialJSONObject()
+    try:
+        for chunk in gemini_stream_recipe(model, dish, ddg_snippets):
+            parser.feed(chunk)
+            name = parser.value("name")
+            category = parser.value("category")
+            ingredients = parser.value("ingredients")
+            if category is None and (ingredients is not None or parser.has_key("steps")):
+                category = guess_category(dish)
+            out.progress({
+                "name": str(name) if name is not None and category is not None else None,
+                "category": str(category or "plate"),
+                "ingredients": clean_recipe_ingredients(ingredients),
+                "steps": [str(x) for x in parser.array_items("steps")],
+            }, ingredients_final=ingredients is not None)
+            if time.time() - started > TOTAL_BUDGET:
+                log(f"Streaming recipe exceeded the total budget for {dish}")
+                break
+    except Exception as e:
+        log(f"Gemini streaming failed for {dish}: {e}")
+        if not out.header_sent:
+            return synthesize_recipe(dish, model)
+
+    recipe, outcome = parse_gemini_json(parser.text, dish, parser)
+    if not recipe_is_usable(recipe):
+        return Synthesis(None, f"Sorry, I couldn't generate a recipe for '{dish}'. Please try a different dish or check your internet connection.", False)
+    complete = recipe_is_complete(recipe, outcome)
+    if complete:
+        recipe_cache.put("recipe", cache_key, recipe)
+    else:
+        log(f"Streamed recipe for {dish} is incomplete ({outcome}); not caching or saving it")
+    return Synthesis(recipe, None, complete)
+
+def stream_answer(user_query: str, emit) -> str:
+    """Like main(), but hands the markdown answer to emit(text) piece by piece: header and
+    ingredients as soon as they are known, steps as Gemini generates them, and the inventory
+    status last. Returns the full answer (equal to the concatenated pieces)."""
+    with stage_metrics.request(user_query) as req:
+        return stream_answer_traced(user_query, AnswerWriter(emit), req)
+
+def stream_answer_traced(user_query: str, out: AnswerWriter, req) -> str:
+    """stream_answer() without the request span; req.route records how the question was answered."""
+    intent = classify_query(user_query)
+    if not intent.restaurant:
+        req.route = "offtopic"
+        out.lines([OFF_TOPIC_REPLY])
+        return out.text
+
+    ingredients_col, items_col = connect_collections()
+
+    inv_reply = answer_directly(user_query, intent, items_col, ingredients_col)
+    if inv_reply:
+        req.route = "direct"
+        out.lines([inv_reply])
+        return out.text
+
+    dish = intent.dish or user_query.strip()
+
+    found = find_item_in_database(items_col, dish)
+    complete = True
+    if found:
+        req.route = "database"
+        recipe = recipe_from_item(found)
+    else:
+        req.route = "synthesized"
+        cache_key = normalize_title_for_match(dish)
+
+        def synthesize_and_save():
+            # Only the leader streams; coalesced callers render the finished recipe at once
+            recipe = recipe_cache.get("recipe", cache_key)
+            if recipe is not None:
+                synthesis = Synthesis(recipe, None, True)
             else:
-                structured_ings.append({"name": str(ing), "quantity": 0.0, "unit": "unit"})
-        recipe["ingredients"] = structured_ings
+                model = get_gemini_model()
+                if model is None:
+                    return Synthesis(None, f"Sorry, I couldn't generate a recipe for '{dish}'. The AI service is currently unavailable.", False)
+                synthesis = stream_synthesized_recipe(dish, model, cache_key, out)
+            if synthesis.complete:
+                save_new_recipe(dish, synthesis.recipe, items_col, ingredients_col)
+            return synthesis
+
+        synthesis, shared = synthesis_flights.do(cache_key, synthesize_and_save)
+        recipe, complete = synthesis.recipe, synthesis.complete
+        if recipe is None:
+            out.lines([synthesis.error])
+            return out.text
+        if shared:
+            recipe = copy.deepcopy(recipe)
+
+    out.finish_recipe(recipe)
+    if found:
+        add_ingredients_to_inventory(ingredients_col, recipe.get("ingredients", []))
+    out.inventory(compare_with_inventory(recipe.get("ingredients", []), inventory_snapshot.get(ingredients_col)))
+    if not complete:
+        out.lines([INCOMPLETE_RECIPE_NOTE.lstrip("\n")])
+    return out.text
 
-        # Add recipe ingredients to inventory
-        add_ingredients_to_inventory(ingredients_col, recipe["ingredients"])
+# ---------------- Batch ----------------
 
-        status = compare_with_inventory(recipe["ingredients"], inventory_map)
-        return build_final_answer(recipe, status)
+def find_items_in_database_bulk(items_col, dishes: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Resolve many dish names at once: one $in query on nameKey, then the local fuzzy index
+    for the rest and one more $in query to fetch those. Returns {nameKey: item doc}."""
+    if items_col is None:
+        return {}
+    keys = {normalize_title_for_match(d): d for d in dishes if d}
+    keys.pop("", None)
+    if not keys:
+        return {}
+    found = {}
+    for doc in items_col.find({"nameKey": {"$in": list(keys)}}):
+        found[doc.get("nameKey")] = doc
+
+    fuzzy_ids = {}
+    if FUZZY_THRESHOLD > 0:
+        for key, dish in keys.items():
+            if key not in found:
+                hits = item_index.search(items_col, dish, k=1, threshold=FUZZY_THRESHOLD)
+                if hits:
+                    fuzzy_ids[hits[0][1]] = key
+    if fuzzy_ids:
+        for doc in items_col.find({"_id": {"$in": list(fuzzy_ids)}}):
+            found[fuzzy_ids[doc["_id"]]] = doc
+    return found
+
+def main_batch(queries: List[str], on_result=None, workers: Optional[int] = None) -> List[str]:
+    """Answer many questions in one pass. DB hits are resolved together and answered first;
+    web/LLM misses fan out over a bounded thread pool. on_result(index, reply) is called as
+    each answer completes (from worker threads for misses); replies are also returned in
+    input order. The whole batch is traced as one request (route "batch")."""
+    with stage_metrics.request(f"batch of {len(queries)}") as req:
+        req.route = "batch"
+        return answer_batch(queries, on_result, workers)
+
+def answer_batch(queries: List[str], on_result, workers: Optional[int]) -> List[str]:
+    replies: List[Optional[str]] = [None] * len(queries)
+
+    def emit(i: int, reply: str) -> None:
+        replies[i] = reply
+        if on_result is not None:
+            on_result(i, reply)
+
+    pending = []
+    for i, q in enumerate(queries):
+        q = (q or "").strip()
+        intent = classify_query(q)
+        if not intent.restaurant:
+            emit(i, OFF_TOPIC_REPLY)
+        else:
+            pending.append((i, q, intent))
+    if not pending:
+        return replies
 
-    # 2) Not found in database -> Web search + Gemini synthesis
-    ddg_snippets = ddg_search_snippets(dish)
-    if model is not None:
+    ingredients_col, items_col = connect_collections()
+
+    dishes = []
+    for i, q, intent in pending:
+        inv_reply = answer_directly(q, intent, items_col, ingredients_col)
+        if inv_reply:
+            emit(i, inv_reply)
+            continue
+        dishes.append((i, intent.dish or q))
+
+    found = find_items_in_database_bulk(items_col, [d for _, d in dishes])
+    misses = []
+    for i, dish in dishes:
+        doc = found.get(normalize_title_for_match(dish))
+        if doc:
+            emit(i, answer_with_inventory(recipe_from_item(doc), ingredients_col))
+        else:
+            misses.append((i, dish))
+    if not misses:
+        return replies
+
+    def answer_miss(i: int, dish: str) -> None:
         try:
-            # First try to get recipe from web search
-            if ddg_snippets:
-                recipe = gemini_compose_recipe_from_web(model, dish, ddg_snippets)
-            else:
-                # If no web results, use Gemini's own knowledge
-                recipe = gemini_compose_recipe_simple(model, dish)
+            reply = answer_new_dish(dish, items_col, ingredients_col)
         except Exception as e:
-            log(f"Web search failed for {dish}: {e}")
-            # If web search fails, use Gemini's own knowledge
-            try:
-                recipe = gemini_compose_recipe_simple(model, dish)
-            except Exception as e2:
-                log(f"Gemini simple recipe failed for {dish}: {e2}")
-                # Last resort: return error message
-                return f"Sorry, I couldn't generate a recipe for '{dish}'. Please try a different dish or check your internet connection."
-    else:
-        # No model available - return error message
-        return f"Sorry, I couldn't generate a recipe for '{dish}'. The AI service is currently unavailable."
+            log(f"Batch query {i} failed: {e}")
+            reply = f"Sorry, I couldn't process your request for '{dish}'. Please try again or ask about a different dish."
+        emit(i, reply)
 
-    # Always save new recipe to MongoDB and add ingredients to inventory
-    try:
-        item_id = save_item_to_mongo(items_col, ingredients_col, recipe)
-        if item_id:
-            log(f"Successfully saved recipe '{dish}' to database with ID: {item_id}")
-        else:
-            log(f"Recipe '{dish}' already exists in database or save was skipped")
-    except Exception as _e:
-        log("Mongo save item failed:", _e)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers or BATCH_WORKERS, len(misses)))) as pool:
+        for i, dish in misses:
+            pool.submit(contextvars.copy_context().run, answer_miss, i, dish)
+    return replies
 
-    # Add recipe ingredients to MongoDB
-    add_ingredients_to_inventory(ingredients_col, recipe.get("ingredients", []))
+# ---------------- Server mode ----------------
 
-    # Inventory check
-    status = compare_with_inventory(recipe.get("ingredients", []), inventory_map)
-    return build_final_answer(recipe, status)
+def configure_stdio() -> None:
+    for stream in (sys.stdin, sys.stdout):
+        try:
+            stream.reconfigure(encoding="utf-8")
+        except Exception:
+            pass
+
+def exit_process(code: int = 0) -> None:
+    """Flush output and exit without joining UPSTREAM_POOL: a search or model call abandoned at
+    its deadline would otherwise hold the process (and the Node request waiting on it) open."""
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:
+            pass
+    recipe_cache.flush()
+    os._exit(code)
+
+def json_line_writer():
+    """Thread-safe writer of one JSON object per stdout line."""
+    write_lock = threading.Lock()
+
+    def respond(payload: Dict[str, Any]) -> None:
+        line = json.dumps(payload, ensure_ascii=False)
+        with write_lock:
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+    return respond
+
+def metrics_text() -> str:
+    """Prometheus text exposition: stage_metrics plus the coalescing, parsing and MongoDB
+    circuit counters the "stats" and "health" commands report as JSON."""
+    lines = stage_metrics.prometheus()
+    flights = synthesis_flights.stats()
+    lines += prometheus_family("assistant_synthesis_leaders_total", "counter",
+                               "Recipe syntheses actually run.", {"": flights["leaders"]})
+    lines += prometheus_family("assistant_synthesis_coalesced_total", "counter",
+                               "Questions that reused an in-flight synthesis.", {"": flights["coalesced"]})
+    lines += prometheus_family("assistant_synthesis_in_flight", "gauge",
+                               "Syntheses running now.", {"": flights["inFlight"]})
+    parsing = recipe_parse_metrics.stats()
+    lines += prometheus_family("assistant_recipe_parse_total", "counter", "Gemini replies by parse outcome.",
+                               {f'outcome="{k}"': parsing[k] for k in RecipeParseMetrics.OUTCOMES})
+    lines += prometheus_family("assistant_recipe_json_mode_fallbacks_total", "counter",
+                               "Gemini JSON mode rejections.", {"": parsing["jsonModeFallbacks"]})
+    health = mongo_health.snapshot()
+    lines += prometheus_family("assistant_mongo_circuit_open", "gauge",
+                               "1 while MongoDB calls are being skipped.", {"": int(health["state"] != "closed")})
+    lines += prometheus_family("assistant_mongo_failures", "gauge",
+                               "Consecutive MongoDB failures.", {"": health["failures"]})
+    return "\n".join(lines) + "\n"
+
+def serve() -> None:
+    """Long-lived JSON-lines server: one request per stdin line, one response per stdout line.
+    Requests run concurrently on a thread pool and share the warm Mongo/Gemini/DDG clients;
+    responses are written as they finish, so callers must match them by id."""
+    configure_stdio()
+    respond = json_line_writer()
+    recipe_cache.flush_delay = CACHE_FLUSH_DELAY
+
+    def handle(req_id, text: str) -> None:
+        try:
+            respond({"id": req_id, "reply": main(text)})
+        except Exception as e:
+            if DEBUG:
+                traceback.print_exc()
+            respond({"id": req_id, "error": str(e) or e.__class__.__name__})
+
+    def handle_batch(req_id, texts: List[str]) -> None:
+        try:
+            main_batch(texts, lambda i, reply: respond({"id": req_id, "index": i, "reply": reply}))
+            respond({"id": req_id, "done": True})
+        except Exception as e:
+            if DEBUG:
+                traceback.print_exc()
+            respond({"id": req_id, "error": str(e) or e.__class__.__name__})
+
+    def handle_stream(req_id, text: str) -> None:
+        try:
+            stream_answer(text, lambda chunk: respond({"id": req_id, "chunk": chunk}))
+            respond({"id": req_id, "done": True})
+        except Exception as e:
+            if DEBUG:
+                traceback.print_exc()
+            respond({"id": req_id, "error": str(e) or e.__class__.__name__})
+
+    def warm_up() -> None:
+        try:
+            get_mongo_client()
+        except Exception as e:
+            log("Mongo warm-up failed:", e)
+        get_gemini_model()
+        get_ddgs_session()
+
+    item_index.enabled = True
+    pool = ThreadPoolExecutor(max_workers=max(1, SERVER_WORKERS))
+    pool.submit(warm_up)
+    respond({"id": None, "ready": True})
+    try:
+        for raw in sys.stdin:
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                req = json.loads(raw)
+            except Exception:
+                respond({"id": None, "error": "Invalid JSON request"})
+                continue
+            if req.get("cmd") == "stats":
+                respond({"id": req.get("id"), "stats": {"cache": recipe_cache.stats(),
+                                                        "coalescing": synthesis_flights.stats(),
+                                                        "parsing": recipe_parse_metrics.stats(),
+                                                        "forecast": forecast_stats()}})
+                continue
+            if req.get("cmd") == "metrics":
+                respond({"id": req.get("id"), "metrics": metrics_text()})
+                continue
+            if req.get("cmd") == "health":
+                respond({"id": req.get("id"), "health": {"mongo": mongo_health.snapshot()}})
+                continue
+            if req.get("cmd") == "batch":
+                texts = req.get("texts")
+                if not isinstance(texts, list) or not texts:
+                    respond({"id": req.get("id"), "error": "No texts provided"})
+                    continue
+                pool.submit(handle_batch, req.get("id"), [str(t or "") for t in texts])
+                continue
+            text = str(req.get("text") or "").strip()
+            if not text:
+                respond({"id": req.get("id"), "error": "No text provided"})
+                continue
+            if req.get("cmd") == "stream":
+                pool.submit(handle_stream, req.get("id"), text)
+                continue
+            pool.submit(handle, req.get("id"), text)
+    finally:
+        pool.shutdown(wait=True)
+
+def run_batch_cli(path: Optional[str]) -> None:
+    configure_stdio()
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = [line.strip() for line in sys.stdin if line.strip()]
+    respond = json_line_writer()
+    main_batch(queries, lambda i, reply: respond({"index": i, "query": queries[i], "reply": reply}))
+
+stage_metrics.import_seconds = time.perf_counter() - _import_started
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        serve()
+        exit_process(0)
+    if len(sys.argv) > 2 and sys.argv[1] == "--stream":
+        configure_stdio()
+        stream_answer(sys.argv[2].strip(), lambda chunk: (sys.stdout.write(chunk), sys.stdout.flush()))
+        sys.stdout.write("\n")
+        exit_process(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        run_batch_cli(sys.argv[2] if len(sys.argv) > 2 else None)
+        exit_process(0)
     try:
         if len(sys.argv) < 2:
             print("Please provide a user question as a single argument.")
-            sys.exit(1)
+            exit_process(1)
         query = sys.argv[1].strip()
         reply = main(query)
         print(reply)
@@ -607,4 +3491,5 @@ if __name__ == "__main__":
         except Exception:
             query = "Dish"
         print(f"Sorry, I couldn't process your request for '{query}'. Please try again or ask about a different dish.")
-        sys.exit(1)
\ No newline at end of file
+        exit_process(1)
+    exit_process(0)
@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_assistant.py — end-to-end latency of assistant.main() without live DDG / Gemini
+
+Replaces DuckDuckGo and Gemini with in-process fakes (configurable latency, jitter and
+failure rate), seeds mongomock (or a local mongod via --mongo-uri) with a synthetic menu
+and inventory at one or more scales, then fires a mix of questions at the assistant:
+known dishes (DB hit), new dishes (search + LLM + save), inventory questions and
+off-topic questions.
+
+Reports, per scale and concurrency level
+----------------------------------------
+  request latency p50/p95/p99/max, throughput (req/s), errors,
+  per-stage timings (gate, connect, inventory, lookup, search, llm, parse, save),
+  peak memory (process max RSS; Python heap peak with --tracemalloc).
+
+With --json the results are written out; with --baseline a previous --json file is
+compared and the run exits 1 when a request or stage p95 regressed past --tolerance.
+
+Usage
+-----
+  python benchmarks/bench_assistant.py [--scales 100,1000,10000] [--concurrency 1,8]
+      [--requests 200] [--llm-latency 0.2] [--ddg-latency 0.05] [--llm-fail 0] [--ddg-fail 0]
+      [--mongo-uri mongodb://localhost:27017] [--json out.json] [--baseline base.json]
+
+Dependencies: mongomock (pip install mongomock) unless --mongo-uri is given.
+"""
+
+import os, re, sys, json, time, random, inspect, itertools, argparse, threading, tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import assistant  # noqa: E402
+from bench_fuzzy_match import synthetic_menu, percentile  # noqa: E402
+
+STAGES = ["gate", "connect", "inventory", "lookup", "search", "llm", "parse", "save"]
+
+INGREDIENT_WORDS = ["tomato", "onion", "garlic", "basil", "cheddar", "mozzarella", "flour", "sugar",
+                    "salt", "pepper", "olive oil", "butter", "milk", "eggs", "rice", "lettuce",
+                    "cucumber", "lemon", "lime", "cilantro", "paprika", "cumin", "chili", "ginger",
+                    "soy sauce", "honey", "mustard", "mayonnaise", "bread", "potato", "carrot",
+                    "mushroom", "spinach", "yogurt", "cream", "parmesan", "oregano", "thyme"]
+INGREDIENT_KINDS = ["", "fresh", "dried", "smoked", "organic", "frozen", "ground", "sliced", "red", "white"]
+UNITS = ["g", "kg", "l", "ml", "piece", "unit"]
+# Vocabulary disjoint from the synthetic menu, so new-dish questions miss the database
+NEW_DISH_WORDS = ["miso", "kimchi", "harissa", "saffron", "jerk", "laksa", "rendang", "sumac",
+                  "dukkah", "gochujang", "adobo", "berbere", "zaatar", "mole", "yuzu", "tamarind"]
+NEW_DISH_KINDS = ["ramen", "stew", "curry", "dumplings", "tagine", "bibimbap", "porridge",
+                  "casserole", "gratin", "pie", "broth", "skillet", "hotpot", "rolls"]
+OFF_TOPIC = ["what is the weather tomorrow", "tell me a joke", "who won the match yesterday",
+             "translate hello to french"]
+
+class StageTimer:
+    """Thread-safe collection of per-stage durations in milliseconds."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {s: [] for s in STAGES}
+
+    def record(self, stage: str, ms: float) -> None:
+        with self.lock:
+            self.samples[stage].append(ms)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.samples = {s: [] for s in STAGES}
+
+    def summary(self):
+        out = {}
+        with self.lock:
+            for stage, vals in self.samples.items():
+                vals = sorted(vals)
+                out[stage] = {"count": len(vals), "p50": percentile(vals, 50),
+                              "p95": percentile(vals, 95), "p99": percentile(vals, 99)}
+        return out
+
+timer = StageTimer()
+
+def instrument(stage: str, fn):
+    """Wrap a sync or async callable so each call is recorded under stage."""
+    if inspect.iscoroutinefunction(fn):
+        async def async_wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                timer.record(stage, (time.perf_counter() - t0) * 1000)
+        return async_wrapper
+
+    def wrapper(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            timer.record(stage, (time.perf_counter() - t0) * 1000)
+    return wrapper
+
+# ---------------- Fake upstreams ----------------
+
+class FakeLatency:
+    def __init__(self, latency: float, jitter: float, failure_rate: float, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+
+    def wait(self, what: str) -> None:
+        with self.lock:
+            self.calls += 1
+            delay = max(0.0, self.latency * (1 + self.rng.uniform(-self.jitter, self.jitter)))
+            fail = self.rng.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError(f"injected {what} failure")
+
+class FakeDDGS:
+    """Stands in for duckduckgo_search.DDGS: .text() returns recipe-looking rows."""
+
+    def __init__(self, behaviour: FakeLatency):
+        self.behaviour = behaviour
+
+    def text(self, query: str, max_results: int = 4, region: str = "wt-wt"):
+        self.behaviour.wait("DDG")
+        dish = query.split(" recipe")[0].split(" cooking")[0].split(" preparation")[0]
+        return [{"title": f"{dish} recipe #{i + 1}",
+                 "body": f"Ingredients and steps for {dish}: 200 g flour, 2 eggs, bake 20 minutes.",
+                 "href": f"https://example.com/{i}"} for i in range(max_results)]
+
+class FakeGenerativeModel:
+    """Stands in for genai.GenerativeModel: answers with a STRICT JSON recipe for the prompted dish."""
+
+    def __init__(self, behaviour: FakeLatency, seed: int, messy: float = 0.0):
+        self.behaviour = behaviour
+        self.rng = random.Random(seed)
+        self.messy = messy
+
+    def dress(self, text: str) -> str:
+        """Wrap a share of answers the way free-text Gemini replies come back."""
+        if self.rng.random() >= self.messy:
+            return text
+        return self.rng.choice([
+            lambda t: f"Here is the recipe:\n```json\n{t}\n```\nEnjoy!",
+            lambda t: f"Use {{your}} favourite brand. {t} Let me know if you need {{more}}.",
+            lambda t: t[:-1] + ",}" if t.endswith("]}") else t,
+            lambda t: t[:int(len(t) * 0.8)],
+        ])(text)
+
+    def recipe_json(self, prompt) -> str:
+        text = prompt[-1]["parts"][0]["text"] if isinstance(prompt, list) else str(prompt)
+        m = re.search(r"recipe for '([^']+)'", text)
+        dish = m.group(1) if m else "dish"
+        n = 4 + self.rng.randrange(7)
+        return json.dumps({
+            "name": dish.title(),
+            "category": assistant.guess_category(dish),
+            "ingredients": [{"name": self.rng.choice(INGREDIENT_WORDS), "quantity": round(self.rng.uniform(0.1, 500), 1),
+                             "unit": self.rng.choice(UNITS)} for _ in range(n)],
+            "steps": [f"Step {i + 1} for {dish}: cook for {5 + i} minutes at 180C." for i in range(8)],
+        })
+
+    def generate_content(self, prompt, stream: bool = False, generation_config=None):
+        t0 = time.perf_counter()
+        try:
+            self.behaviour.wait("LLM")
+            text = self.recipe_json(prompt)
+            if not generation_config:
+                text = self.dress(text)
+        finally:
+            timer.record("llm", (time.perf_counter() - t0) * 1000)
+        if stream:
+            return [SimpleNamespace(text=text[i:i + 64]) for i in range(0, len(text), 64)]
+        return SimpleNamespace(text=text)
+
+# ---------------- Database ----------------
+
+def open_database(mongo_uri, db_name: str):
+    if mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("mongomock is not installed (pip install mongomock) and no --mongo-uri was given")
+        client = mongomock.MongoClient()
+    client.drop_database(db_name)
+    return client
+
+def ingredient_names(n: int, rng: random.Random):
+    names, seen = [], set()
+    while len(names) < n:
+        name = f"{rng.choice(INGREDIENT_KINDS)} {rng.choice(INGREDIENT_WORDS)}".strip()
+        if len(seen) >= len(INGREDIENT_KINDS) * len(INGREDIENT_WORDS):
+            name = f"{name} {len(names)}"
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+def seed_database(db, n_items: int, rng: random.Random):
+    now = datetime.now(timezone.utc)
+    n_ingredients = max(50, n_items // 2)
+    ing_docs = [{"name": name, "nameKey": assistant.normalize_title_for_match(name),
+                 "unit": rng.choice(UNITS), "currentStock": round(rng.uniform(0, 100), 1),
+                 "pricePerUnit": round(rng.uniform(0.1, 20), 2), "alertThreshold": 10,
+                 "isManuallyOutOfStock": False, "createdAt": now, "updatedAt": now}
+                for name in ingredient_names(n_ingredients, rng)]
+    ing_ids = db["ingredients"].insert_many(ing_docs).inserted_ids
+
+    menu = synthetic_menu(n_items, rng)
+    item_docs = []
+    for name in menu:
+        picks = rng.sample(range(len(ing_docs)), 4 + rng.randrange(7))
+        item_docs.append({
+            "name": name, "nameKey": assistant.normalize_title_for_match(name),
+            "category": assistant.guess_category(name), "price": round(rng.uniform(5, 40), 2),
+            "ingredients": [{"ingredient": ing_ids[j], "name": ing_docs[j]["name"],
+                             "quantity": round(rng.uniform(0.1, 300), 1), "unit": ing_docs[j]["unit"]}
+                            for j in picks],
+            "steps": [f"Step {i + 1}" for i in range(6)], "isAvailable": True, "soldCount": 0,
+            "createdAt": now, "updatedAt": now,
+        })
+    db["items"].insert_many(item_docs)
+    return menu, [d["name"] for d in ing_docs]
+
+# ---------------- Workload ----------------
+
+def build_queries(n: int, menu, ingredients, args, rng: random.Random):
+    pool = [f"{a} {b} {c}" for a in NEW_DISH_WORDS for b in NEW_DISH_WORDS if a != b for c in NEW_DISH_KINDS]
+    # Past the pool size new dishes repeat, and repeats are answered from the saved item
+    new_dishes = itertools.cycle(rng.sample(pool, k=min(n, len(pool))))
+    queries = []
+    for _ in range(n):
+        r = rng.random()
+        if r < args.hit_ratio:
+            queries.append(f"recipe for {rng.choice(menu).lower()}")
+        elif r < args.hit_ratio + args.inventory_ratio:
+            queries.append(f"how much {rng.choice(ingredients)} do i have")
+        elif r < args.hit_ratio + args.inventory_ratio + args.offtopic_ratio:
+            queries.append(rng.choice(OFF_TOPIC))
+        else:
+            queries.append(f"recipe for {next(new_dishes)}")
+    return queries
+
+def reset_assistant(client, db_name: str, mongo_uri) -> None:
+    """Fresh per-process state, as if the daemon had just started against this database."""
+    assistant.MONGO_DB = db_name
+    if mongo_uri:
+        assistant.MONGO_URI = mongo_uri
+        assistant._mongo_client = None
+    else:
+        assistant._mongo_client = client
+    assistant._indexes_ready = False
+    assistant.item_index = assistant.ItemNameIndex(assistant.ITEM_INDEX_REFRESH)
+    assistant.item_index.enabled = not ARGS.one_shot
+    snapshot = assistant.InventorySnapshot(assistant.INVENTORY_MAX_STALENESS, assistant.INVENTORY_RESYNC)
+    snapshot.get = instrument("inventory", snapshot.get)
+    assistant.inventory_snapshot = snapshot
+    assistant.recipe_cache = assistant.RecipeCache(
+        None, assistant.CACHE_SIZE, {"recipe": assistant.RECIPE_TTL, "snippets": assistant.SNIPPET_TTL})
+    assistant.recipe_parse_metrics = assistant.RecipeParseMetrics()
+
+def install_fakes(args) -> tuple:
+    ddg = FakeLatency(args.ddg_latency, args.jitter, args.ddg_fail, args.seed + 1)
+    llm = FakeLatency(args.llm_latency, args.jitter, args.llm_fail, args.seed + 2)
+    session = FakeDDGS(ddg)
+    assistant.DDGS = lambda: session
+    assistant._ddgs_session = session
+    assistant._gemini_model = FakeGenerativeModel(llm, args.seed + 3, args.llm_messy)
+    assistant.JSON_MODE = not args.no_json_mode
+    assistant._gemini_ready = True
+    assistant.AUTO_SAVE_ITEMS = not args.no_save
+    assistant.AUTO_ADD_INGREDIENTS = args.auto_add
+    if args.serial:
+        assistant.ASYNC_PIPELINE = False
+
+    assistant.classify_query = instrument("gate", assistant.classify_query)
+    assistant.connect_collections = instrument("connect", assistant.connect_collections)
+    assistant.find_item_in_database = instrument("lookup", assistant.find_item_in_database)
+    assistant.ddg_search_snippets = instrument("search", assistant.ddg_search_snippets)
+    assistant.ddg_search_snippets_async = instrument("search", assistant.ddg_search_snippets_async)
+    assistant.parse_gemini_json = instrument("parse", assistant.parse_gemini_json)
+    assistant.save_new_recipe = instrument("save", assistant.save_new_recipe)
+    return ddg, llm
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def run_level(queries, concurrency: int):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(q: str):
+        nonlocal errors
+        t0 = time.perf_counter()
+        try:
+            if ARGS.stream:
+                assistant.stream_answer(q, lambda text: None)
+            else:
+                assistant.main(q)
+            ok = True
+        except Exception as e:
+            assistant.log("bench request failed:", e)
+            ok = False
+        ms = (time.perf_counter() - t0) * 1000
+        with lock:
+            latencies.append(ms)
+            if not ok:
+                errors += 1
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, queries))
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        "requests": len(queries), "errors": errors, "wall_s": round(wall, 3),
+        "throughput_rps": round(len(queries) / wall, 2) if wall else 0.0,
+        "latency_ms": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                       "p99": percentile(latencies, 99), "max": latencies[-1] if latencies else 0.0},
+        "parsing": assistant.recipe_parse_metrics.stats(),
+    }
+
+def print_result(res) -> None:
+    lat = res["latency_ms"]
+    print(f"\nscale={res['scale']} items  concurrency={res['concurrency']}  requests={res['requests']}"
+          f"  errors={res['errors']}")
+    print("latency ms:   p50={:.2f} p95={:.2f} p99={:.2f} max={:.2f}".format(lat["p50"], lat["p95"], lat["p99"], lat["max"]))
+    print(f"throughput:   {res['throughput_rps']:.1f} req/s (wall {res['wall_s']:.2f} s)")
+    mem = f"peak RSS {res['peak_rss_mb']:.1f} MB"
+    if res.get("peak_heap_mb") is not None:
+        mem += f", Python heap peak {res['peak_heap_mb']:.1f} MB"
+    print(f"memory:       {mem}")
+    print(f"upstream:     DDG {res['ddg_calls']} calls ({res['ddg_failures']} failed),"
+          f" LLM {res['llm_calls']} calls ({res['llm_failures']} failed)")
+    if res.get("parsing"):
+        print("parsing:      " + ", ".join(f"{k}={v}" for k, v in res["parsing"].items() if v))
+    print(f"{'stage':<10} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for stage in STAGES:
+        s = res["stages"][stage]
+        print(f"{stage:<10} {s['count']:>6} {s['p50']:>9.3f} {s['p95']:>9.3f} {s['p99']:>9.3f}")
+
+def compare_baseline(results, path: str, tolerance: float) -> int:
+    with open(path, "r", encoding="utf-8") as f:
+        baseline = {(r["scale"], r["concurrency"]): r for r in json.load(f)}
+    regressions = []
+    for res in results:
+        base = baseline.get((res["scale"], res["concurrency"]))
+        if not base:
+            continue
+        checks = [("request", base["latency_ms"]["p95"], res["latency_ms"]["p95"])]
+        checks += [(stage, base["stages"][stage]["p95"], res["stages"][stage]["p95"])
+                   for stage in STAGES if base["stages"].get(stage, {}).get("count")]
+        for name, old, new in checks:
+            # Sub-millisecond stages are dominated by noise; only flag meaningful slowdowns
+            if new > old * (1 + tolerance) and new - old > 1.0:
+                regressions.append(f"scale={res['scale']} c={res['concurrency']} {name} p95 {old:.2f} -> {new:.2f} ms")
+    print()
+    if regressions:
+        print(f"Regressions vs {path} (tolerance {tolerance:.0%}):")
+        for line in regressions:
+            print("  " + line)
+        return 1
+    print(f"No p95 regressions vs {path} (tolerance {tolerance:.0%}).")
+    return 0
+
+def main(args) -> int:
+    ddg, llm = install_fakes(args)
+    results = []
+    for scale in args.scales:
+        for concurrency in args.concurrency:
+            rng = random.Random(args.seed)
+            client = open_database(args.mongo_uri, args.db)
+            menu, ingredients = seed_database(client[args.db], scale, rng)
+            reset_assistant(client, args.db, args.mongo_uri)
+            queries = build_queries(args.requests, menu, ingredients, args, rng)
+            timer.reset()
+            ddg.calls = ddg.failures = llm.calls = llm.failures = 0
+            if args.tracemalloc:
+                tracemalloc.start()
+            res = run_level(queries, concurrency)
+            res.update({"scale": scale, "concurrency": concurrency, "stages": timer.summary(),
+                        "peak_rss_mb": round(peak_rss_mb(), 1), "peak_heap_mb": None,
+                        "ddg_calls": ddg.calls, "ddg_failures": ddg.failures,
+                        "llm_calls": llm.calls, "llm_failures": llm.failures})
+            if args.tracemalloc:
+                res["peak_heap_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+                tracemalloc.stop()
+            print_result(res)
+            results.append(res)
+            client.drop_database(args.db)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote {args.json}")
+    if args.baseline:
+        return compare_baseline(results, args.baseline, args.tolerance)
+    return 0
+
+def int_list(s: str):
+    return [int(x) for x in s.split(",") if x.strip()]
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scales", type=int_list, default=[100, 1000, 10000], help="menu sizes to seed")
+    ap.add_argument("--concurrency", type=int_list, default=[1, 8], help="worker threads per run")
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--hit-ratio", type=float, default=0.6, help="share of questions about known dishes")
+    ap.add_argument("--inventory-ratio", type=float, default=0.15)
+    ap.add_argument("--offtopic-ratio", type=float, default=0.05, help="the rest are new dishes")
+    ap.add_argument("--ddg-latency", type=float, default=0.05, help="seconds per fake DDG search")
+    ap.add_argument("--llm-latency", type=float, default=0.2, help="seconds per fake Gemini call")
+    ap.add_argument("--jitter", type=float, default=0.3, help="+/- fraction applied to each latency")
+    ap.add_argument("--ddg-fail", type=float, default=0.0, help="fake DDG failure rate")
+    ap.add_argument("--llm-fail", type=float, default=0.0, help="fake Gemini failure rate")
+    ap.add_argument("--llm-messy", type=float, default=0.0,
+                    help="share of plain-text answers wrapped in prose / fences / trailing commas / cut off")
+    ap.add_argument("--no-json-mode", action="store_true", help="do not ask the fake Gemini for JSON mode")
+    ap.add_argument("--mongo-uri", default=None, help="local mongod instead of mongomock")
+    ap.add_argument("--db", default="assistant_bench", help="database to seed (dropped before and after)")
+    ap.add_argument("--serial", action="store_true", help="use the serial synthesis path")
+    ap.add_argument("--stream", action="store_true", help="drive stream_answer() instead of main()")
+    ap.add_argument("--one-shot", action="store_true", help="skip the in-process item index (CLI mode)")
+    ap.add_argument("--no-save", action="store_true", help="do not save synthesized items")
+    ap.add_argument("--auto-add", action="store_true", help="also upsert recipe ingredients into inventory")
+    ap.add_argument("--tracemalloc", action="store_true", help="track the Python heap peak (slower)")
+    ap.add_argument("--json", default=None, help="write results to this file")
+    ap.add_argument("--baseline", default=None, help="compare p95s against a previous --json file")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown vs baseline")
+    ap.add_argument("--seed", type=int, default=7)
+    ARGS = ap.parse_args()
+    sys.exit(main(ARGS))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_fuzzy_match.py — quality and latency of FuzzyDishMatcher on a synthetic menu
+
+Builds a synthetic menu (default 10k items), then queries it with perturbed versions of
+real names (filler words, typos, hyphens, casing) plus unrelated dishes that must NOT match.
+
+Reports
+-------
+  build time, top-1 accuracy and recall@k on perturbed queries,
+  false-positive rate on unrelated queries, latency p50/p95/p99/max.
+
+Usage
+-----
+  python benchmarks/bench_fuzzy_match.py [--items 10000] [--queries 2000] [--threshold 0.75] [--k 5]
+"""
+
+import os, sys, time, random, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from assistant import FuzzyDishMatcher, FUZZY_THRESHOLD  # noqa: E402
+
+ADJECTIVES = ["spicy", "smoked", "crispy", "grilled", "classic", "double", "garlic", "honey",
+              "truffle", "bbq", "cajun", "lemon", "pesto", "teriyaki", "buffalo", "sweet",
+              "herb", "chipotle", "roasted", "tandoori", "maple", "sesame", "pepper", "ranch"]
+BASES = ["chicken", "beef", "veggie", "mushroom", "shrimp", "salmon", "lamb", "tofu", "pork",
+         "turkey", "halloumi", "falafel", "tuna", "bacon", "steak", "paneer"]
+DISHES = ["burger", "pizza", "wrap", "salad", "sandwich", "pasta", "tacos", "bowl", "fries",
+          "skewers", "risotto", "quesadilla", "noodles", "soup", "flatbread", "melt"]
+FILLERS = [("", ""), ("a ", ""), ("", " please"), ("can i get a ", ""), ("one ", " please"),
+           ("give me the ", "")]
+UNRELATED = ["chocolate fondant", "espresso martini", "sushi platter", "mango lassi",
+             "beef wellington", "crème brûlée", "miso ramen", "eggs benedict", "baklava",
+             "pho bo", "cheesecake slice", "mojito", "kimchi jjigae", "tiramisu", "paella"]
+
+def synthetic_menu(n: int, rng: random.Random):
+    names, seen = [], set()
+    while len(names) < n:
+        parts = [rng.choice(ADJECTIVES), rng.choice(BASES), rng.choice(DISHES)]
+        if rng.random() < 0.5:
+            parts.insert(0, rng.choice(ADJECTIVES))
+        name = " ".join(dict.fromkeys(parts)).title()
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+def typo(word: str, rng: random.Random) -> str:
+    if len(word) < 5:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    op = rng.choice(["drop", "swap", "double"])
+    if op == "drop":
+        return word[:i] + word[i + 1:]
+    if op == "swap":
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word[:i] + word[i] + word[i:]
+
+def perturb(name: str, rng: random.Random) -> str:
+    words = name.lower().split()
+    kind = rng.random()
+    if kind < 0.35:
+        j = rng.randrange(len(words))
+        words[j] = typo(words[j], rng)
+    elif kind < 0.5:
+        return "-".join(words)
+    pre, post = rng.choice(FILLERS)
+    return pre + " ".join(words) + post
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, int(round(p / 100.0 * (len(sorted_vals) - 1))))
+    return sorted_vals[idx]
+
+def run(n_items: int, n_queries: int, threshold: float, k: int, seed: int) -> None:
+    rng = random.Random(seed)
+    names = synthetic_menu(n_items, rng)
+
+    matcher = FuzzyDishMatcher()
+    t0 = time.perf_counter()
+    for i, name in enumerate(names):
+        matcher.add(i, name)
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    targets = [rng.randrange(len(names)) for _ in range(n_queries)]
+    queries = [(perturb(names[t], rng), t) for t in targets]
+    latencies, top1, at_k, answered = [], 0, 0, 0
+    for q, target in queries:
+        t0 = time.perf_counter()
+        res = matcher.search(q, k=k, threshold=threshold)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if res:
+            answered += 1
+            if res[0][1] == target:
+                top1 += 1
+            if any(r[1] == target for r in res):
+                at_k += 1
+
+    false_pos = 0
+    for q in UNRELATED:
+        t0 = time.perf_counter()
+        res = matcher.search(q, k=1, threshold=threshold)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if res:
+            false_pos += 1
+
+    latencies.sort()
+    print(f"items={len(names)} queries={len(queries)} threshold={threshold} k={k}")
+    print(f"build:            {build_ms:.1f} ms ({len(matcher.postings)} trigrams)")
+    print(f"answered:         {answered / len(queries):.1%}")
+    print(f"top-1 accuracy:   {top1 / len(queries):.1%}")
+    print(f"recall@{k}:         {at_k / len(queries):.1%}")
+    print(f"false positives:  {false_pos}/{len(UNRELATED)} unrelated queries matched")
+    print("latency ms:       p50={:.3f} p95={:.3f} p99={:.3f} max={:.3f}".format(
+        percentile(latencies, 50), percentile(latencies, 95),
+        percentile(latencies, 99), latencies[-1]))
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--items", type=int, default=10000)
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--threshold", type=float, default=FUZZY_THRESHOLD)
+    ap.add_argument("--k", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    run(args.items, args.queries, args.threshold, args.k, args.seed)
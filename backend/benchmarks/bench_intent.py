@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_intent.py — agreement and latency of classify_query() / IngredientEntityIndex
+
+Runs a corpus of kitchen questions through the compiled intent stage and through the
+original linear implementation (keyword any(), per-call regexes, scan over every inventory
+name) and reports every question where the two disagree, then times inventory entity
+resolution against both as the ingredient list grows.
+
+Reports
+-------
+  agreement on gate / inventory intent / entity / dish / resolved inventory name,
+  per-question latency p50/p95 for both implementations at each inventory size.
+
+Usage
+-----
+  python benchmarks/bench_intent.py [--sizes 100,1000,10000] [--queries 2000] [--corpus file.txt]
+"""
+
+import os, re, sys, time, random, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import assistant  # noqa: E402
+from bench_fuzzy_match import percentile  # noqa: E402
+from bench_assistant import ingredient_names  # noqa: E402
+
+CORPUS = [
+    "how much water do i have",
+    "How many eggs do I have?",
+    "oil buckets",
+    "how many buckets of oil are left",
+    "tomato quantity",
+    "flour quantity in stock",
+    "what's our stock of sugar",
+    "inventory check for milk and coffee",
+    "how much olive oil do i have",
+    "how much smoked paprika do i have",
+    "how much mato do i have",
+    "recipe for chicken burger",
+    "Recipe for Classic Margherita Pizza",
+    "ingredients of caesar salad",
+    "what are the ingredients of the veggie wrap",
+    "how do i make pancakes",
+    "how to prepare french fries",
+    "can you bake a chocolate cake",
+    "cook spaghetti bolognese",
+    "how do we fry chicken wings",
+    "grill a steak sandwich",
+    "what drinks are on the menu",
+    "best orange juice recipe",
+    "how many burgers sold today",
+    "order status for table 4",
+    "add a new dish to the menu",
+    "boil eggs",
+    "toilet paper inventory",
+    "what is the weather tomorrow",
+    "tell me a joke",
+    "who won the match yesterday",
+    "translate hello to french",
+    "",
+]
+
+# ---------------- Original implementation (before the compiled intent stage) ----------------
+
+def legacy_is_restaurant_question(q: str) -> bool:
+    return any(k in q.lower() for k in assistant.RESTAURANT_KEYWORDS)
+
+def legacy_is_inventory_question(query: str) -> bool:
+    q = query.lower()
+    return any(phrase in q for phrase in ["how much", "how many", "buckets", "quantity", "stock", "inventory"])
+
+def legacy_entity(query: str):
+    q = query.lower()
+    m = re.search(r"how (?:much|many) ([a-zA-Z\s]+?) do i have|([a-zA-Z\s]+?) buckets|([a-zA-Z\s]+?) quantity", q)
+    cand = None
+    if m:
+        for g in m.groups():
+            if g:
+                cand = g.strip()
+                break
+    if not cand:
+        for k in ["water", "oil", "flour", "sugar", "salt", "coffee", "tea", "milk", "eggs"]:
+            if k in q:
+                cand = k
+                break
+    return cand
+
+def legacy_target(cand: str, names):
+    for name in names:
+        if cand in name or name in cand:
+            return name
+    return None
+
+def legacy_dish(q: str):
+    ql = q.lower()
+    m = re.search(r"ingredients of ([a-zA-Z\s]+)", ql) or re.search(r"recipe for ([a-zA-Z\s]+)", ql)
+    if m:
+        return m.group(1).strip()
+    m = re.search(r"(?:make|prepare|cook|bake) ([a-zA-Z\s]+)$", ql)
+    if m:
+        return m.group(1).strip()
+    return None
+
+# ---------------- Checks ----------------
+
+def agreement(corpus, names) -> int:
+    index = assistant.IngredientEntityIndex(names)
+    fields = {"gate": 0, "inventory": 0, "entity": 0, "dish": 0, "target": 0}
+    diffs = []
+    for q in corpus:
+        intent = assistant.classify_query(q)
+        old_inv = legacy_is_inventory_question(q)
+        old_entity = legacy_entity(q) if old_inv else None
+        pairs = {
+            "gate": (legacy_is_restaurant_question(q), intent.restaurant),
+            "inventory": (old_inv, intent.inventory),
+            "entity": (old_entity, intent.entity),
+            "dish": (legacy_dish(q), intent.dish),
+            "target": (legacy_target(old_entity, names) if old_entity else None,
+                       index.match(intent.entity) if intent.entity else None),
+        }
+        for field, (old, new) in pairs.items():
+            if old == new:
+                fields[field] += 1
+            else:
+                diffs.append(f"  {q!r}: {field} {old!r} -> {new!r}")
+    print(f"corpus={len(corpus)} questions, inventory={len(names)} names")
+    for field, ok in fields.items():
+        print(f"  {field:<10} {ok}/{len(corpus)} agree")
+    if diffs:
+        print("disagreements:")
+        print("\n".join(diffs))
+    return len(diffs)
+
+def timing(sizes, n_queries: int, seed: int) -> None:
+    rng = random.Random(seed)
+    print(f"\n{'names':>7} {'build ms':>9} {'old p50':>9} {'old p95':>9} {'new p50':>9} {'new p95':>9}  (us per question)")
+    for size in sizes:
+        names = ingredient_names(size, rng)
+        t0 = time.perf_counter()
+        index = assistant.IngredientEntityIndex(names)
+        build_ms = (time.perf_counter() - t0) * 1000
+        # Mostly names that exist, some that do not (the worst case for the scan)
+        queries = [f"how much {rng.choice(names) if rng.random() < 0.8 else 'unobtainium'} do i have"
+                   for _ in range(n_queries)]
+        old, new = [], []
+        for q in queries:
+            t0 = time.perf_counter()
+            cand = legacy_entity(q) if legacy_is_inventory_question(q) else None
+            if cand:
+                legacy_target(cand, names)
+            old.append((time.perf_counter() - t0) * 1e6)
+            t0 = time.perf_counter()
+            intent = assistant.classify_query(q)
+            if intent.entity:
+                index.match(intent.entity)
+            new.append((time.perf_counter() - t0) * 1e6)
+        old.sort()
+        new.sort()
+        print(f"{size:>7} {build_ms:>9.1f} {percentile(old, 50):>9.1f} {percentile(old, 95):>9.1f}"
+              f" {percentile(new, 50):>9.1f} {percentile(new, 95):>9.1f}")
+
+def int_list(s: str):
+    return [int(x) for x in s.split(",") if x.strip()]
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int_list, default=[100, 1000, 10000])
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--corpus", default=None, help="one question per line (default: built-in corpus)")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    corpus = CORPUS
+    if args.corpus:
+        with open(args.corpus, "r", encoding="utf-8") as f:
+            corpus = [line.rstrip("\n") for line in f]
+    names = ["water", "vegetable oil", "olive oil", "flour", "sugar", "salt", "eggs", "milk",
+             "coffee beans", "tomato", "smoked paprika", "paprika", "mozzarella", "toilet paper"]
+    agreement(corpus, names)
+    timing(args.sizes, args.queries, args.seed)
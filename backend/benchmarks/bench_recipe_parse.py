@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_recipe_parse.py — recovery rate and latency of parse_gemini_json() on messy replies
+
+Builds recipe replies in the shapes Gemini returns without JSON mode (bare object, code
+fence, prose with braces around it, a stray unbalanced '{', trailing commas, cut off
+mid-object, padded with long prose) and runs them through the current parser and through
+the original one (json.loads, then a greedy \\{[\\s\\S]*\\} regex over the whole text).
+
+Reports
+-------
+  per reply shape: usable recipes recovered (old vs new), complete ones the new parser
+  would let be cached and saved, and ingredients kept,
+  per reply size: parse latency p50/p95 for both parsers,
+  the RecipeParseMetrics counters after the run.
+
+Usage
+-----
+  python benchmarks/bench_recipe_parse.py [--replies 300] [--sizes 2,20,200] [--seed 7]
+"""
+
+import os, re, sys, json, time, random, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import assistant  # noqa: E402
+from bench_fuzzy_match import percentile  # noqa: E402
+from bench_assistant import INGREDIENT_WORDS, UNITS  # noqa: E402
+
+PROSE = ("Great choice! This dish is a crowd favourite {chef's tip: rest the dough}. "
+         "Serve it hot and adjust seasoning to taste. ")
+
+# ---------------- Original implementation ----------------
+
+def legacy_parse(txt: str, dish: str):
+    try:
+        data = json.loads(txt)
+    except Exception:
+        m = re.search(r"\{[\s\S]*\}", txt)
+        if m:
+            try:
+                data = json.loads(m.group(0))
+            except Exception:
+                data = {}
+        else:
+            data = {}
+    if not isinstance(data, dict):
+        return {"name": dish, "category": assistant.guess_category(dish), "ingredients": [], "steps": []}
+    return {"name": data.get("name", dish), "category": data.get("category", assistant.guess_category(dish)),
+            "ingredients": assistant.clean_recipe_ingredients(data.get("ingredients", [])),
+            "steps": [str(s) for s in data.get("steps", []) or []]}
+
+# ---------------- Replies ----------------
+
+def recipe_text(rng: random.Random, dish: str) -> str:
+    return json.dumps({
+        "name": dish.title(), "category": rng.choice(["pizza", "Main Course", "dessert"]),
+        "ingredients": [{"name": rng.choice(INGREDIENT_WORDS), "quantity": rng.choice([2, 0.5, "1/2", "1 1/2"]),
+                         "unit": rng.choice(UNITS + ["grams", "tbsp", "cups"])} for _ in range(4 + rng.randrange(6))],
+        "steps": [f"Step {i + 1}: cook for {5 + i} minutes at 180C." for i in range(8)],
+    }, indent=rng.choice([None, 2]))
+
+SHAPES = {
+    "bare": lambda t, pad: t,
+    "fenced": lambda t, pad: f"Here is the recipe:\n```json\n{t}\n```\n{pad}",
+    "prose braces": lambda t, pad: f"{pad}Use {{your}} favourite brand.\n{t}\nNeed {{more}}? Ask!",
+    "unbalanced brace": lambda t, pad: f"Careful with {{ the oven. {pad}\n```json\n{t}\n```",
+    "trailing commas": lambda t, pad: re.sub(r"(\]|\"|\d)(\s*)([}\]])", r"\1,\2\3", t, count=2),
+    "truncated": lambda t, pad: t[:int(len(t) * 0.75)],
+    "no json": lambda t, pad: pad + "Sorry, I cannot help with {that} recipe.",
+}
+
+def agreement(n: int, rng: random.Random) -> None:
+    print(f"{'shape':<18} {'old usable':>11} {'new usable':>11} {'new saved':>11} {'old ings':>9} {'new ings':>9}")
+    for shape, dress in SHAPES.items():
+        old_ok = new_ok = new_saved = old_ings = new_ings = 0
+        for i in range(n):
+            dish = f"dish {i}"
+            reply = dress(recipe_text(rng, dish), PROSE * 3)
+            old = legacy_parse(reply, dish)
+            new, outcome = assistant.parse_gemini_json(reply, dish)
+            old_ok += assistant.recipe_is_usable(old)
+            new_ok += assistant.recipe_is_usable(new)
+            new_saved += assistant.recipe_is_complete(new, outcome)
+            old_ings += len(old["ingredients"])
+            new_ings += len(new["ingredients"]) if new else 0
+        print(f"{shape:<18} {old_ok:>7}/{n:<3} {new_ok:>7}/{n:<3} {new_saved:>7}/{n:<3} {old_ings:>9} {new_ings:>9}")
+
+def timing(sizes, n: int, rng: random.Random) -> None:
+    print(f"\n{'pad KB':>7} {'old p50':>9} {'old p95':>9} {'new p50':>9} {'new p95':>9}  (us per reply, prose-wrapped)")
+    for kb in sizes:
+        pad = PROSE * max(1, kb * 1024 // len(PROSE))
+        replies = [SHAPES["prose braces"](recipe_text(rng, f"dish {i}"), pad) for i in range(n)]
+        old, new = [], []
+        for i, reply in enumerate(replies):
+            t0 = time.perf_counter()
+            legacy_parse(reply, f"dish {i}")
+            old.append((time.perf_counter() - t0) * 1e6)
+            t0 = time.perf_counter()
+            assistant.parse_gemini_json(reply, f"dish {i}")
+            new.append((time.perf_counter() - t0) * 1e6)
+        old.sort()
+        new.sort()
+        print(f"{kb:>7} {percentile(old, 50):>9.0f} {percentile(old, 95):>9.0f}"
+              f" {percentile(new, 50):>9.0f} {percentile(new, 95):>9.0f}")
+
+def int_list(s: str):
+    return [int(x) for x in s.split(",") if x.strip()]
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--replies", type=int, default=300, help="replies per shape / size")
+    ap.add_argument("--sizes", type=int_list, default=[2, 20, 200], help="KB of prose around the JSON")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+    agreement(args.replies, rng)
+    timing(args.sizes, max(10, args.replies // 10), rng)
+    print("\nmetrics:", assistant.recipe_parse_metrics.stats())
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_startup.py — cold-start cost of one-shot questions (python assistant.py "<q>")
+
+Each run is a fresh interpreter started with `python -X importtime` that imports assistant
+and answers one question against a small mongomock inventory and menu (or --mongo-uri),
+the way the Node route spawns the CLI when the daemon is not running.
+
+Reports, per question
+---------------------
+  process wall time, `import assistant` time and answer time (median of --runs),
+  which optional SDKs (google.generativeai, duckduckgo_search) ended up imported,
+  when numpy was imported and what it cost (it loads inside `import assistant` or while
+  answering, so the top-level list below would fold it into its importer),
+  the slowest top-level imports by cumulative time, split into those paid at import and
+  those pulled in while answering.
+
+With --compare-eager every question is also run with the SDKs imported up front, as the
+module did before they were loaded lazily (only meaningful where they are installed).
+
+Usage
+-----
+  python benchmarks/bench_startup.py [--runs 5] [--top 10] [--compare-eager]
+      [--query "how much oil do i have"] [--query "recipe for margherita pizza"]
+      [--mongo-uri mongodb://localhost:27017]
+
+Dependencies: mongomock (pip install mongomock) unless --mongo-uri is given.
+"""
+
+import os, re, sys, json, time, argparse, statistics, subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SDK_MODULES = ["google.generativeai", "duckduckgo_search"]
+# Reported on their own line wherever they sit in the import tree
+TRACKED_MODULES = ["numpy"]
+DEFAULT_QUERIES = ["how much oil do i have", "recipe for margherita pizza"]
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+# ---------------- Child (one cold process) ----------------
+
+def seed(db) -> None:
+    """A few ingredients and one dish: enough for the inventory and DB-hit paths."""
+    names = ["vegetable oil", "olive oil", "flour", "tomato", "mozzarella", "basil", "salt", "water"]
+    ids = db["ingredients"].insert_many([
+        {"name": n, "nameKey": re.sub(r"[\s\-]+", "", n), "unit": "g", "currentStock": 500.0,
+         "pricePerUnit": 0.01, "isManuallyOutOfStock": False} for n in names]).inserted_ids
+    db["items"].insert_one({
+        "name": "Margherita Pizza", "nameKey": "margheritapizza", "category": "pizza", "price": 11.5,
+        "ingredients": [{"ingredient": ids[i], "name": names[i], "quantity": 100, "unit": "g"} for i in (2, 3, 4, 5)],
+        "steps": ["Stretch the dough", "Top", "Bake"], "isAvailable": True,
+    })
+
+def child(args) -> None:
+    client = None
+    if not args.mongo_uri:
+        import mongomock  # before assistant, so its imports are not attributed to answering
+        client = mongomock.MongoClient()
+        seed(client["startup_bench"])
+    if args.eager:
+        for name in SDK_MODULES:
+            try:
+                __import__(name)
+            except Exception:
+                pass
+    sys.path.insert(0, os.path.join(HERE, ".."))
+    t0 = time.perf_counter()
+    import assistant
+    t1 = time.perf_counter()
+    if client is not None:
+        assistant._mongo_client = client
+        assistant.MONGO_DB = "startup_bench"
+    else:
+        assistant.MONGO_URI = args.mongo_uri
+    print("--- answering ---", file=sys.stderr, flush=True)
+    reply = assistant.main(args.query[-1])
+    t2 = time.perf_counter()
+    print(json.dumps({
+        "import_ms": (t1 - t0) * 1000, "answer_ms": (t2 - t1) * 1000, "reply": reply[:80],
+        "sdks": [m for m in SDK_MODULES if m in sys.modules],
+    }))
+
+# ---------------- Parent ----------------
+
+def parse_importtime(stderr: str):
+    """Top-level imports as (module, cumulative us), split at the answering marker, and
+    {tracked module: (phase, cumulative us)} for TRACKED_MODULES at any depth."""
+    at_import, while_answering = [], []
+    tracked = {}
+    bucket, phase = at_import, "import"
+    for line in stderr.splitlines():
+        if line.startswith("--- answering ---"):
+            bucket, phase = while_answering, "answer"
+            continue
+        m = IMPORTTIME_RE.match(line)
+        if not m:
+            continue
+        if m.group(4) in TRACKED_MODULES:
+            tracked[m.group(4)] = (phase, int(m.group(2)))
+        if len(m.group(3)) <= 1:
+            bucket.append((m.group(4), int(m.group(2))))
+    return at_import, while_answering, tracked
+
+def run_once(query: str, eager: bool, args):
+    cmd = [sys.executable, "-X", "importtime", os.path.abspath(__file__), "--child", "--query", query]
+    if eager:
+        cmd.append("--eager")
+    if args.mongo_uri:
+        cmd += ["--mongo-uri", args.mongo_uri]
+    env = dict(os.environ, ASSISTANT_DEBUG="0", ASSISTANT_CACHE_PATH=os.devnull)
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, capture_output=True, text=True, env=env)
+    wall_ms = (time.perf_counter() - t0) * 1000
+    if proc.returncode != 0:
+        sys.exit(f"child failed for {query!r}:\n{proc.stderr[-2000:]}")
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["wall_ms"] = wall_ms
+    result["imports"] = parse_importtime(proc.stderr)
+    return result
+
+def report(query: str, eager: bool, runs, top: int) -> None:
+    med = lambda key: statistics.median(r[key] for r in runs)
+    last = runs[-1]
+    print(f"\n{query!r}{' (eager SDK imports)' if eager else ''}")
+    print(f"  wall {med('wall_ms'):7.1f} ms   import assistant {med('import_ms'):7.1f} ms"
+          f"   answer {med('answer_ms'):7.1f} ms   (median of {len(runs)})")
+    print(f"  SDKs imported: {', '.join(last['sdks']) or 'none'}")
+    print(f"  reply: {last['reply']!r}")
+    at_import, while_answering, tracked = last["imports"]
+    for name in TRACKED_MODULES:
+        if name not in tracked:
+            print(f"  {name}: not imported")
+            continue
+        phase, cumulative = tracked[name]
+        when = "during import assistant" if phase == "import" else "while answering"
+        print(f"  {name}: {cumulative / 1000:.1f} ms, {when}")
+    for title, rows in (("slowest imports", at_import), ("imported while answering", while_answering)):
+        rows = sorted(rows, key=lambda r: -r[1])[:top]
+        if rows:
+            print(f"  {title}:")
+            for name, cumulative in rows:
+                print(f"    {cumulative / 1000:8.1f} ms  {name}")
+
+def main(args) -> int:
+    missing = [m for m in SDK_MODULES if not module_available(m)]
+    if missing:
+        print(f"not installed (their import cost is not measured): {', '.join(missing)}")
+    for query in args.query or DEFAULT_QUERIES:
+        for eager in ([False, True] if args.compare_eager else [False]):
+            report(query, eager, [run_once(query, eager, args) for _ in range(args.runs)], args.top)
+    return 0
+
+def module_available(name: str) -> bool:
+    import importlib.util
+    try:
+        return importlib.util.find_spec(name) is not None
+    except ModuleNotFoundError:
+        return False
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--query", action="append", default=None, help="question to time (repeatable)")
+    ap.add_argument("--runs", type=int, default=5, help="cold processes per question")
+    ap.add_argument("--top", type=int, default=10, help="imports to list per section")
+    ap.add_argument("--compare-eager", action="store_true", help="also time with the SDKs imported up front")
+    ap.add_argument("--mongo-uri", default=None, help="answer against this mongod instead of mongomock")
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--eager", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child:
+        child(args)
+        sys.exit(0)
+    sys.exit(main(args))
@@ -1,4 +1,8 @@
 const Ingredient = require('../models/Ingredient');
+const Item = require('../models/Item');
+const CostService = require('../services/costService');
+const LedgerService = require('../services/ledgerService');
+const DishIndexService = require('../services/dishIndexService');
 
 const createIngredient = async (req, res) => {
   const { name, unit, currentStock, alertThreshold, pricePerUnit } = req.body;
@@ -48,6 +52,13 @@ const updateIngredient = async (req, res) => {
       { new: true, runValidators: true }
     );
     if (!ingredient) return res.status(404).json({ message: 'Ingredient not found' });
+    // Price and unit feed every dish's food cost
+    if (req.body.pricePerUnit !== undefined || req.body.unit !== undefined) {
+      CostService.refreshInBackground('ingredients', [ingredient._id]);
+    }
+    if (req.body.currentStock !== undefined || req.body.isManuallyOutOfStock !== undefined) {
+      DishIndexService.syncInBackground([ingredient._id]);
+    }
     res.json(ingredient);
   } catch (err) {
     res.status(500).json({ message: err.message });
@@ -82,6 +93,7 @@ const updateIngredientStock = async (req, res) => {
     ingredient.currentStock = newStock;
     if (operation === 'add') ingredient.isManuallyOutOfStock = false;
     await ingredient.save();
+    DishIndexService.syncInBackground([ingredient._id]);
 
     // Record inventory transaction for manual stock changes
     try {
@@ -97,6 +109,7 @@ const updateIngredientStock = async (req, res) => {
         notes: operation === 'add' ? 'Manual add via Inventory page' : 'Manual dispose via Inventory page',
       };
       await InventoryTransaction.create(tx);
+      await LedgerService.recordQuietly([tx]);
     } catch (e) {
       // non-fatal
     }
@@ -113,16 +126,31 @@ const toggleManualOutOfStock = async (req, res) => {
     if (!ingredient) return res.status(404).json({ message: 'Ingredient not found' });
     ingredient.isManuallyOutOfStock = !ingredient.isManuallyOutOfStock;
     await ingredient.save();
+    DishIndexService.syncInBackground([ingredient._id]);
     res.json(ingredient);
   } catch (err) {
     res.status(500).json({ message: err.message });
   }
 };
 
+// Menu items whose recipe uses the ingredient (from the in-memory ingredient -> dish index)
+const getIngredientDishes = async (req, res) => {
+  try {
+    const ids = await DishIndexService.itemsUsing([req.params.id]);
+    const items = await Item.find({ _id: { $in: ids } }, { name: 1, category: 1, isAvailable: 1, disabledForStock: 1 })
+      .sort({ name: 1 })
+      .lean();
+    res.json(items);
+  } catch (err) {
+    res.status(500).json({ message: err.message });
+  }
+};
+
 const deleteIngredient = async (req, res) => {
   try {
     const ingredient = await Ingredient.findByIdAndDelete(req.params.id);
     if (!ingredient) return res.status(404).json({ message: 'Ingredient not found' });
+    DishIndexService.syncInBackground([ingredient._id]);
     res.json({ message: 'Ingredient deleted' });
   } catch (err) {
     res.status(500).json({ message: err.message });
@@ -136,5 +164,6 @@ module.exports = {
   updateIngredient,
   updateIngredientStock,
   toggleManualOutOfStock,
+  getIngredientDishes,
   deleteIngredient,
 };
\ No newline at end of file
@@ -1,179 +1,36 @@
 const DailyInventory = require('../models/DailyInventory');
 const InventoryTransaction = require('../models/InventoryTransaction');
 const Ingredient = require('../models/Ingredient');
-
-function normalizeDate(dateInput) {
-  const d = dateInput ? new Date(dateInput) : new Date();
-  // Service day starts at 02:00 local time
-  return new Date(d.getFullYear(), d.getMonth(), d.getDate(), 2, 0, 0, 0);
-}
-
-async function buildDailyFromNow(date) {
-  const start = normalizeDate(date);
-  const end = new Date(start);
-  end.setDate(end.getDate() + 1);
-
-  const ingredients = await Ingredient.find();
-
-  // Aggregate transactions for the day by ingredient
-  const txs = await InventoryTransaction.aggregate([
-    { $match: { date: { $gte: start, $lt: end } } },
-    { $group: {
-      _id: '$ingredient',
-      purchaseQty: { $sum: { $cond: [{ $eq: ['$kind', 'purchase'] }, '$quantity', 0] } },
-      disposeQty: { $sum: { $cond: [{ $eq: ['$kind', 'dispose'] }, '$quantity', 0] } },
-      usageQty: { $sum: { $cond: [{ $eq: ['$kind', 'usage'] }, '$quantity', 0] } },
-    } }
-  ]);
-
-  const idToAgg = new Map(txs.map(t => [String(t._id), t]));
-
-  // Try to find an existing daily record
-  let daily = await DailyInventory.findOne({ date: start });
-  if (daily && daily.finalized) {
-    return daily;
-  }
-  const ingredientMap = new Map();
-  if (daily) {
-    for (const di of daily.ingredients) {
-      ingredientMap.set(String(di.ingredient), di);
-    }
-  }
-
-  // Merge/compose ingredients entries
-  const merged = [];
-  // If there is no daily yet, we need to compute Open for the first time
-  // Prefer previous day's finalized close; otherwise, derive open from current stock and today's net transactions
-  let prevCloseMap = null;
-  if (!daily) {
-    const prev = new Date(start);
-    prev.setDate(prev.getDate() - 1);
-    const prevDaily = await DailyInventory.findOne({ date: prev, finalized: true });
-    if (prevDaily) {
-      prevCloseMap = new Map(prevDaily.ingredients.map(di => [String(di.ingredient), di.closeQty]));
-    } else {
-      prevCloseMap = new Map();
-    }
-  }
-
-  for (const ing of ingredients) {
-    const idStr = String(ing._id);
-    const prev = ingredientMap.get(idStr);
-    const agg = idToAgg.get(idStr);
-    const purchaseQty = agg ? agg.purchaseQty : 0;
-    const disposeQty = agg ? agg.disposeQty : 0;
-    const usageQty = agg ? agg.usageQty : 0;
-    let openQty;
-    if (prev) {
-      openQty = prev.openQty;
-      // Backfill: if a prior snapshot had openQty at 0 (or unset) and there have been no
-      // transactions today yet, initialize open from currentStock so the Open column reflects
-      // the start-of-day inventory status.
-      if (
-        (openQty === 0 || openQty === undefined || openQty === null) &&
-        purchaseQty === 0 && disposeQty === 0 && usageQty === 0 &&
-        (Number(ing.currentStock) || 0) > 0
-      ) {
-        openQty = Number(ing.currentStock) || 0;
-      }
-    } else if (prevCloseMap) {
-      if (prevCloseMap.has(idStr)) {
-        openQty = Number(prevCloseMap.get(idStr)) || 0;
-      } else {
-        // Derive opening from current stock by reversing today's net transactions
-        // open = currentStock - purchases + disposals + usage
-        openQty = Math.max((Number(ing.currentStock) || 0) - purchaseQty + disposeQty + usageQty, 0);
-      }
-    } else {
-      openQty = 0;
-    }
-    const closeQty = Math.max(openQty + purchaseQty - disposeQty - usageQty, 0);
-    merged.push({
-      ingredient: ing._id,
-      name: ing.name,
-      unit: ing.unit,
-      openQty,
-      purchaseQty,
-      disposeQty,
-      usageQty,
-      closeQty,
-    });
-  }
-
-  if (!daily) {
-    daily = await DailyInventory.create({ date: start, ingredients: merged, finalized: false });
-  } else {
-    daily.ingredients = merged;
-    await daily.save();
-  }
-
-  return daily;
-}
+const LedgerService = require('../services/ledgerService');
+const DishIndexService = require('../services/dishIndexService');
 
 // Open the day: snapshot open quantities for all ingredients
 const openDay = async (req, res) => {
   try {
-    const date = normalizeDate(req.body?.date);
-    let daily = await DailyInventory.findOne({ date });
-    if (daily && daily.ingredients?.length) {
-      return res.json(daily);
-    }
-    const ingredients = await Ingredient.find();
-    // Determine previous day's close as today's open when available
-    const prev = new Date(date);
-    prev.setDate(prev.getDate() - 1);
-    const prevDaily = await DailyInventory.findOne({ date: prev, finalized: true });
-    const prevMap = new Map();
-    if (prevDaily) {
-      for (const di of prevDaily.ingredients) {
-        prevMap.set(String(di.ingredient), di.closeQty || 0);
-      }
-    }
-    const entries = ingredients.map(ing => {
-      const prevClose = prevMap.get(String(ing._id));
-      const opening = typeof prevClose === 'number' ? prevClose : ing.currentStock;
-      return {
-        ingredient: ing._id,
-        name: ing.name,
-        unit: ing.unit,
-        openQty: opening,
-        purchaseQty: 0,
-        disposeQty: 0,
-        usageQty: 0,
-        closeQty: opening,
-      };
-    });
-    daily = await DailyInventory.findOneAndUpdate(
-      { date },
-      { $set: { date, ingredients: entries, finalized: false } },
-      { new: true, upsert: true }
-    );
-    return res.json(daily);
+    const date = LedgerService.serviceDay(req.body?.date);
+    await LedgerService.seedDay(date);
+    const daily = await DailyInventory.findOneAndUpdate(
+      { date, openTime: null },
+      { $set: { openTime: new Date() } },
+      { new: true }
+    ) || await DailyInventory.findOne({ date });
+    return res.json(LedgerService.present(daily));
   } catch (err) {
     return res.status(500).json({ message: 'Server error', error: err.message });
   }
 };
 
-// Close the day: compute close quantities and usage
+// Close the day: the ledger is kept current as transactions are written, so closing only freezes it
 const closeDay = async (req, res) => {
   try {
-    const date = normalizeDate(req.body?.date);
-    const start = date;
-    const end = new Date(start);
-    end.setDate(end.getDate() + 1);
-
-    let daily = await DailyInventory.findOne({ date: start });
-    if (!daily) {
-      // If day wasn't explicitly opened, create an opening snapshot first
-      await DailyInventory.create({ date: start, ingredients: [], finalized: false });
-      daily = await DailyInventory.findOne({ date: start });
-    }
-
-    // Rebuild daily based on current state and transactions, then mark finalized
-    const rebuilt = await buildDailyFromNow(start);
-    rebuilt.finalized = true;
-    await rebuilt.save();
-    return res.json(rebuilt);
+    const date = LedgerService.serviceDay(req.body?.date);
+    await LedgerService.seedDay(date);
+    const daily = await DailyInventory.findOneAndUpdate(
+      { date },
+      { $set: { finalized: true, closeTime: new Date() } },
+      { new: true }
+    );
+    return res.json(LedgerService.present(daily));
   } catch (err) {
     return res.status(500).json({ message: 'Server error', error: err.message });
   }
@@ -195,8 +52,9 @@ const disposeIngredient = async (req, res) => {
 
     ing.currentStock -= quantity;
     await ing.save();
+    DishIndexService.syncInBackground([ing._id]);
 
-    await InventoryTransaction.create({
+    const tx = await InventoryTransaction.create({
       ingredient: ing._id,
       quantity: Number(quantity),
       operation: 'subtract',
@@ -206,6 +64,7 @@ const disposeIngredient = async (req, res) => {
       notes: notes || '',
       date: new Date(),
     });
+    await LedgerService.recordQuietly([tx]);
 
     return res.json({ message: 'Disposed successfully', ingredient: ing });
   } catch (err) {
@@ -213,34 +72,54 @@ const disposeIngredient = async (req, res) => {
   }
 };
 
-// Get daily report (builds/updates snapshot for the date)
+// Get daily report: the stored ledger for the date; past days missing one are built from
+// their transactions once (and finalized), today's is seeded on first view and picks up
+// ingredients created since
 const getDaily = async (req, res) => {
   try {
-    const date = normalizeDate(req.query?.date);
-    const todayStart = normalizeDate(new Date());
-    const existing = await DailyInventory.findOne({ date });
+    const date = LedgerService.serviceDay(req.query?.date);
+    const today = LedgerService.serviceDayOf(new Date());
+    let daily = await DailyInventory.findOne({ date });
 
-    let daily;
-    if (existing && existing.finalized) {
-      daily = existing;
-    } else {
-      daily = await buildDailyFromNow(date);
-      // Auto-finalize past days (date strictly before today's service day start)
-      if (date.getTime() < todayStart.getTime()) {
-        if (!daily.finalized) {
-          daily.finalized = true;
-          await daily.save();
-        }
+    if (!daily || !daily.ingredients.length) {
+      if (date < today) {
+        await LedgerService.backfill(date, date);
+      } else {
+        await LedgerService.seedDay(date);
       }
+      daily = await DailyInventory.findOne({ date });
+    } else if (date >= today && !daily.finalized && await LedgerService.addMissingRows(date, daily)) {
+      daily = await DailyInventory.findOne({ date });
+    }
+    // Auto-finalize past days (date strictly before today's service day start)
+    if (date < today && !daily.finalized) {
+      daily.finalized = true;
+      await daily.save();
     }
 
-    return res.json(daily);
+    return res.json(LedgerService.present(daily));
   } catch (err) {
     return res.status(500).json({ message: 'Server error', error: err.message });
   }
 };
 
-module.exports = { openDay, closeDay, disposeIngredient, getDaily };
-
-
+// Weekly or monthly totals built from the stored daily ledgers: ?from=YYYY-MM-DD&to=YYYY-MM-DD&period=week|month
+const getRollup = async (req, res) => {
+  try {
+    const period = req.query?.period || 'week';
+    if (!['week', 'month'].includes(period)) {
+      return res.status(400).json({ message: 'period must be "week" or "month"' });
+    }
+    const to = req.query?.to ? new Date(req.query.to) : new Date();
+    const from = req.query?.from ? new Date(req.query.from) : LedgerService.addDays(to, period === 'month' ? -90 : -28);
+    if (Number.isNaN(from.getTime()) || Number.isNaN(to.getTime()) || from > to) {
+      return res.status(400).json({ message: 'from and to must be dates with from <= to' });
+    }
+    const periods = await LedgerService.rollup(from, to, period);
+    return res.json({ period, from: LedgerService.serviceDay(from), to: LedgerService.serviceDay(to), periods });
+  } catch (err) {
+    return res.status(500).json({ message: 'Server error', error: err.message });
+  }
+};
 
+module.exports = { openDay, closeDay, disposeIngredient, getDaily, getRollup };
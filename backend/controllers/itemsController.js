@@ -1,5 +1,8 @@
 const Item = require('../models/Item');
 const Ingredient = require('../models/Ingredient');
+const ItemCost = require('../models/ItemCost');
+const CostService = require('../services/costService');
+const DishIndexService = require('../services/dishIndexService');
 
 const createItem = async (req, res) => {
   try {
@@ -42,6 +45,8 @@ const createItem = async (req, res) => {
       instructions: typeof instructions === 'string' ? instructions : ''
     });
     await newItem.save();
+    CostService.refreshInBackground('items', [newItem._id]);
+    DishIndexService.upsertItem(newItem);
 
     res.status(201).json(newItem);
   } catch (error) {
@@ -69,6 +74,25 @@ const getItems = async (req, res) => {
   }
 };
 
+// Precomputed per-portion food cost and margin of every menu item (see services/costService.js)
+const getItemCosts = async (req, res) => {
+  try {
+    const costs = await ItemCost.find({}).sort({ marginPct: 1 }).lean();
+    res.json(costs);
+  } catch (error) {
+    res.status(500).json({ message: 'Server error', error: error.message });
+  }
+};
+
+const rebuildItemCosts = async (req, res) => {
+  try {
+    const result = await CostService.rebuildAll();
+    res.json(result);
+  } catch (error) {
+    res.status(500).json({ message: 'Server error', error: error.message });
+  }
+};
+
 const getItemById = async (req, res) => {
   try {
     const item = await Item.findById(req.params.id);
@@ -93,7 +117,11 @@ const updateItem = async (req, res) => {
     if (name) item.name = name;
     if (category) item.category = category;
     if (price !== undefined) item.price = price;
-    if (typeof isAvailable === 'boolean') item.isAvailable = isAvailable;
+    if (typeof isAvailable === 'boolean') {
+      item.isAvailable = isAvailable;
+      // A manager's choice is never undone by stock changes
+      item.disabledForStock = false;
+    }
     if (Array.isArray(ingredients)) {
       // Validate provided ingredients
       for (const ing of ingredients) {
@@ -113,6 +141,10 @@ const updateItem = async (req, res) => {
     if (typeof instructions === 'string') item.instructions = instructions;
 
     await item.save();
+    if (price !== undefined || Array.isArray(ingredients) || name) {
+      CostService.refreshInBackground('items', [item._id]);
+    }
+    if (Array.isArray(ingredients)) DishIndexService.upsertItem(item);
 
     res.json(item);
   } catch (error) {
@@ -162,6 +194,8 @@ const deleteItem = async (req, res) => {
     }
 
     await item.deleteOne();
+    await ItemCost.deleteOne({ item: item._id });
+    DishIndexService.removeItem(item._id);
     res.json({ message: 'Item removed' });
   } catch (error) {
     res.status(500).json({ message: 'Server error', error: error.message });
@@ -172,6 +206,8 @@ module.exports = {
   createItem,
   getItems,
   getItemById,
+  getItemCosts,
+  rebuildItemCosts,
   updateItem,
   updateItemStock,
   deleteItem
@@ -1,5 +1,4 @@
 const Order = require('../models/Order');
-const Item = require('../models/Item');
 const InventoryService = require('../services/inventoryService');
 
 exports.createOrder = async (req, res) => {
@@ -13,28 +12,20 @@ exports.createOrder = async (req, res) => {
     let totalPrice = 0;
     const orderItems = [];
 
+    // Resolve every line's item at once (by ID, else by name)
+    const itemDocs = await InventoryService.resolveOrderItems(items);
+    const resolvedDocs = [];
+
     // Process each item and calculate total price
-    for (const ordered of items) {
-      let itemData;
-      
-      // Try to find item by ID first
-      if (ordered.item) {
-        itemData = await Item.findById(ordered.item);
-      }
-      
-      // If not found by ID, try to find by name
-      if (!itemData && ordered.name) {
-        itemData = await Item.findOne({ 
-          name: { $regex: new RegExp(ordered.name, 'i') } 
-        });
-      }
+    items.forEach((ordered, i) => {
+      const itemData = itemDocs[i];
 
-      // If still no item found, we'll create a virtual item for pricing
+      // If no item found, we'll create a virtual item for pricing
       if (!itemData) {
         // Use a default price or get from recipe if available
         const defaultPrice = ordered.priceAtSale || 0;
         totalPrice += defaultPrice * ordered.quantity;
-        
+
         orderItems.push({
           item: null, // No item ID since it doesn't exist
           name: ordered.name,
@@ -52,10 +43,11 @@ exports.createOrder = async (req, res) => {
           priceAtSale
         });
       }
-    }
+      resolvedDocs.push(itemData);
+    });
 
     // Process inventory before creating the order
-    const inventoryResult = await InventoryService.processOrderInventory(orderItems);
+    const inventoryResult = await InventoryService.processOrderInventory(orderItems, resolvedDocs);
     
     if (!inventoryResult.success) {
       return res.status(400).json({ 
@@ -1,6 +1,9 @@
 const Payment = require('../models/Payment');
 const User = require('../models/User');
 const mongoose = require('mongoose');
+const CostService = require('../services/costService');
+const LedgerService = require('../services/ledgerService');
+const DishIndexService = require('../services/dishIndexService');
 
 const createPayment = async (req, res) => {
   try {
@@ -136,6 +139,11 @@ const createPayment = async (req, res) => {
           );
         }
 
+        // Purchase prices feed pricePerUnit: re-cost the dishes that use these ingredients
+        CostService.refreshInBackground('ingredients', enriched.map(line => line.ingredient));
+        // Restocked ingredients bring back dishes that were switched off for lack of them
+        DishIndexService.syncInBackground(enriched.map(line => line.ingredient));
+
         // Log inventory transactions for purchases
         try {
           const InventoryTransaction = require('../models/InventoryTransaction');
@@ -151,6 +159,7 @@ const createPayment = async (req, res) => {
           }));
           if (txDocs.length) {
             await InventoryTransaction.insertMany(txDocs);
+            await LedgerService.recordQuietly(txDocs);
           }
         } catch (e) {
           // non-fatal
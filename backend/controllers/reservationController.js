@@ -1,4 +1,9 @@
 const Reservation = require('../models/Reservation');
+const ReservationSlotService = require('../services/reservationSlotService');
+
+const STATUSES = ['pending', 'confirmed', 'cancelled', 'completed', 'waitlisted'];
+
+const escapeRegex = (s) => String(s).replace(/[.*+?^${}()|[\]\\]/g, '\\$&');
 
 // Get all reservations with optional filtering
 exports.getReservations = async (req, res) => {
@@ -19,9 +24,9 @@ exports.getReservations = async (req, res) => {
       filter.status = status;
     }
 
-    // Email filter
+    // Email filter: addresses are stored lowercase, so an anchored prefix can use the index
     if (email) {
-      filter.emailAddress = { $regex: new RegExp(email, 'i') };
+      filter.emailAddress = { $regex: new RegExp(`^${escapeRegex(String(email).trim().toLowerCase())}`) };
     }
 
     const reservations = await Reservation.find(filter)
@@ -58,7 +63,8 @@ exports.createReservation = async (req, res) => {
       emailAddress,
       date,
       numberOfGuests,
-      comments
+      comments,
+      waitlist
     } = req.body;
 
     // Validate required fields
@@ -88,7 +94,31 @@ exports.createReservation = async (req, res) => {
       comments: comments || ''
     });
 
-    const savedReservation = await newReservation.save();
+    // Take the seats first; a full slot rejects the booking (or waitlists it when asked to)
+    const delta = ReservationSlotService.diff(null, newReservation);
+    try {
+      await ReservationSlotService.applyDelta(delta);
+    } catch (err) {
+      if (!ReservationSlotService.isSlotFull(err)) throw err;
+      if (waitlist === true) {
+        newReservation.status = 'waitlisted';
+        const waitlisted = await newReservation.save();
+        return res.status(201).json(waitlisted);
+      }
+      const alternatives = await ReservationSlotService.nextFree(numberOfGuests, reservationDate, 3);
+      return res.status(409).json({
+        message: `No table for ${numberOfGuests} guests at that time`,
+        alternatives
+      });
+    }
+
+    let savedReservation;
+    try {
+      savedReservation = await newReservation.save();
+    } catch (err) {
+      await ReservationSlotService.applyDelta(ReservationSlotService.negate(delta));
+      throw err;
+    }
     res.status(201).json(savedReservation);
   } catch (error) {
     console.error('Error creating reservation:', error);
@@ -102,19 +132,35 @@ exports.updateReservationStatus = async (req, res) => {
     const { status } = req.body;
     const { id } = req.params;
 
-    if (!status || !['pending', 'confirmed', 'cancelled', 'completed'].includes(status)) {
+    if (!status || !STATUSES.includes(status)) {
       return res.status(400).json({ message: 'Valid status is required' });
     }
 
-    const reservation = await Reservation.findByIdAndUpdate(
-      id,
+    const current = await Reservation.findById(id).lean();
+    if (!current) {
+      return res.status(404).json({ message: 'Reservation not found' });
+    }
+
+    // Seats follow the status: cancelling releases them, (re)activating has to find room
+    const delta = ReservationSlotService.diff(current, { ...current, status });
+    try {
+      await ReservationSlotService.applyDelta(delta);
+    } catch (err) {
+      if (!ReservationSlotService.isSlotFull(err)) throw err;
+      return res.status(409).json({ message: 'Not enough seats left at that time' });
+    }
+
+    // Only if nobody changed the status meanwhile; otherwise the seat change is undone
+    const reservation = await Reservation.findOneAndUpdate(
+      { _id: id, status: current.status },
       { status },
       { new: true, runValidators: true }
     );
-
     if (!reservation) {
-      return res.status(404).json({ message: 'Reservation not found' });
+      await ReservationSlotService.applyDelta(ReservationSlotService.negate(delta));
+      return res.status(409).json({ message: 'Reservation was changed by someone else, please retry' });
     }
+    if ([...delta.values()].some((g) => g < 0)) ReservationSlotService.promoteInBackground(current);
 
     res.json(reservation);
   } catch (error) {
@@ -132,15 +178,43 @@ exports.updateReservation = async (req, res) => {
     // Remove status from update data if present (use separate endpoint for status)
     delete updateData.status;
 
-    const reservation = await Reservation.findByIdAndUpdate(
-      id,
-      updateData,
-      { new: true, runValidators: true }
-    );
+    const current = await Reservation.findById(id).lean();
+    if (!current) {
+      return res.status(404).json({ message: 'Reservation not found' });
+    }
+    if (updateData.date !== undefined && Number.isNaN(new Date(updateData.date).getTime())) {
+      return res.status(400).json({ message: 'Invalid reservation date' });
+    }
+
+    // Moving the booking or changing the party size re-checks the seats it needs
+    const delta = ReservationSlotService.diff(current, {
+      ...current,
+      date: updateData.date !== undefined ? new Date(updateData.date) : current.date,
+      numberOfGuests: updateData.numberOfGuests !== undefined ? Number(updateData.numberOfGuests) : current.numberOfGuests
+    });
+    try {
+      await ReservationSlotService.applyDelta(delta);
+    } catch (err) {
+      if (!ReservationSlotService.isSlotFull(err)) throw err;
+      return res.status(409).json({ message: 'Not enough seats left at that time' });
+    }
 
+    let reservation;
+    try {
+      reservation = await Reservation.findOneAndUpdate(
+        { _id: id, date: current.date, numberOfGuests: current.numberOfGuests, status: current.status },
+        updateData,
+        { new: true, runValidators: true }
+      );
+    } catch (err) {
+      await ReservationSlotService.applyDelta(ReservationSlotService.negate(delta));
+      throw err;
+    }
     if (!reservation) {
-      return res.status(404).json({ message: 'Reservation not found' });
+      await ReservationSlotService.applyDelta(ReservationSlotService.negate(delta));
+      return res.status(409).json({ message: 'Reservation was changed by someone else, please retry' });
     }
+    if ([...delta.values()].some((g) => g < 0)) ReservationSlotService.promoteInBackground(current);
 
     res.json(reservation);
   } catch (error) {
@@ -158,6 +232,12 @@ exports.deleteReservation = async (req, res) => {
       return res.status(404).json({ message: 'Reservation not found' });
     }
 
+    const delta = ReservationSlotService.diff(reservation, null);
+    if (delta.size) {
+      await ReservationSlotService.applyDelta(delta);
+      ReservationSlotService.promoteInBackground(reservation);
+    }
+
     res.json({ message: 'Reservation deleted successfully' });
   } catch (error) {
     console.error('Error deleting reservation:', error);
@@ -165,6 +245,24 @@ exports.deleteReservation = async (req, res) => {
   }
 };
 
+// Next free seating times for a party: ?party=6&from=<date>&limit=5
+exports.getAvailability = async (req, res) => {
+  try {
+    const party = Number(req.query.party) || 1;
+    const from = req.query.from ? new Date(req.query.from) : new Date();
+    const limit = Math.min(Math.max(Number(req.query.limit) || 5, 1), 50);
+    if (Number.isNaN(from.getTime())) {
+      return res.status(400).json({ message: 'Invalid from date' });
+    }
+
+    const slots = await ReservationSlotService.nextFree(party, from < new Date() ? new Date() : from, limit);
+    res.json({ party, slots });
+  } catch (error) {
+    console.error('Error fetching availability:', error);
+    res.status(500).json({ message: 'Server error', error: error.message });
+  }
+};
+
 // Get reservation statistics
 exports.getReservationStats = async (req, res) => {
   try {
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+forecast.py — ingredient consumption forecasts, days of cover and reorder points
+
+Purpose
+-------
+  Turns the inventorytransactions history into per-ingredient demand forecasts for the
+  assistant's "what do I need to order for the weekend" and "how long will the flour last"
+  questions. Everything is computed as ingredients x days NumPy arrays, one pass for the
+  whole ingredient set.
+
+  History is read with one projected cursor over usage and disposal transactions (both take
+  stock away) and binned into service days. A service day starts at 02:00 local time, as in
+  LedgerService.serviceDayOf, so a 01:30 sale counts towards the previous day.
+
+Model
+-----
+  level      exponentially smoothed daily consumption (or a moving average over the last
+             `window` days), counted from each ingredient's first recorded use
+  weekday    per-weekday factors (mean on that weekday / overall mean), shrunk towards 1 while
+             there are few observations, so Saturdays can forecast higher than Tuesdays
+  sigma      standard deviation of daily consumption around the weekday-adjusted mean
+  demand     level * weekday factor, per future service day
+  cover      whole days the current stock lasts against that demand
+  reorder    lead-time demand + z * sigma * sqrt(lead days)
+
+  A forecast only changes when a service day is complete, so ForecastCache builds it once per
+  service day; current stock is joined in at question time.
+"""
+
+import time, threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+# Service day starts at 02:00 local time (LedgerService.DAY_START_HOUR)
+DAY_START_HOUR = 2
+DAY_SECONDS = 86400
+# Transaction kinds that take stock away
+CONSUMPTION_KINDS = ["usage", "dispose"]
+USAGE_FIELDS = {"_id": 0, "ingredient": 1, "quantity": 1, "date": 1}
+# Pseudo-observations pulling a weekday factor towards 1
+WEEKDAY_PRIOR = 2.0
+# Days of cover are counted up to this far ahead
+COVER_LIMIT = 60
+WEEKDAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# ---------------- Service days ----------------
+
+def service_days(epoch: np.ndarray) -> np.ndarray:
+    """Service day number (days since 1970-01-01, local, starting 02:00) of each epoch second.
+    Local UTC offsets are looked up once per distinct hour, so DST changes are honoured."""
+    epoch = np.asarray(epoch, dtype=np.float64)
+    if not len(epoch):
+        return np.zeros(0, dtype=np.int64)
+    hours, inverse = np.unique(np.floor_divide(epoch, 3600).astype(np.int64), return_inverse=True)
+    offsets = np.array([time.localtime(int(h) * 3600).tm_gmtoff for h in hours], dtype=np.float64)
+    local = epoch + offsets[inverse.ravel()]
+    return np.floor_divide(local - DAY_START_HOUR * 3600, DAY_SECONDS).astype(np.int64)
+
+def service_day(now: Optional[float] = None) -> Tuple[int, float]:
+    """(service day number, fraction of it still to come) for a moment, default now."""
+    now = time.time() if now is None else now
+    local = now + time.localtime(now).tm_gmtoff - DAY_START_HOUR * 3600
+    day, into = divmod(local, DAY_SECONDS)
+    return int(day), 1.0 - into / DAY_SECONDS
+
+def service_day_start(day: int) -> datetime:
+    """UTC moment a service day begins (its local 02:00)."""
+    guess = day * DAY_SECONDS + DAY_START_HOUR * 3600
+    return datetime.fromtimestamp(guess - time.localtime(guess).tm_gmtoff, timezone.utc)
+
+def weekday_of(days) -> np.ndarray:
+    """Monday = 0 ... Sunday = 6; day 0 (1970-01-01) was a Thursday."""
+    return (np.asarray(days, dtype=np.int64) + 3) % 7
+
+# ---------------- History ----------------
+
+def load_consumption(tx_col, first_day: int, end_day: int) -> Tuple[List[Any], np.ndarray]:
+    """(ingredient ids, ingredients x days matrix) of consumption over [first_day, end_day).
+    One projected cursor; rows come back in order of first appearance."""
+    cursor = tx_col.find({"kind": {"$in": CONSUMPTION_KINDS},
+                          "date": {"$gte": service_day_start(first_day), "$lt": service_day_start(end_day)}},
+                         USAGE_FIELDS, batch_size=5000)
+    row_of: Dict[Any, int] = {}
+    rows, quantities, dates = [], [], []
+    for doc in cursor:
+        ing, when = doc.get("ingredient"), doc.get("date")
+        if ing is None or when is None:
+            continue
+        rows.append(row_of.setdefault(ing, len(row_of)))
+        quantities.append(doc.get("quantity") or 0)
+        if when.tzinfo is not None:
+            when = when.astimezone(timezone.utc).replace(tzinfo=None)
+        dates.append(when)
+    n_days = end_day - first_day
+    usage = np.zeros((len(row_of), n_days))
+    if rows:
+        # Naive datetimes from pymongo are UTC
+        epoch = np.array(dates, dtype="datetime64[ms]").astype(np.int64) / 1000.0
+        cols = service_days(epoch) - first_day
+        keep = (cols >= 0) & (cols < n_days)
+        qty = np.asarray(quantities, dtype=np.float64)
+        np.add.at(usage, (np.asarray(rows)[keep], cols[keep]), np.abs(qty[keep]))
+    return list(row_of.keys()), usage
+
+# ---------------- Model ----------------
+
+class ConsumptionForecast:
+    """Per-ingredient demand model fitted on complete service days before `day`."""
+
+    def __init__(self, day: int, ids: List[Any], usage: np.ndarray, method: str = "ewma",
+                 alpha: float = 0.3, window: int = 7):
+        self.day = day
+        self.ids = ids
+        self.row_of = {ing: i for i, ing in enumerate(ids)}
+        self.history_days = usage.shape[1]
+        n, h = usage.shape
+        first_day = day - h
+        if n == 0 or h == 0:
+            self.level = self.sigma = np.zeros(n)
+            self.weekday_factor = np.ones((n, 7))
+            self.observed_days = np.zeros(n, dtype=np.int64)
+            return
+
+        # Each ingredient counts from its first recorded use; earlier zeros mean "not stocked yet"
+        used = usage > 0
+        first = np.where(used.any(axis=1), used.argmax(axis=1), h)
+        active = np.arange(h)[None, :] >= first[:, None]
+        observed = active.sum(axis=1)
+        masked = np.where(active, usage, 0.0)
+        mean = masked.sum(axis=1) / np.maximum(observed, 1)
+
+        # Weekday factors: mean on each weekday over the overall mean, shrunk towards 1
+        onehot = (weekday_of(first_day + np.arange(h))[:, None] == np.arange(7)[None, :]).astype(np.float64)
+        per_weekday_sum = masked @ onehot
+        per_weekday_n = active.astype(np.float64) @ onehot
+        with np.errstate(divide="ignore", invalid="ignore"):
+            raw = np.where(per_weekday_n > 0, per_weekday_sum / per_weekday_n, 0.0) / mean[:, None]
+        raw = np.where(mean[:, None] > 0, raw, 1.0)
+        factor = (per_weekday_n * raw + WEEKDAY_PRIOR) / (per_weekday_n + WEEKDAY_PRIOR)
+        # Renormalise so a whole week forecasts 7 x level
+        factor /= np.maximum(factor.mean(axis=1, keepdims=True), 1e-12)
+
+        # Level on deseasonalised days, so a Saturday spike does not inflate the baseline
+        col_factor = factor[:, weekday_of(first_day + np.arange(h))]
+        flat = np.where(active, usage / np.maximum(col_factor, 1e-12), 0.0)
+        if method == "ma":
+            recent = active[:, -window:]
+            level = flat[:, -window:].sum(axis=1) / np.maximum(recent.sum(axis=1), 1)
+            level = np.where(recent.any(axis=1), level, mean)
+        else:
+            level = np.zeros(n)
+            started = np.zeros(n, dtype=bool)
+            for j in range(h):
+                x, on = flat[:, j], active[:, j]
+                level = np.where(on, np.where(started, alpha * x + (1 - alpha) * level, x), level)
+                started |= on
+
+        resid = np.where(active, usage - mean[:, None] * col_factor, 0.0)
+        self.sigma = np.sqrt((resid ** 2).sum(axis=1) / np.maximum(observed - 1, 1))
+        self.level = level
+        self.weekday_factor = factor
+        self.observed_days = observed
+
+    def demand(self, n_days: int) -> np.ndarray:
+        """ingredients x n_days forecast, starting with today's service day."""
+        wd = weekday_of(self.day + np.arange(n_days))
+        return self.level[:, None] * self.weekday_factor[:, wd]
+
+    def plan(self, stock: np.ndarray, end_day: int, today_left: float = 1.0, lead_days: float = 1.0,
+             z: float = 1.65) -> Dict[str, np.ndarray]:
+        """Order quantities to last through service day end_day (inclusive), plus cover and
+        reorder points, for stock aligned with self.ids."""
+        stock = np.clip(np.asarray(stock, dtype=np.float64), 0, None)
+        horizon = max(end_day - self.day + 1, 1)
+        demand = self.demand(max(horizon, COVER_LIMIT))
+        # Only what is left of today still has to be served
+        demand[:, 0] *= today_left
+        cumulative = np.cumsum(demand, axis=1)
+        need = cumulative[:, horizon - 1]
+        exposure = today_left + horizon - 1
+        safety = z * self.sigma * np.sqrt(max(exposure, 0.0))
+        order = np.maximum(need + safety - stock, 0.0)
+        # Whole service days the stock lasts, today counting as the fraction left of it
+        lasts = cumulative[:, :COVER_LIMIT] <= stock[:, None]
+        cover = np.where(lasts.all(axis=1), np.inf, np.argmin(lasts, axis=1).astype(np.float64))
+        cover = np.where(self.level > 0, cover, np.inf)
+        reorder_point = self.level * lead_days + z * self.sigma * np.sqrt(lead_days)
+        return {"need": need, "safety": safety, "order": order, "cover": cover,
+                "reorderPoint": reorder_point, "belowReorder": (stock <= reorder_point) & (self.level > 0)}
+
+def build_forecast(tx_col, day: int, history_days: int, method: str = "ewma", alpha: float = 0.3,
+                   window: int = 7) -> ConsumptionForecast:
+    ids, usage = load_consumption(tx_col, day - history_days, day)
+    return ConsumptionForecast(day, ids, usage, method, alpha, window)
+
+class ForecastCache:
+    """One ConsumptionForecast per service day: the first question after 02:00 rebuilds it,
+    concurrent ones wait for that build instead of starting their own."""
+
+    def __init__(self, history_days: int, method: str, alpha: float, window: int):
+        self.history_days = history_days
+        self.method = method
+        self.alpha = alpha
+        self.window = window
+        self.forecast: Optional[ConsumptionForecast] = None
+        self.lock = threading.Lock()
+        self.builds = 0
+        self.hits = 0
+        self.last_build_seconds = 0.0
+
+    def get(self, tx_col, day: int) -> Tuple[ConsumptionForecast, bool]:
+        """(forecast for the service day, whether it was already cached)."""
+        forecast = self.forecast
+        if forecast is not None and forecast.day == day:
+            with self.lock:
+                self.hits += 1
+            return forecast, True
+        with self.lock:
+            if self.forecast is not None and self.forecast.day == day:
+                self.hits += 1
+                return self.forecast, True
+            started = time.perf_counter()
+            self.forecast = build_forecast(tx_col, day, self.history_days, self.method, self.alpha, self.window)
+            self.last_build_seconds = time.perf_counter() - started
+            self.builds += 1
+            return self.forecast, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            forecast = self.forecast
+            return {"builds": self.builds, "hits": self.hits,
+                    "ingredients": len(forecast.ids) if forecast is not None else 0,
+                    "serviceDay": service_day_start(forecast.day).isoformat() if forecast is not None else None,
+                    "lastBuildMs": round(self.last_build_seconds * 1000, 3)}
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+menu_io.py — streaming bulk import / export of menu items and their recipes
+
+Purpose
+-------
+  Loads a whole seasonal menu (thousands of recipes) from a JSON-lines or CSV file, and
+  writes the menu back out in the same format for backups. Records go through the same
+  recipe model the assistant uses for synthesized dishes (normalize_recipe: unit mapping and
+  clamping, quantities, category enum / guess_category; item_document), so imported items
+  look exactly like saved ones.
+
+  Files are streamed: memory stays flat in the size of one --batch. Each batch resolves its
+  ingredient names to ObjectIds with one bulk lookup/upsert and writes its items with one
+  unordered bulk_write keyed on nameKey (re-importing a file updates items in place).
+  Bad records are reported with their line number and skipped.
+
+Usage
+-----
+  python menu_io.py import menu.jsonl [--format csv] [--batch 500] [--dry-run]
+                                      [--skip-existing] [--no-create-ingredients]
+  python menu_io.py export backup.jsonl [--format csv]
+  "-" reads stdin / writes stdout. The format defaults to the file extension.
+  Run `npm run backfill:name-keys` first on databases with legacy items, and
+  `npm run costs:rebuild` after a large import.
+
+Record format
+-------------
+  JSONL  {"name": "Bacon Burger", "category": "burger", "price": 12.5,
+          "ingredients": [{"name": "beef patty", "quantity": 1, "unit": "piece"}, ...],
+          "steps": ["Grill the patty", ...], "description": "", "isAvailable": true}
+  CSV    header name,category,price,description,instructions,isAvailable,ingredients,steps;
+         ingredients / steps are JSON arrays (what export writes) or, hand-written,
+         "150 g beef; 2 slices bacon" and "Grill | Assemble".
+"""
+
+import os, re, sys, csv, json, time, argparse
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import assistant
+from assistant import (UNIT_ALIASES, item_document, normalize_recipe, normalize_title_for_match,
+                       resolve_ingredient_ids)
+
+CSV_FIELDS = ["name", "category", "price", "description", "instructions", "isAvailable", "ingredients", "steps"]
+NUMBER_RE = re.compile(r"^\d+(?:[.,]\d+)?$")
+TRUE_WORDS = {"1", "true", "yes", "y"}
+
+class InvalidRecord(ValueError):
+    pass
+
+# ---------------- Reading ----------------
+
+def detect_format(path: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+def read_jsonl(f) -> Iterator[Tuple[int, Any]]:
+    for lineno, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield lineno, json.loads(line)
+        except ValueError as e:
+            yield lineno, InvalidRecord(f"invalid JSON: {e}")
+
+def parse_ingredient_cell(cell: str) -> List[Dict[str, Any]]:
+    """JSON array, or "150 g beef; 2 slices bacon; salt" (quantity and unit optional)."""
+    cell = (cell or "").strip()
+    if cell.startswith("["):
+        return json.loads(cell)
+    lines = []
+    for part in cell.split(";"):
+        words = part.split()
+        if not words:
+            continue
+        qty = 0.0
+        if NUMBER_RE.match(words[0]):
+            qty = float(words.pop(0).replace(",", "."))
+        unit = "unit"
+        if len(words) > 1 and words[0].lower() in UNIT_ALIASES:
+            unit = words.pop(0).lower()
+        lines.append({"name": " ".join(words), "quantity": qty, "unit": unit})
+    return lines
+
+def parse_steps_cell(cell: str) -> List[str]:
+    cell = (cell or "").strip()
+    if cell.startswith("["):
+        return json.loads(cell)
+    return [s.strip() for s in cell.split("|") if s.strip()]
+
+def read_csv(f) -> Iterator[Tuple[int, Any]]:
+    reader = csv.DictReader(f)
+    for row in reader:
+        try:
+            record = {k: v for k, v in row.items() if k and v not in (None, "")}
+            record["ingredients"] = parse_ingredient_cell(row.get("ingredients") or "")
+            record["steps"] = parse_steps_cell(row.get("steps") or "")
+            if "isAvailable" in record:
+                record["isAvailable"] = str(record["isAvailable"]).strip().lower() in TRUE_WORDS
+            yield reader.line_num, record
+        except ValueError as e:
+            yield reader.line_num, InvalidRecord(f"invalid cell: {e}")
+
+def normalize_record(raw: Any) -> Dict[str, Any]:
+    """Validated item dict ready for item_document(), or InvalidRecord."""
+    if not isinstance(raw, dict):
+        raise InvalidRecord("record is not an object")
+    name = re.sub(r"\s+", " ", str(raw.get("name") or "")).strip()
+    if not name:
+        raise InvalidRecord("missing name")
+    try:
+        price = float(raw.get("price"))
+    except (TypeError, ValueError):
+        raise InvalidRecord(f"{name}: missing or non-numeric price")
+    if price < 0:
+        raise InvalidRecord(f"{name}: negative price")
+    ingredients = raw.get("ingredients") or []
+    if not isinstance(ingredients, list):
+        raise InvalidRecord(f"{name}: ingredients must be a list")
+    if any(isinstance(ing, dict) and isinstance(ing.get("quantity"), (int, float)) and ing["quantity"] < 0
+           for ing in ingredients):
+        raise InvalidRecord(f"{name}: negative ingredient quantity")
+    steps = raw.get("steps") or []
+    if not isinstance(steps, list):
+        raise InvalidRecord(f"{name}: steps must be a list")
+
+    recipe = normalize_recipe({"name": name, "category": raw.get("category"), "ingredients": ingredients,
+                               "steps": steps, "instructions": raw.get("instructions") or ""}, name)
+    return {
+        "name": name,
+        "category": recipe["category"],
+        "price": price,
+        "description": str(raw.get("description") or ""),
+        "instructions": str(raw.get("instructions") or ""),
+        "isAvailable": bool(raw.get("isAvailable", True)),
+        "ingredients": recipe["ingredients"],
+        "steps": recipe["steps"],
+    }
+
+# ---------------- Import ----------------
+
+class ImportStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.read = 0
+        self.invalid = 0
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.failed = 0
+
+    def rate(self) -> float:
+        return self.read / max(time.perf_counter() - self.started, 1e-9)
+
+    def summary(self) -> str:
+        return (f"{self.read} records in {time.perf_counter() - self.started:.2f}s ({self.rate():.0f} rec/s): "
+                f"{self.inserted} inserted, {self.updated} updated, {self.unchanged} unchanged, "
+                f"{self.invalid} invalid, {self.failed} failed")
+
+def flush_batch(batch: List[Tuple[int, Dict[str, Any]]], items_col, ingredients_col, args, stats: ImportStats) -> None:
+    # Later records win over earlier ones with the same nameKey within a batch
+    by_key: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+    for lineno, item in batch:
+        by_key[normalize_title_for_match(item["name"])] = (lineno, item)
+    stats.unchanged += len(batch) - len(by_key)
+
+    lines = [ing for _, item in by_key.values() for ing in item["ingredients"]]
+    if args.dry_run:
+        stats.inserted += len(by_key)
+        return
+    ids = resolve_ingredient_ids(ingredients_col, lines, create_missing=args.create_ingredients)
+
+    now = datetime.now(timezone.utc)
+    ops = []
+    for key, (lineno, item) in by_key.items():
+        unknown = [ing["name"] for ing in item["ingredients"] if normalize_title_for_match(ing["name"]) not in ids]
+        if unknown:
+            stats.invalid += 1
+            print(f"line {lineno}: {item['name']}: unknown ingredient(s) {', '.join(unknown)}", file=sys.stderr)
+            continue
+        doc = item_document(item, ids, now)
+        if args.skip_existing:
+            ops.append(UpdateOne({"nameKey": key}, {"$setOnInsert": doc}, upsert=True))
+        else:
+            on_insert = {"createdAt": doc.pop("createdAt"), "soldCount": doc.pop("soldCount")}
+            ops.append(UpdateOne({"nameKey": key}, {"$set": doc, "$setOnInsert": on_insert}, upsert=True))
+    if not ops:
+        return
+    try:
+        result = items_col.bulk_write(ops, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        result = e.details
+        stats.failed += len(result.get("writeErrors", []))
+        for err in result.get("writeErrors", [])[:5]:
+            print(f"write failed: {err.get('errmsg')}", file=sys.stderr)
+    upserted = result.get("nUpserted", 0)
+    modified = result.get("nModified", 0)
+    stats.inserted += upserted
+    stats.updated += modified
+    stats.unchanged += result.get("nMatched", 0) - modified
+
+def import_menu(path: str, items_col, ingredients_col, args) -> ImportStats:
+    fmt = detect_format(path, args.format)
+    stats = ImportStats()
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8-sig", newline="")
+    try:
+        records = read_csv(f) if fmt == "csv" else read_jsonl(f)
+        batch: List[Tuple[int, Dict[str, Any]]] = []
+        for lineno, raw in records:
+            stats.read += 1
+            try:
+                if isinstance(raw, InvalidRecord):
+                    raise raw
+                batch.append((lineno, normalize_record(raw)))
+            except InvalidRecord as e:
+                stats.invalid += 1
+                print(f"line {lineno}: {e}", file=sys.stderr)
+            if len(batch) >= args.batch:
+                flush_batch(batch, items_col, ingredients_col, args, stats)
+                batch = []
+            if args.progress and stats.read % args.progress == 0:
+                print(f"... {stats.read} records ({stats.rate():.0f} rec/s)", file=sys.stderr)
+        if batch:
+            flush_batch(batch, items_col, ingredients_col, args, stats)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return stats
+
+# ---------------- Export ----------------
+
+EXPORT_FIELDS = {"name": 1, "category": 1, "price": 1, "description": 1, "instructions": 1,
+                 "isAvailable": 1, "ingredients": 1, "steps": 1}
+
+def export_records(items_col, ingredients_col, batch_size: int) -> Iterator[Dict[str, Any]]:
+    """Items in _id order, batch_size at a time; recipe lines without a stored name take the
+    ingredient's name (one $in query per batch)."""
+    buffer: List[Dict[str, Any]] = []
+
+    def drain():
+        unnamed = {line.get("ingredient") for doc in buffer for line in doc.get("ingredients") or []
+                   if not line.get("name") and line.get("ingredient") is not None}
+        names = {d["_id"]: d.get("name") for d in ingredients_col.find({"_id": {"$in": list(unnamed)}}, {"name": 1})} if unnamed else {}
+        for doc in buffer:
+            yield {
+                "name": doc.get("name"),
+                "category": doc.get("category"),
+                "price": doc.get("price"),
+                "description": doc.get("description") or "",
+                "instructions": doc.get("instructions") or "",
+                "isAvailable": bool(doc.get("isAvailable", True)),
+                "ingredients": [{"name": line.get("name") or names.get(line.get("ingredient")) or "",
+                                 "quantity": line.get("quantity"), "unit": line.get("unit")}
+                                for line in doc.get("ingredients") or []],
+                "steps": [str(s) for s in doc.get("steps") or []],
+            }
+
+    for doc in items_col.find({}, EXPORT_FIELDS).sort("_id", 1).batch_size(batch_size):
+        buffer.append(doc)
+        if len(buffer) >= batch_size:
+            yield from drain()
+            buffer = []
+    yield from drain()
+
+def export_menu(path: str, items_col, ingredients_col, args) -> Tuple[int, float]:
+    fmt = detect_format(path, args.format)
+    started = time.perf_counter()
+    count = 0
+    f = sys.stdout if path == "-" else open(path, "w", encoding="utf-8", newline="")
+    try:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS) if fmt == "csv" else None
+        if writer:
+            writer.writeheader()
+        for record in export_records(items_col, ingredients_col, args.batch):
+            if writer:
+                record["ingredients"] = json.dumps(record["ingredients"], ensure_ascii=False)
+                record["steps"] = json.dumps(record["steps"], ensure_ascii=False)
+                writer.writerow(record)
+            else:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return count, time.perf_counter() - started
+
+# ---------------- Main ----------------
+
+def connect(args):
+    if args.mongo_uri:
+        assistant.MONGO_URI = args.mongo_uri
+    if args.db:
+        assistant.MONGO_DB = args.db
+    ingredients_col, items_col = assistant.get_collections(assistant.get_mongo_client())
+    return items_col, ingredients_col
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("command", choices=["import", "export"])
+    ap.add_argument("path", help='file to read / write, "-" for stdin / stdout')
+    ap.add_argument("--format", choices=["jsonl", "csv"], default=None, help="default: from the file extension")
+    ap.add_argument("--batch", type=int, default=500, help="records per bulk write / export batch")
+    ap.add_argument("--dry-run", action="store_true", help="validate and normalize only, write nothing")
+    ap.add_argument("--skip-existing", action="store_true", help="leave items that already exist untouched")
+    ap.add_argument("--no-create-ingredients", dest="create_ingredients", action="store_false",
+                    help="reject records naming ingredients that are not in the inventory")
+    ap.add_argument("--progress", type=int, default=0, help="print throughput every N records")
+    ap.add_argument("--mongo-uri", default=None, help="default: MONGO_URI")
+    ap.add_argument("--db", default=None, help="default: MONGO_DB")
+    args = ap.parse_args(argv)
+    args.batch = max(1, args.batch)
+
+    items_col = ingredients_col = None
+    if not (args.command == "import" and args.dry_run):
+        try:
+            items_col, ingredients_col = connect(args)
+        except Exception as e:
+            print(f"MongoDB unavailable: {e}", file=sys.stderr)
+            return 2
+    if args.command == "import":
+        stats = import_menu(args.path, items_col, ingredients_col, args)
+        print(("dry run: " if args.dry_run else "imported ") + stats.summary(), file=sys.stderr)
+        return 1 if stats.invalid or stats.failed else 0
+    count, elapsed = export_menu(args.path, items_col, ingredients_col, args)
+    print(f"exported {count} records in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.0f} rec/s)", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
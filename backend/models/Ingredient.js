@@ -1,5 +1,6 @@
 const mongoose = require('mongoose');
 const AutoIncrement = require('mongoose-sequence')(mongoose);
+const { toNameKey } = require('../services/nameUtils');
 
 const ingredientSchema = new mongoose.Schema(
   {
@@ -9,6 +10,10 @@ const ingredientSchema = new mongoose.Schema(
       unique: true,
       trim: true,
     },
+    // Normalized name (lowercase, no spaces/hyphens) used for exact lookups by the assistant
+    nameKey: {
+      type: String,
+    },
     unit: {
       type: String,
       enum: ['g', 'kg', 'l', 'ml', 'piece', 'unit'],
@@ -50,6 +55,30 @@ const ingredientSchema = new mongoose.Schema(
   }
 );
 
+ingredientSchema.index({ updatedAt: 1 });
+// One ingredient per normalized name; documents without a key (legacy) are not constrained
+ingredientSchema.index(
+  { nameKey: 1 },
+  { unique: true, partialFilterExpression: { nameKey: { $type: 'string' } } }
+);
+
+ingredientSchema.pre('save', function (next) {
+  if (this.isNew || this.isModified('name') || !this.nameKey) {
+    this.nameKey = toNameKey(this.name);
+  }
+  next();
+});
+
+// Keep nameKey in step when a name is changed through findByIdAndUpdate
+ingredientSchema.pre('findOneAndUpdate', function (next) {
+  const update = this.getUpdate() || {};
+  const name = update.$set && update.$set.name !== undefined ? update.$set.name : update.name;
+  if (typeof name === 'string') {
+    this.set({ nameKey: toNameKey(name) });
+  }
+  next();
+});
+
 // Auto-increment plugin
 ingredientSchema.plugin(AutoIncrement, { inc_field: 'id' });
 
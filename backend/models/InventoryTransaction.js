@@ -46,6 +46,9 @@ const inventoryTransactionSchema = new mongoose.Schema(
   { timestamps: true }
 );
 
+// Usage history by kind and date (assistant forecasts, ledger backfill); covers the forecast's projection
+inventoryTransactionSchema.index({ kind: 1, date: 1, ingredient: 1, quantity: 1 });
+
 module.exports = mongoose.model('InventoryTransaction', inventoryTransactionSchema);
 
 
@@ -1,4 +1,5 @@
 const mongoose = require('mongoose');
+const { toNameKey } = require('../services/nameUtils');
 
 const recipeIngredientSchema = new mongoose.Schema({
   ingredient: {
@@ -29,6 +30,11 @@ const itemSchema = new mongoose.Schema(
       required: [true, 'Item name is required'],
       trim: true,
     },
+    // Normalized name used for indexed lookups (see services/nameUtils.js)
+    nameKey: {
+      type: String,
+      index: true,
+    },
     description: {
       type: String,
       trim: true,
@@ -53,6 +59,11 @@ const itemSchema = new mongoose.Schema(
       type: Boolean,
       default: true,
     },
+    // Switched off by DishIndexService because an ingredient ran out; switched back on by it when restocked
+    disabledForStock: {
+      type: Boolean,
+      default: false,
+    },
     soldCount: {
       type: Number,
       default: 0,
@@ -69,6 +80,17 @@ const itemSchema = new mongoose.Schema(
   }
 );
 
+itemSchema.index({ updatedAt: 1 });
+// Items using a given ingredient (incremental cost refresh after purchases)
+itemSchema.index({ 'ingredients.ingredient': 1 });
+
+itemSchema.pre('save', function (next) {
+  if (this.isNew || this.isModified('name') || !this.nameKey) {
+    this.nameKey = toNameKey(this.name);
+  }
+  next();
+});
+
 const Item = mongoose.model('Item', itemSchema);
 
 module.exports = Item;
\ No newline at end of file
@@ -0,0 +1,89 @@
+const mongoose = require('mongoose');
+
+const costLineSchema = new mongoose.Schema({
+  ingredient: {
+    type: mongoose.Schema.Types.ObjectId,
+    ref: 'Ingredient',
+    required: true
+  },
+  name: {
+    type: String,
+    trim: true
+  },
+  // Recipe quantity converted to the ingredient's own unit
+  quantity: {
+    type: Number,
+    default: 0
+  },
+  unit: {
+    type: String
+  },
+  unitCost: {
+    type: Number,
+    default: 0
+  },
+  cost: {
+    type: Number,
+    default: 0
+  },
+  // True when the ingredient is gone or has no price yet (cost counted as 0)
+  missingPrice: {
+    type: Boolean,
+    default: false
+  }
+}, { _id: false });
+
+// Materialized per-portion food cost of a menu item (see services/costService.js)
+const itemCostSchema = new mongoose.Schema({
+  item: {
+    type: mongoose.Schema.Types.ObjectId,
+    ref: 'Item',
+    required: true,
+    unique: true // one cost row per menu item
+  },
+  name: {
+    type: String,
+    trim: true
+  },
+  nameKey: {
+    type: String,
+    index: true
+  },
+  category: {
+    type: String
+  },
+  price: {
+    type: Number,
+    default: 0
+  },
+  cost: {
+    type: Number,
+    default: 0
+  },
+  margin: {
+    type: Number,
+    default: 0
+  },
+  // Margin as a percentage of the selling price (null when the item has no price)
+  marginPct: {
+    type: Number,
+    default: null
+  },
+  lines: {
+    type: [costLineSchema],
+    default: []
+  },
+  complete: {
+    type: Boolean,
+    default: true
+  },
+  computedAt: {
+    type: Date,
+    default: Date.now
+  }
+}, {
+  timestamps: true
+});
+
+const ItemCost = mongoose.model('ItemCost', itemCostSchema);
+module.exports = ItemCost;
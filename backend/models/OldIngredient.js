@@ -52,6 +52,9 @@ const oldIngredientSchema = new mongoose.Schema(
   }
 );
 
+// FIFO draw-down: open batches of an ingredient, oldest first
+oldIngredientSchema.index({ originalIngredient: 1, snapshotDate: 1, createdAt: 1 });
+
 module.exports = mongoose.model('OldIngredient', oldIngredientSchema);
 
 
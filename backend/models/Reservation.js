@@ -37,7 +37,7 @@ const reservationSchema = new mongoose.Schema({
   },
   status: {
     type: String,
-    enum: ['pending', 'confirmed', 'cancelled', 'completed'],
+    enum: ['pending', 'confirmed', 'cancelled', 'completed', 'waitlisted'],
     default: 'pending'
   },
   createdAt: {
@@ -48,9 +48,10 @@ const reservationSchema = new mongoose.Schema({
   timestamps: true
 });
 
-// Index for efficient queries
-reservationSchema.index({ date: 1 });
-reservationSchema.index({ status: 1 });
+// Index for efficient queries: date ranges (optionally by status, sorted by date), one status
+// over a date range (waitlist promotion), and email prefix search
+reservationSchema.index({ date: 1, status: 1 });
+reservationSchema.index({ status: 1, date: 1 });
 reservationSchema.index({ emailAddress: 1 });
 
 const Reservation = mongoose.model('Reservation', reservationSchema);
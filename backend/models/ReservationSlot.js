@@ -0,0 +1,15 @@
+const mongoose = require('mongoose');
+
+// Guests seated in one reservation time slot (see services/reservationSlotService.js)
+const reservationSlotSchema = new mongoose.Schema(
+  {
+    start: { type: Date, required: true },
+    guests: { type: Number, default: 0 },
+  },
+  { timestamps: true }
+);
+
+// One document per slot; a guarded upsert that hits this index means the slot is full
+reservationSlotSchema.index({ start: 1 }, { unique: true });
+
+module.exports = mongoose.model('ReservationSlot', reservationSlotSchema);
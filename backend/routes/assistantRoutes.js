@@ -2,40 +2,10 @@ const express = require("express");
 const router = express.Router();
 const { spawn } = require("child_process");
 const Ingredient = require("../models/Ingredient");
-const path = require("path");
-const fs = require("fs");
-
-// Improved Python path detection
-function getPythonPath() {
-  // Try multiple possible Python paths
-  const possiblePaths = [
-    // Windows with .venv
-    path.join(__dirname, "..", ".venv", "Scripts", "python.exe"),
-    // Windows with venv
-    path.join(__dirname, "..", "venv", "Scripts", "python.exe"),
-    // Unix/Linux with .venv
-    path.join(__dirname, "..", ".venv", "bin", "python"),
-    // Unix/Linux with venv
-    path.join(__dirname, "..", "venv", "bin", "python"),
-    // System Python (Windows)
-    "python.exe",
-    // System Python (Unix/Linux/Mac)
-    "python3",
-    "python"
-  ];
-
-  for (const pythonPath of possiblePaths) {
-    if (fs.existsSync(pythonPath) || !pythonPath.includes(path.sep)) {
-      return pythonPath;
-    }
-  }
-
-  // Default fallback
-  return "python";
-}
+const { daemon, pythonPath, scriptPath } = require("../services/assistantDaemon");
 
-const pythonPath = getPythonPath();
-const scriptPath = path.join(__dirname, "..", "assistant.py");
+// Set ASSISTANT_DAEMON=0 to fall back to one Python process per question
+const USE_DAEMON = process.env.ASSISTANT_DAEMON !== "0";
 
 // Log paths only in development
 if (process.env.NODE_ENV !== 'production') {
@@ -52,6 +22,22 @@ router.post("/ask", async (req, res) => {
       return res.status(400).json({ error: "No text provided" });
     }
 
+    if (USE_DAEMON) {
+      try {
+        const reply = ((await daemon.ask(text)) || "").trim();
+        if (!reply) {
+          return res.status(500).json({ error: "Empty reply from assistant" });
+        }
+        return res.json({ reply });
+      } catch (err) {
+        console.error("Assistant daemon error:", err);
+        return res.status(500).json({
+          error: "Python process failed",
+          details: err.message,
+        });
+      }
+    }
+
     // Pass the user text as a single argument to assistant.py
     // The Python script will fetch inventory live from DB itself, so no need to write inventory.json
     const python = spawn(pythonPath, [scriptPath, text], {
@@ -105,4 +91,156 @@ router.post("/ask", async (req, res) => {
   }
 });
 
+// Streams the answer as server-sent events while it is generated:
+// "data: {\"chunk\": \"...\"}" frames, then "event: done" (or "event: error").
+router.post("/ask-stream", async (req, res) => {
+  const { text } = req.body || {};
+  if (!text || typeof text !== "string" || text.trim().length === 0) {
+    return res.status(400).json({ error: "No text provided" });
+  }
+
+  res.status(200);
+  res.setHeader("Content-Type", "text/event-stream; charset=utf-8");
+  res.setHeader("Cache-Control", "no-cache");
+  res.setHeader("Connection", "keep-alive");
+  res.flushHeaders();
+  const sendChunk = (chunk) => res.write(`data: ${JSON.stringify({ chunk })}\n\n`);
+  const sendEvent = (event, data) => res.write(`event: ${event}\ndata: ${JSON.stringify(data)}\n\n`);
+
+  if (USE_DAEMON) {
+    try {
+      await daemon.askStream(text, sendChunk);
+      sendEvent("done", {});
+    } catch (err) {
+      console.error("Assistant daemon stream error:", err);
+      sendEvent("error", { error: err.message });
+    }
+    return res.end();
+  }
+
+  // One-shot fallback: relay stdout of `assistant.py --stream` as it is written
+  const python = spawn(pythonPath, [scriptPath, "--stream", text], {
+    env: { ...process.env, ASSISTANT_DEBUG: process.env.ASSISTANT_DEBUG || "0", PYTHONUNBUFFERED: "1" }
+  });
+  // A client that goes away stops the generation instead of leaving it running unread
+  // (res, not req: req "close" fires as soon as the request body has been read)
+  res.on("close", () => {
+    if (python.exitCode === null && python.signalCode === null) python.kill();
+  });
+  python.stdout.on("data", (chunk) => sendChunk(chunk.toString()));
+  python.stderr.on("data", (err) => {
+    console.error("Python stderr:", err.toString());
+  });
+  python.on("error", (err) => {
+    console.error("Failed to start Python process:", err);
+    sendEvent("error", { error: "Failed to start Python process" });
+    res.end();
+  });
+  python.on("close", (code) => {
+    if (res.writableEnded) return;
+    if (code === 0) {
+      sendEvent("done", {});
+    } else {
+      sendEvent("error", { error: "Python process failed", code });
+    }
+    res.end();
+  });
+});
+
+const MAX_BATCH_SIZE = Number(process.env.ASSISTANT_MAX_BATCH || 100);
+
+// Answers a list of questions, streaming one NDJSON line per question as it completes:
+// {"index": i, "text": "...", "reply": "..."}, then {"done": true} (or {"error": "..."}).
+router.post("/ask-batch", async (req, res) => {
+  const { texts } = req.body || {};
+  if (!Array.isArray(texts) || texts.length === 0 || texts.some((t) => typeof t !== "string" || !t.trim())) {
+    return res.status(400).json({ error: "texts must be a non-empty array of questions" });
+  }
+  if (texts.length > MAX_BATCH_SIZE) {
+    return res.status(400).json({ error: `At most ${MAX_BATCH_SIZE} questions per batch` });
+  }
+
+  res.status(200);
+  res.setHeader("Content-Type", "application/x-ndjson; charset=utf-8");
+  res.setHeader("Cache-Control", "no-cache");
+  const writeLine = (obj) => res.write(JSON.stringify(obj) + "\n");
+
+  if (USE_DAEMON) {
+    try {
+      await daemon.askBatch(texts, (index, reply) => {
+        writeLine({ index, text: texts[index], reply: (reply || "").trim() });
+      });
+      writeLine({ done: true });
+    } catch (err) {
+      console.error("Assistant daemon batch error:", err);
+      writeLine({ error: err.message });
+    }
+    return res.end();
+  }
+
+  // One-shot fallback: a single `assistant.py --batch` process for the whole list
+  const python = spawn(pythonPath, [scriptPath, "--batch"], {
+    env: { ...process.env, ASSISTANT_DEBUG: process.env.ASSISTANT_DEBUG || "0" }
+  });
+  let buffered = "";
+  python.stdout.on("data", (chunk) => {
+    buffered += chunk.toString();
+    let nl;
+    while ((nl = buffered.indexOf("\n")) >= 0) {
+      const line = buffered.slice(0, nl).trim();
+      buffered = buffered.slice(nl + 1);
+      if (!line) continue;
+      try {
+        const msg = JSON.parse(line);
+        writeLine({ index: msg.index, text: texts[msg.index], reply: (msg.reply || "").trim() });
+      } catch (e) {
+        console.warn("Assistant emitted a non-JSON line:", line);
+      }
+    }
+  });
+  python.stderr.on("data", (err) => {
+    console.error("Python stderr:", err.toString());
+  });
+  python.on("error", (err) => {
+    console.error("Failed to start Python process:", err);
+    writeLine({ error: "Failed to start Python process" });
+    res.end();
+  });
+  python.on("close", (code) => {
+    if (res.writableEnded) return;
+    writeLine(code === 0 ? { done: true } : { error: "Python process failed", code });
+    res.end();
+  });
+  // One question per line; collapse embedded newlines
+  python.stdin.end(texts.map((t) => t.replace(/\s*\n\s*/g, " ").trim()).join("\n") + "\n");
+});
+
+// Assistant process / MongoDB circuit state; 503 while the assistant is skipping the DB
+router.get("/health", async (req, res) => {
+  if (!USE_DAEMON) {
+    return res.json({ daemon: false });
+  }
+  try {
+    const health = await daemon.health();
+    const ok = !health.mongo || health.mongo.state === "closed";
+    res.status(ok ? 200 : 503).json({ daemon: true, ...health });
+  } catch (err) {
+    res.status(503).json({ daemon: true, error: err.message });
+  }
+});
+
+// Prometheus scrape target: per-stage timings, cache hit/miss and coalescing counters
+router.get("/metrics", async (req, res) => {
+  if (!USE_DAEMON) {
+    return res.status(404).json({ error: "Metrics are only collected by the assistant daemon" });
+  }
+  try {
+    const text = await daemon.metrics();
+    res.setHeader("Content-Type", "text/plain; version=0.0.4; charset=utf-8");
+    res.send(text);
+  } catch (err) {
+    res.status(503).json({ error: err.message });
+  }
+});
+
 module.exports = router;
\ No newline at end of file
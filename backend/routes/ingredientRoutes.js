@@ -6,6 +6,7 @@ const { protect } = require('../middleWares/authMiddleware');
 router.get('/', protect,ingredientController.getIngredients);
 router.post('/', protect,ingredientController.createIngredient);
 router.get('/:id', protect,ingredientController.getIngredientById);
+router.get('/:id/dishes', protect, ingredientController.getIngredientDishes);
 router.put('/:id', protect,ingredientController.updateIngredient);
 router.patch('/:id/stock', protect, ingredientController.updateIngredientStock);
 router.patch('/:id/manual-oos', protect, ingredientController.toggleManualOutOfStock);
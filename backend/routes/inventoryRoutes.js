@@ -1,6 +1,6 @@
 const express = require('express');
 const router = express.Router();
-const { openDay, closeDay, disposeIngredient, getDaily } = require('../controllers/inventoryController');
+const { openDay, closeDay, disposeIngredient, getDaily, getRollup } = require('../controllers/inventoryController');
 const { protect } = require('../middleWares/authMiddleware');
 const allowRoles = require('../middleWares/roleMiddleware');
 
@@ -9,6 +9,7 @@ router.post('/open', protect, allowRoles('admin', 'manager', 'accountant'), open
 router.post('/close', protect, allowRoles('admin', 'manager', 'accountant'), closeDay);
 router.post('/dispose', protect, allowRoles('admin', 'manager', 'accountant'), disposeIngredient);
 router.get('/daily', protect, allowRoles('admin', 'manager', 'accountant', 'cashier', 'waiter', 'co-manager'), getDaily);
+router.get('/rollup', protect, allowRoles('admin', 'manager', 'accountant', 'co-manager'), getRollup);
 
 module.exports = router;
 
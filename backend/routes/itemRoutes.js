@@ -1,10 +1,13 @@
 const express = require('express');
 const router = express.Router();
 const { protect } = require('../middleWares/authMiddleware');
+const allowRoles = require('../middleWares/roleMiddleware');
 const {
   createItem,
   getItems,
   getItemById,
+  getItemCosts,
+  rebuildItemCosts,
   updateItem,
   updateItemStock,
   deleteItem
@@ -12,6 +15,8 @@ const {
 
 router.post('/', protect, createItem);
 router.get('/', protect, getItems);
+router.get('/costs', protect, getItemCosts);
+router.post('/costs/rebuild', protect, allowRoles('admin', 'manager', 'accountant'), rebuildItemCosts);
 router.get('/:id', protect, getItemById);
 router.put('/:id', protect, updateItem);
 router.patch('/:id/stock', protect, updateItemStock);
@@ -7,13 +7,15 @@ const {
   updateReservationStatus,
   updateReservation,
   deleteReservation,
-  getReservationStats
+  getReservationStats,
+  getAvailability
 } = require('../controllers/reservationController');
 const { protect } = require('../middleWares/authMiddleware');
 const allowRoles = require('../middleWares/roleMiddleware');
 
 // Public route for creating reservations (from contact form)
 router.post('/', createReservation);
+router.get('/availability', getAvailability);
 
 // Protected routes for dashboard management
 router.get('/', protect, allowRoles('admin', 'manager', 'waiter'), getReservations);
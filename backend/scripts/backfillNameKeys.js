@@ -0,0 +1,56 @@
+/*
+  Backfill nameKey on items and ingredients created before the field existed.
+  Usage: node backend/scripts/backfillNameKeys.js
+*/
+
+require('dotenv').config();
+const connectDB = require('../config/db');
+const Item = require('../models/Item');
+const Ingredient = require('../models/Ingredient');
+const { toNameKey } = require('../services/nameUtils');
+
+async function backfill(Model, label, { unique = false } = {}) {
+  const docs = await Model.find({}, { name: 1, nameKey: 1 }).lean();
+  const ops = [];
+  const unsets = [];
+  const claimed = new Set();
+  for (const doc of docs) {
+    const key = toNameKey(doc.name);
+    if (unique) {
+      // Leave later duplicates (e.g. "Tomato" vs "tomato") unkeyed so the unique index still builds
+      if (claimed.has(key)) {
+        console.warn(`${label}: "${doc.name}" duplicates an existing name; left without nameKey.`);
+        if (doc.nameKey) {
+          unsets.push({ updateOne: { filter: { _id: doc._id }, update: { $unset: { nameKey: '' } } } });
+        }
+        continue;
+      }
+      claimed.add(key);
+    }
+    if (doc.nameKey !== key) {
+      ops.push({ updateOne: { filter: { _id: doc._id }, update: { $set: { nameKey: key } } } });
+    }
+  }
+  // Clear duplicate keys before assigning new ones so the unique index is never violated
+  if (unsets.length) {
+    await Model.bulkWrite(unsets, { ordered: false });
+  }
+  if (ops.length) {
+    await Model.bulkWrite(ops, { ordered: false });
+  }
+  await Model.syncIndexes();
+  console.log(`${label}: updated ${ops.length + unsets.length} of ${docs.length} document(s).`);
+}
+
+async function run() {
+  await connectDB();
+  await backfill(Item, 'Items');
+  await backfill(Ingredient, 'Ingredients', { unique: true });
+  console.log('Finished.');
+  process.exit(0);
+}
+
+run().catch((e) => {
+  console.error('Unexpected error:', e);
+  process.exit(1);
+});
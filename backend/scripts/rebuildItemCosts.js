@@ -0,0 +1,23 @@
+/*
+  Recompute the per-portion food cost and margin of every menu item into the
+  itemcosts collection (Item.ingredients × Ingredient.pricePerUnit, unit converted).
+  Purchases and item/ingredient edits keep it current incrementally; run this
+  nightly or after bulk imports to catch anything changed outside the API.
+*/
+
+require('dotenv').config();
+const connectDB = require('../config/db');
+const CostService = require('../services/costService');
+
+async function run() {
+  await connectDB();
+  const started = Date.now();
+  const { items, removed } = await CostService.rebuildAll();
+  console.log(`Finished. Costed ${items} item(s), removed ${removed} stale row(s) in ${Date.now() - started}ms.`);
+  process.exit(0);
+}
+
+run().catch((e) => {
+  console.error('Unexpected error:', e);
+  process.exit(1);
+});
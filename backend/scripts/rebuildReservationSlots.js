@@ -0,0 +1,36 @@
+/*
+  Recompute the per-slot guest totals (ReservationSlot) from the reservations that hold seats
+  and fix slots that drifted. Needed once after deploying the slot index, and safe to re-run.
+
+  Usage: node backend/scripts/rebuildReservationSlots.js [--since YYYY-MM-DD]
+  Defaults to now (past slots are left alone).
+*/
+
+require('dotenv').config();
+const connectDB = require('../config/db');
+const ReservationSlotService = require('../services/reservationSlotService');
+
+function argValue(name) {
+  const i = process.argv.indexOf(name);
+  return i >= 0 ? process.argv[i + 1] : undefined;
+}
+
+async function run() {
+  const since = argValue('--since') ? new Date(argValue('--since')) : new Date();
+  if (Number.isNaN(since.getTime())) {
+    console.error('--since must be a date (YYYY-MM-DD)');
+    process.exit(1);
+  }
+
+  await connectDB();
+  const started = Date.now();
+  const report = await ReservationSlotService.rebuild(since);
+  console.log(`Finished. ${report.reservations} reservation(s) over ${report.slots} slot(s): `
+    + `${report.corrected} corrected in ${Date.now() - started}ms.`);
+  process.exit(0);
+}
+
+run().catch((e) => {
+  console.error('Unexpected error:', e);
+  process.exit(1);
+});
@@ -0,0 +1,188 @@
+const { spawn } = require('child_process');
+const path = require('path');
+const fs = require('fs');
+const readline = require('readline');
+
+// Improved Python path detection
+function getPythonPath() {
+  // Try multiple possible Python paths
+  const possiblePaths = [
+    // Windows with .venv
+    path.join(__dirname, "..", ".venv", "Scripts", "python.exe"),
+    // Windows with venv
+    path.join(__dirname, "..", "venv", "Scripts", "python.exe"),
+    // Unix/Linux with .venv
+    path.join(__dirname, "..", ".venv", "bin", "python"),
+    // Unix/Linux with venv
+    path.join(__dirname, "..", "venv", "bin", "python"),
+    // System Python (Windows)
+    "python.exe",
+    // System Python (Unix/Linux/Mac)
+    "python3",
+    "python"
+  ];
+
+  for (const pythonPath of possiblePaths) {
+    if (fs.existsSync(pythonPath) || !pythonPath.includes(path.sep)) {
+      return pythonPath;
+    }
+  }
+
+  // Default fallback
+  return "python";
+}
+
+const pythonPath = getPythonPath();
+const scriptPath = path.join(__dirname, '..', 'assistant.py');
+const REQUEST_TIMEOUT_MS = Number(process.env.ASSISTANT_TIMEOUT_MS || 120000);
+
+/**
+ * Keeps one `assistant.py --serve` process alive and multiplexes questions over its
+ * JSON-lines stdin/stdout protocol. The process is started lazily and restarted on exit.
+ */
+class AssistantDaemon {
+  constructor() {
+    this.proc = null;
+    this.nextId = 1;
+    this.pending = new Map();
+  }
+
+  start() {
+    if (this.proc) return this.proc;
+
+    const proc = spawn(pythonPath, [scriptPath, '--serve'], {
+      env: { ...process.env, ASSISTANT_DEBUG: process.env.ASSISTANT_DEBUG || '0' }
+    });
+    this.proc = proc;
+
+    readline.createInterface({ input: proc.stdout }).on('line', (line) => this.handleLine(line));
+
+    proc.stdin.on('error', (err) => {
+      console.error('Assistant stdin error:', err.message);
+    });
+
+    proc.stderr.on('data', (err) => {
+      console.error('Python stderr:', err.toString());
+    });
+
+    const onExit = (reason) => {
+      if (this.proc !== proc) return;
+      this.proc = null;
+      for (const { reject, timer } of this.pending.values()) {
+        clearTimeout(timer);
+        reject(new Error(`Assistant process ${reason}`));
+      }
+      this.pending.clear();
+    };
+    proc.on('error', (err) => onExit(`failed to start: ${err.message}`));
+    proc.on('exit', (code) => onExit(`exited with code ${code}`));
+
+    return proc;
+  }
+
+  handleLine(line) {
+    let msg;
+    try {
+      msg = JSON.parse(line);
+    } catch (e) {
+      console.warn('Assistant emitted a non-JSON line:', line);
+      return;
+    }
+    const entry = this.pending.get(msg.id);
+    if (!entry) return;
+    // Partial batch result or stream chunk: keep the request open and restart its timeout
+    if (entry.onPartial && !msg.error && !msg.done) {
+      entry.onPartial(msg);
+      this.armTimeout(msg.id, entry);
+      return;
+    }
+    this.pending.delete(msg.id);
+    clearTimeout(entry.timer);
+    if (msg.error) {
+      entry.reject(new Error(msg.error));
+    } else {
+      entry.resolve(msg.reply !== undefined ? msg.reply : msg);
+    }
+  }
+
+  armTimeout(id, entry) {
+    clearTimeout(entry.timer);
+    entry.timer = setTimeout(() => {
+      this.pending.delete(id);
+      entry.reject(new Error('Assistant request timed out'));
+    }, REQUEST_TIMEOUT_MS);
+  }
+
+  send(payload, onPartial = null) {
+    const proc = this.start();
+    const id = this.nextId++;
+    return new Promise((resolve, reject) => {
+      const entry = { resolve, reject, onPartial, timer: null };
+      this.armTimeout(id, entry);
+      this.pending.set(id, entry);
+      proc.stdin.write(JSON.stringify({ id, ...payload }) + '\n');
+    });
+  }
+
+  /**
+   * Send one question to the daemon.
+   * @param {string} text
+   * @returns {Promise<string>} the assistant's reply
+   */
+  ask(text) {
+    return this.send({ text });
+  }
+
+  /**
+   * Send a list of questions; onResult(index, reply) fires as each one completes.
+   * @param {string[]} texts
+   * @param {(index: number, reply: string) => void} onResult
+   * @returns {Promise<void>} resolves once every question has been answered
+   */
+  askBatch(texts, onResult) {
+    return this.send({ cmd: 'batch', texts }, (msg) => onResult(msg.index, msg.reply));
+  }
+
+  /**
+   * Ask one question and receive the answer in pieces as it is generated.
+   * @param {string} text
+   * @param {(chunk: string) => void} onChunk
+   * @returns {Promise<void>} resolves once the answer is complete
+   */
+  askStream(text, onChunk) {
+    return this.send({ cmd: 'stream', text }, (msg) => onChunk(msg.chunk || ''));
+  }
+
+  /**
+   * Health of the assistant process and its MongoDB circuit breaker.
+   * @returns {Promise<{mongo: {state: string, connected: boolean, lastError: ?string, retryInSeconds: number}}>}
+   */
+  health() {
+    return this.send({ cmd: 'health' }).then((msg) => msg.health);
+  }
+
+  /**
+   * Per-stage latency histograms and counters of the assistant process.
+   * @returns {Promise<string>} Prometheus text exposition
+   */
+  metrics() {
+    return this.send({ cmd: 'metrics' }).then((msg) => msg.metrics || '');
+  }
+
+  stop() {
+    if (this.proc) {
+      this.proc.stdin.end();
+      this.proc = null;
+    }
+  }
+}
+
+const daemon = new AssistantDaemon();
+
+module.exports = {
+  getPythonPath,
+  pythonPath,
+  scriptPath,
+  AssistantDaemon,
+  daemon,
+};
@@ -0,0 +1,119 @@
+const Item = require('../models/Item');
+const Ingredient = require('../models/Ingredient');
+const ItemCost = require('../models/ItemCost');
+const { convertToIngredientUnit } = require('./unitUtils');
+const { toNameKey } = require('./nameUtils');
+
+const round2 = (n) => Math.round(n * 100) / 100;
+const round4 = (n) => Math.round(n * 10000) / 10000;
+
+class CostService {
+  /**
+   * Per-portion food cost and margin of one item.
+   * @param {object} item - lean Item document
+   * @param {Map<string, object>} ingredientsById - lean Ingredient documents keyed by String(_id)
+   */
+  static computeItemCost(item, ingredientsById) {
+    let cost = 0;
+    let complete = true;
+    const lines = (item.ingredients || []).map((line) => {
+      const ingredient = ingredientsById.get(String(line.ingredient));
+      const unitCost = ingredient ? Number(ingredient.pricePerUnit) || 0 : 0;
+      const quantity = ingredient
+        ? convertToIngredientUnit(line.unit, ingredient.unit, Number(line.quantity) || 0)
+        : Number(line.quantity) || 0;
+      const lineCost = quantity * unitCost;
+      const missingPrice = !ingredient || unitCost <= 0;
+      if (missingPrice) complete = false;
+      cost += lineCost;
+      return {
+        ingredient: line.ingredient,
+        name: line.name || (ingredient && ingredient.name) || '',
+        quantity: round4(quantity),
+        unit: ingredient ? ingredient.unit : line.unit,
+        unitCost,
+        cost: round4(lineCost),
+        missingPrice,
+      };
+    });
+
+    const price = Number(item.price) || 0;
+    const margin = price - cost;
+    return {
+      item: item._id,
+      name: item.name,
+      nameKey: item.nameKey || toNameKey(item.name),
+      category: item.category,
+      price,
+      cost: round2(cost),
+      margin: round2(margin),
+      marginPct: price > 0 ? round2((margin / price) * 100) : null,
+      lines,
+      complete,
+      computedAt: new Date(),
+    };
+  }
+
+  // Cost and write a batch of items, loading every ingredient they use in a single query
+  static async writeCosts(items) {
+    if (!items.length) return 0;
+    const ids = new Set();
+    for (const item of items) {
+      // Lines without an ingredient (unresolved names) are costed as missing a price
+      for (const line of item.ingredients || []) if (line.ingredient) ids.add(String(line.ingredient));
+    }
+    const ingredients = await Ingredient.find(
+      { _id: { $in: [...ids] } },
+      { name: 1, unit: 1, pricePerUnit: 1 }
+    ).lean();
+    const ingredientsById = new Map(ingredients.map((ing) => [String(ing._id), ing]));
+
+    const ops = items.map((item) => ({
+      updateOne: {
+        filter: { item: item._id },
+        update: { $set: CostService.computeItemCost(item, ingredientsById) },
+        upsert: true,
+      },
+    }));
+    await ItemCost.bulkWrite(ops, { ordered: false });
+    return ops.length;
+  }
+
+  // Batch job: recompute the whole menu and drop rows of items that no longer exist
+  static async rebuildAll() {
+    const items = await Item.find({}, { name: 1, nameKey: 1, category: 1, price: 1, ingredients: 1 }).lean();
+    const written = await CostService.writeCosts(items);
+    const { deletedCount } = await ItemCost.deleteMany({ item: { $nin: items.map((item) => item._id) } });
+    return { items: written, removed: deletedCount || 0 };
+  }
+
+  // Incremental update after ingredient prices change (purchases, manual edits)
+  static async refreshForIngredients(ingredientIds) {
+    const ids = [...new Set((ingredientIds || []).filter(Boolean).map(String))];
+    if (!ids.length) return 0;
+    const items = await Item.find(
+      { 'ingredients.ingredient': { $in: ids } },
+      { name: 1, nameKey: 1, category: 1, price: 1, ingredients: 1 }
+    ).lean();
+    return CostService.writeCosts(items);
+  }
+
+  // Incremental update after items are created or their recipe/price is edited
+  static async refreshForItems(itemIds) {
+    const ids = [...new Set((itemIds || []).filter(Boolean).map(String))];
+    if (!ids.length) return 0;
+    const items = await Item.find(
+      { _id: { $in: ids } },
+      { name: 1, nameKey: 1, category: 1, price: 1, ingredients: 1 }
+    ).lean();
+    return CostService.writeCosts(items);
+  }
+
+  // Fire-and-forget wrapper so request handlers never wait on or fail because of cost upkeep
+  static refreshInBackground(kind, ids) {
+    const run = kind === 'items' ? CostService.refreshForItems : CostService.refreshForIngredients;
+    run(ids).catch((e) => console.error(`Failed to refresh item costs for ${kind}`, e.message));
+  }
+}
+
+module.exports = CostService;
@@ -0,0 +1,149 @@
+const Item = require('../models/Item');
+const Ingredient = require('../models/Ingredient');
+
+// Items written outside this process (assistant saves, menu imports) are picked up this often
+const REFRESH_MS = Number(process.env.DISH_INDEX_REFRESH_MS) || 5000;
+const INDEX_FIELDS = { 'ingredients.ingredient': 1, updatedAt: 1 };
+const STOCK_FIELDS = { currentStock: 1, isManuallyOutOfStock: 1 };
+
+// Inverted index: ingredient id -> ids of the items using it, plus each item's ingredient ids
+const byIngredient = new Map();
+const ingredientsOf = new Map();
+let building = null;
+let lastUpdated = null;
+let lastCheck = 0;
+
+const isOut = (ing) => !ing || ing.isManuallyOutOfStock || !(Number(ing.currentStock) > 0);
+
+function unlink(itemId) {
+  for (const ing of ingredientsOf.get(itemId) || []) {
+    const items = byIngredient.get(ing);
+    if (items) {
+      items.delete(itemId);
+      if (!items.size) byIngredient.delete(ing);
+    }
+  }
+  ingredientsOf.delete(itemId);
+}
+
+function link(item) {
+  const itemId = String(item._id);
+  unlink(itemId);
+  const ids = [...new Set((item.ingredients || []).map((r) => r.ingredient).filter(Boolean).map(String))];
+  for (const ing of ids) {
+    if (!byIngredient.has(ing)) byIngredient.set(ing, new Set());
+    byIngredient.get(ing).add(itemId);
+  }
+  ingredientsOf.set(itemId, ids);
+  if (item.updatedAt && (!lastUpdated || item.updatedAt > lastUpdated)) lastUpdated = item.updatedAt;
+}
+
+function lookup(ingredientIds) {
+  const items = new Set();
+  for (const ing of ingredientIds) {
+    for (const itemId of byIngredient.get(String(ing)) || []) items.add(itemId);
+  }
+  return [...items];
+}
+
+class DishIndexService {
+  // Build the whole index with one projected scan
+  static async rebuild() {
+    const items = await Item.find({}, INDEX_FIELDS).lean();
+    byIngredient.clear();
+    ingredientsOf.clear();
+    lastUpdated = null;
+    items.forEach(link);
+    lastCheck = Date.now();
+    return ingredientsOf.size;
+  }
+
+  // Built once; afterwards items updated since the newest one seen are re-indexed, and a count
+  // drift (deletes made elsewhere) triggers a rebuild
+  static async ensureFresh() {
+    if (!building) {
+      building = DishIndexService.rebuild().catch((e) => {
+        building = null;
+        throw e;
+      });
+    }
+    await building;
+    if (Date.now() - lastCheck < REFRESH_MS) return;
+    lastCheck = Date.now();
+    const changed = await Item.find(lastUpdated ? { updatedAt: { $gte: lastUpdated } } : {}, INDEX_FIELDS).lean();
+    changed.forEach(link);
+    if ((await Item.estimatedDocumentCount()) !== ingredientsOf.size) await DishIndexService.rebuild();
+  }
+
+  // Keep the index in step with item writes made through this process
+  static upsertItem(item) {
+    if (building) link(item);
+  }
+
+  static removeItem(itemId) {
+    if (building) unlink(String(itemId));
+  }
+
+  /**
+   * Ids of the items whose recipe uses any of the ingredients.
+   * @param {Array<string|ObjectId>} ingredientIds
+   * @returns {Promise<string[]>}
+   */
+  static async itemsUsing(ingredientIds) {
+    await DishIndexService.ensureFresh();
+    return lookup(ingredientIds || []);
+  }
+
+  /**
+   * Switch dishes off when one of their ingredients runs out (no stock, marked out of stock by
+   * hand, or deleted), and back on once every ingredient is in stock again. Each direction is
+   * one updateMany; only dishes switched off here come back, never ones a manager disabled.
+   * @param {Array<string|ObjectId>} ingredientIds - ingredients whose stock just changed
+   * @returns {Promise<{disabled: number, enabled: number}>}
+   */
+  static async syncAvailability(ingredientIds) {
+    const ids = [...new Set((ingredientIds || []).filter(Boolean).map(String))];
+    const result = { disabled: 0, enabled: 0 };
+    if (!ids.length) return result;
+    await DishIndexService.ensureFresh();
+    const docs = await Ingredient.find({ _id: { $in: ids } }, STOCK_FIELDS).lean();
+    const byId = new Map(docs.map((d) => [String(d._id), d]));
+    const out = ids.filter((id) => isOut(byId.get(id)));
+    const back = ids.filter((id) => !isOut(byId.get(id)));
+
+    const toDisable = lookup(out);
+    if (toDisable.length) {
+      const res = await Item.updateMany(
+        { _id: { $in: toDisable }, isAvailable: { $ne: false } },
+        { $set: { isAvailable: false, disabledForStock: true } }
+      );
+      result.disabled = res.modifiedCount || 0;
+    }
+
+    const disabledSet = new Set(toDisable);
+    const candidates = lookup(back).filter((itemId) => !disabledSet.has(itemId));
+    if (candidates.length) {
+      const needed = new Set();
+      for (const itemId of candidates) (ingredientsOf.get(itemId) || []).forEach((ing) => needed.add(ing));
+      const stock = await Ingredient.find({ _id: { $in: [...needed] } }, STOCK_FIELDS).lean();
+      const inStock = new Set(stock.filter((d) => !isOut(d)).map((d) => String(d._id)));
+      const ready = candidates.filter((itemId) => (ingredientsOf.get(itemId) || []).every((ing) => inStock.has(ing)));
+      if (ready.length) {
+        const res = await Item.updateMany(
+          { _id: { $in: ready }, disabledForStock: true },
+          { $set: { isAvailable: true, disabledForStock: false } }
+        );
+        result.enabled = res.modifiedCount || 0;
+      }
+    }
+    return result;
+  }
+
+  // Fire-and-forget wrapper so stock changes never wait on or fail because of menu upkeep
+  static syncInBackground(ingredientIds) {
+    DishIndexService.syncAvailability(ingredientIds)
+      .catch((e) => console.error('Failed to sync dish availability', e.message));
+  }
+}
+
+module.exports = DishIndexService;
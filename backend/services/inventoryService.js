@@ -1,7 +1,28 @@
+const mongoose = require('mongoose');
 const Item = require('../models/Item');
 const Ingredient = require('../models/Ingredient');
 const OldIngredient = require('../models/OldIngredient');
+const InventoryTransaction = require('../models/InventoryTransaction');
 const { convertToIngredientUnit: convertUnitUtil } = require('./unitUtils');
+const { toNameKey } = require('./nameUtils');
+const LedgerService = require('./ledgerService');
+const DishIndexService = require('./dishIndexService');
+
+const ITEM_FIELDS = { name: 1, nameKey: 1, price: 1, ingredients: 1 };
+const INGREDIENT_FIELDS = { name: 1, nameKey: 1, unit: 1, currentStock: 1, pricePerUnit: 1, isManuallyOutOfStock: 1 };
+
+const escapeRegex = (s) => String(s).replace(/[.*+?^${}()|[\]\\]/g, '\\$&');
+
+// Thrown inside a deduction when a guarded $inc matched nothing (another till took the stock first)
+class InsufficientStockError extends Error {
+  constructor(ingredients) {
+    super(`Insufficient stock for ${ingredients.join(', ')}`);
+    this.ingredients = ingredients;
+  }
+}
+
+// null until the first deduction finds out whether the server runs transactions (replica set / mongos)
+let transactionsSupported = null;
 
 class InventoryService {
   // Convert requirement units to ingredient's unit via shared utils
@@ -10,71 +31,245 @@ class InventoryService {
   }
 
   /**
-   * Helper to subtract from main Ingredient and FIFO from OldIngredient batches
-   * @param {import('../models/Ingredient')} ingredient
-   * @param {number} requiredQuantity - in the ingredient's unit
-   * @param {string|null} contextName
+   * Case-insensitive partial name match (the legacy lookup) for many names in one query.
+   * @returns {Promise<Map<string, object>>} first matching lean document per name
    */
-  static async subtractFromIngredientAndBatches(ingredient, requiredQuantity, contextName = null) {
-    if (!ingredient) {
-      return { success: false, error: 'Ingredient not provided' };
+  static async findByNames(Model, names, projection) {
+    const unique = [...new Set(names.filter(Boolean))];
+    if (!unique.length) return new Map();
+    const patterns = unique.map((n) => new RegExp(escapeRegex(n), 'i'));
+    const docs = await Model.find({ name: { $in: patterns } }, projection).lean();
+    const found = new Map();
+    unique.forEach((n, i) => {
+      const doc = docs.find((d) => patterns[i].test(d.name || ''));
+      if (doc) found.set(n, doc);
+    });
+    return found;
+  }
+
+  /**
+   * Menu items for a list of order lines: one query by _id / nameKey, plus one partial-name
+   * query for whatever is left. Returns lean documents (or null) aligned with orderItems.
+   */
+  static async resolveOrderItems(orderItems) {
+    const ids = orderItems.map((o) => o.item).filter((id) => id && mongoose.isValidObjectId(id));
+    const keys = orderItems.map((o) => toNameKey(o.name)).filter(Boolean);
+    const or = [];
+    if (ids.length) or.push({ _id: { $in: ids } });
+    if (keys.length) or.push({ nameKey: { $in: keys } });
+    const docs = or.length ? await Item.find({ $or: or }, ITEM_FIELDS).lean() : [];
+    const byId = new Map(docs.map((d) => [String(d._id), d]));
+    const byKey = new Map(docs.map((d) => [d.nameKey || toNameKey(d.name), d]));
+    const resolved = orderItems.map((o) => (o.item && byId.get(String(o.item))) || byKey.get(toNameKey(o.name)) || null);
+
+    const unresolved = orderItems.filter((o, i) => !resolved[i] && o.name).map((o) => o.name);
+    if (unresolved.length) {
+      const byName = await this.findByNames(Item, unresolved, ITEM_FIELDS);
+      orderItems.forEach((o, i) => {
+        if (!resolved[i] && o.name) resolved[i] = byName.get(o.name) || null;
+      });
     }
-    if (ingredient.currentStock < requiredQuantity) {
-      return { success: false, error: `Insufficient stock for ${ingredient.name}` };
+    return resolved;
+  }
+
+  /**
+   * Ingredients for a list of requirements: one query by _id / nameKey, plus one partial-name
+   * query for names that have no exact match. Returns lean documents (or null) aligned with requirements.
+   */
+  static async resolveIngredients(requirements) {
+    const ids = requirements.map((r) => r.ingredientId).filter((id) => id && mongoose.isValidObjectId(id));
+    const keys = requirements.map((r) => toNameKey(r.name)).filter(Boolean);
+    const or = [];
+    if (ids.length) or.push({ _id: { $in: ids } });
+    if (keys.length) or.push({ nameKey: { $in: keys } });
+    const docs = or.length ? await Ingredient.find({ $or: or }, INGREDIENT_FIELDS).lean() : [];
+    const byId = new Map(docs.map((d) => [String(d._id), d]));
+    const byKey = new Map(docs.map((d) => [d.nameKey || toNameKey(d.name), d]));
+    const resolved = requirements.map((r) =>
+      (r.ingredientId && byId.get(String(r.ingredientId))) || (r.name && byKey.get(toNameKey(r.name))) || null);
+
+    const unresolved = requirements.filter((r, i) => !resolved[i] && r.name).map((r) => r.name);
+    if (unresolved.length) {
+      const byName = await this.findByNames(Ingredient, unresolved, INGREDIENT_FIELDS);
+      requirements.forEach((r, i) => {
+        if (!resolved[i] && r.name) resolved[i] = byName.get(r.name) || null;
+      });
     }
+    return resolved;
+  }
 
-    const previousStock = ingredient.currentStock;
-    ingredient.currentStock -= requiredQuantity;
-    await ingredient.save();
+  /**
+   * Recipe lines of an order line: the item's own ingredients, else the predefined mapping.
+   * @returns {Array|null}
+   */
+  static requirementsFor(orderItem, itemDoc) {
+    if (itemDoc && Array.isArray(itemDoc.ingredients) && itemDoc.ingredients.length) {
+      return itemDoc.ingredients.map((r) => ({
+        name: r.name || undefined,
+        ingredientId: r.ingredient,
+        quantity: r.quantity,
+        unit: r.unit,
+      }));
+    }
+    return this.getDishIngredientRequirements(itemDoc ? itemDoc.name : orderItem.name);
+  }
 
-    // Deduct from oldest batches first (FIFO)
-    try {
-      let remaining = requiredQuantity;
-      const batches = await OldIngredient.find({
-        originalIngredient: ingredient._id,
-        currentStock: { $gt: 0 }
-      }).sort({ snapshotDate: 1, createdAt: 1 });
-
-      for (const batch of batches) {
-        if (remaining <= 0) break;
-        const takeQuantity = Math.min(batch.currentStock, remaining);
-        batch.currentStock -= takeQuantity;
-        await batch.save();
-        remaining -= takeQuantity;
+  /**
+   * Deduct a set of usages atomically. Usages are summed per ingredient and applied with one
+   * bulkWrite of guarded $inc (currentStock >= need), so concurrent orders can never take the
+   * same stock twice; FIFO batches are drawn down with one more bulkWrite and every usage is
+   * logged with one insertMany. On a replica set it all runs in one transaction; on a
+   * standalone server the guarded updates are sent concurrently and undone if any misses,
+   * or if logging the usage or drawing down batches fails (which fails the order either way).
+   * @param {Array<{ingredient: object, quantity: number, contextName: ?string}>} usages
+   *   quantities in the ingredient's unit, ingredient a (lean) Ingredient document
+   * @throws {InsufficientStockError} when stock ran out; nothing is deducted
+   */
+  static async applyDeductions(usages) {
+    const totals = new Map();
+    for (const u of usages) {
+      if (!(u.quantity > 0)) continue;
+      const key = String(u.ingredient._id);
+      const entry = totals.get(key) || { ingredient: u.ingredient, need: 0 };
+      entry.need += u.quantity;
+      totals.set(key, entry);
+    }
+    if (!totals.size) return;
+
+    const needs = [...totals.values()];
+    const ops = needs.map(({ ingredient, need }) => ({
+      updateOne: {
+        filter: { _id: ingredient._id, currentStock: { $gte: need }, isManuallyOutOfStock: { $ne: true } },
+        update: { $inc: { currentStock: -need } },
+      },
+    }));
+    const now = new Date();
+    const transactions = usages.filter((u) => u.quantity > 0).map((u) => ({
+      ingredient: u.ingredient._id,
+      quantity: u.quantity,
+      operation: 'subtract',
+      kind: 'usage',
+      unitPrice: Number(u.ingredient.pricePerUnit || 0),
+      amount: Number(u.ingredient.pricePerUnit || 0) * u.quantity,
+      date: now,
+      notes: u.contextName ? `Used for preparing ${u.contextName}` : 'Usage deduction',
+    }));
+
+    if (transactionsSupported !== false) {
+      const session = await mongoose.startSession();
+      try {
+        await session.withTransaction(async () => {
+          const res = await Ingredient.bulkWrite(ops, { ordered: false, session });
+          if (res.matchedCount !== ops.length) {
+            throw new InsufficientStockError(await this.shortIngredients(needs, session));
+          }
+          await this.consumeBatches(needs, session);
+          await InventoryTransaction.insertMany(transactions, { session });
+        });
+        transactionsSupported = true;
+        await LedgerService.recordQuietly(transactions);
+        DishIndexService.syncInBackground(needs.map((n) => n.ingredient._id));
+        return;
+      } catch (err) {
+        if (err instanceof InsufficientStockError || !this.isTransactionUnsupported(err)) throw err;
+        transactionsSupported = false;
+      } finally {
+        await session.endSession();
       }
-      // If remaining > 0 here, it means batch records are out-of-sync with Ingredient stock.
-      // We already guarded with Ingredient stock check, so we won't fail the operation.
-    } catch (e) {
-      // Non-fatal; keep operation resilient
     }
 
-    // Log inventory transaction
+    // Standalone server: same guards, each update's own result tells what to undo
+    const results = await Promise.all(ops.map((op) => Ingredient.updateOne(op.updateOne.filter, op.updateOne.update)));
+    const missed = needs.filter((n, i) => results[i].matchedCount === 0);
+    if (missed.length) {
+      await this.restoreStock(needs.filter((n, i) => results[i].matchedCount > 0));
+      throw new InsufficientStockError(missed.map(({ ingredient }) => ingredient.name));
+    }
+    // Usage history feeds the ledger and the forecasts: losing it fails the order, as it does
+    // inside the transaction, and the deduction is undone by hand
+    let logged = [];
     try {
-      const InventoryTransaction = require('../models/InventoryTransaction');
-      await InventoryTransaction.create({
-        ingredient: ingredient._id,
-        quantity: requiredQuantity,
-        operation: 'subtract',
-        kind: 'usage',
-        unitPrice: Number(ingredient.pricePerUnit || 0),
-        amount: Number(ingredient.pricePerUnit || 0) * requiredQuantity,
-        date: new Date(),
-        notes: contextName ? `Used for preparing ${contextName}` : `Usage deduction`,
-      });
-    } catch (e) {}
+      logged = await InventoryTransaction.insertMany(transactions);
+      await this.consumeBatches(needs, null);
+    } catch (err) {
+      console.error('Failed to record inventory usage; undoing the deduction', err.message);
+      try {
+        if (logged.length) await InventoryTransaction.deleteMany({ _id: { $in: logged.map((t) => t._id) } });
+        await this.restoreStock(needs);
+      } catch (e) {
+        console.error('Failed to undo an inventory deduction', e.message);
+      }
+      throw err;
+    }
+    await LedgerService.recordQuietly(transactions);
+    DishIndexService.syncInBackground(needs.map((n) => n.ingredient._id));
+  }
 
-    return {
-      success: true,
-      previousStock,
-      newStock: ingredient.currentStock,
-    };
+  // Give back deducted quantities (standalone server, no transaction to abort)
+  static async restoreStock(needs) {
+    if (!needs.length) return;
+    await Ingredient.bulkWrite(needs.map(({ ingredient, need }) => ({
+      updateOne: { filter: { _id: ingredient._id }, update: { $inc: { currentStock: need } } },
+    })), { ordered: false });
   }
+
+  // Names of the ingredients whose guard failed (read inside the aborting transaction)
+  static async shortIngredients(needs, session) {
+    const docs = await Ingredient.find({ _id: { $in: needs.map((n) => n.ingredient._id) } }, INGREDIENT_FIELDS)
+      .session(session).lean();
+    const byId = new Map(docs.map((d) => [String(d._id), d]));
+    return needs
+      .filter(({ ingredient, need }) => {
+        const doc = byId.get(String(ingredient._id));
+        return !doc || doc.isManuallyOutOfStock || doc.currentStock < need;
+      })
+      .map(({ ingredient }) => ingredient.name);
+  }
+
+  static isTransactionUnsupported(err) {
+    return err && (err.code === 20 || /Transaction numbers are only allowed|replica set/i.test(err.message || ''));
+  }
+
   /**
-   * Process an order and deduct ingredients from inventory
+   * Draw the deducted quantities from the oldest OldIngredient batches first (FIFO):
+   * one find across all ingredients, one guarded bulkWrite.
+   */
+  static async consumeBatches(needs, session) {
+    const remaining = new Map(needs.map(({ ingredient, need }) => [String(ingredient._id), need]));
+    const batches = await OldIngredient.find(
+      { originalIngredient: { $in: needs.map((n) => n.ingredient._id) }, currentStock: { $gt: 0 } },
+      { originalIngredient: 1, currentStock: 1 }
+    ).sort({ snapshotDate: 1, createdAt: 1 }).session(session).lean();
+
+    const ops = [];
+    for (const batch of batches) {
+      const key = String(batch.originalIngredient);
+      const left = remaining.get(key);
+      if (!(left > 0)) continue;
+      const take = Math.min(batch.currentStock, left);
+      ops.push({
+        updateOne: {
+          filter: { _id: batch._id, currentStock: { $gte: take } },
+          update: { $inc: { currentStock: -take } },
+        },
+      });
+      remaining.set(key, left - take);
+    }
+    // Whatever is left over means batch records are out of sync with Ingredient stock; not fatal
+    if (ops.length) {
+      await OldIngredient.bulkWrite(ops, { ordered: false, session });
+    }
+  }
+
+  /**
+   * Process an order and deduct ingredients from inventory. Items and ingredients for the
+   * whole order are resolved with one query each, requirements are summed per ingredient and
+   * deducted all-or-nothing (see applyDeductions).
    * @param {Array} orderItems - Array of order items with name, quantity, etc.
+   * @param {Array|null} itemDocs - the lines' items when already resolved (resolveOrderItems)
    * @returns {Object} - Result with success status and any errors
    */
-  static async processOrderInventory(orderItems) {
+  static async processOrderInventory(orderItems, itemDocs = null) {
     const results = {
       success: true,
       errors: [],
@@ -83,48 +278,83 @@ class InventoryService {
     };
 
     try {
-      for (const orderItem of orderItems) {
+      itemDocs = itemDocs || await this.resolveOrderItems(orderItems);
+      const lines = [];
+      orderItems.forEach((orderItem, i) => {
         const itemName = orderItem.name;
-        const quantity = orderItem.quantity;
+        const requirements = this.requirementsFor(orderItem, itemDocs[i]);
+        if (!requirements) {
+          results.errors.push(`Cannot prepare ${orderItem.quantity}x ${itemName}: No ingredient requirements defined for ${itemName}. Please add this dish to the items table or define its ingredient requirements.`);
+          return;
+        }
+        lines.push({ orderItem, requirements });
+      });
 
-        // First, try to find the item in the items table
-        let item = await Item.findOne({ 
-          name: { $regex: new RegExp(itemName, 'i') } 
+      const flat = lines.flatMap((l) => l.requirements);
+      const ingredients = await this.resolveIngredients(flat);
+      const totals = new Map();
+      let offset = 0;
+      for (const line of lines) {
+        const { quantity } = line.orderItem;
+        line.usages = line.requirements.map((requirement, j) => {
+          const ingredient = ingredients[offset + j];
+          if (!ingredient) return { requirement, ingredient: null };
+          const required = this.convertToIngredientUnit(requirement.unit, ingredient.unit, requirement.quantity * quantity);
+          const key = String(ingredient._id);
+          totals.set(key, (totals.get(key) || 0) + required);
+          return { requirement, ingredient, quantity: required };
         });
+        offset += line.requirements.length;
+      }
 
-        if (item) {
-          // Prefer deducting from ingredients via recipe to record usage properly
-          const preparationResult = await this.prepareFromIngredients(item.name, quantity, { itemDoc: item });
-          if (preparationResult.success) {
-            results.processedItems.push({
-              name: itemName,
-              type: 'prepared',
-              quantity: quantity,
-              ingredientsUsed: preparationResult.ingredientsUsed
-            });
-          } else {
-            results.errors.push(`Cannot prepare ${quantity}x ${itemName}: ${preparationResult.error}`);
-            results.success = false;
+      for (const line of lines) {
+        const { name: itemName, quantity } = line.orderItem;
+        const missing = [];
+        for (const u of line.usages) {
+          if (!u.ingredient) {
+            missing.push(`${u.requirement.name} (not found in inventory)`);
+            continue;
           }
-        } else {
-          // Item doesn't exist, try to prepare from ingredients using predefined ingredient requirements
-          const preparationResult = await this.prepareFromIngredients(itemName, quantity);
-          if (preparationResult.success) {
-            results.processedItems.push({
-              name: itemName,
-              type: 'prepared',
-              quantity: quantity,
-              ingredientsUsed: preparationResult.ingredientsUsed
-            });
-          } else {
-            results.errors.push(`Cannot prepare ${quantity}x ${itemName}: ${preparationResult.error}`);
-            results.success = false;
+          const need = totals.get(String(u.ingredient._id));
+          if (u.ingredient.isManuallyOutOfStock || u.ingredient.currentStock < need) {
+            missing.push(`${u.ingredient.name} (need ${need} ${u.ingredient.unit}, have ${u.ingredient.currentStock} ${u.ingredient.unit})`);
           }
         }
+        if (missing.length) {
+          results.errors.push(`Cannot prepare ${quantity}x ${itemName}: Insufficient ingredients: ${missing.join(', ')}`);
+        }
+      }
+      if (results.errors.length) {
+        results.success = false;
+        return results;
+      }
+
+      await this.applyDeductions(lines.flatMap((line) => line.usages.map((u) => ({
+        ingredient: u.ingredient,
+        quantity: u.quantity,
+        contextName: `${line.orderItem.quantity}x ${line.orderItem.name}`,
+      }))));
+
+      // Stock as read before the deduction, stepped through the order's lines
+      const running = new Map();
+      for (const line of lines) {
+        results.processedItems.push({
+          name: line.orderItem.name,
+          type: 'prepared',
+          quantity: line.orderItem.quantity,
+          ingredientsUsed: line.usages.map(({ ingredient, quantity }) => {
+            const key = String(ingredient._id);
+            const previousStock = running.has(key) ? running.get(key) : ingredient.currentStock;
+            running.set(key, previousStock - quantity);
+            return { name: ingredient.name, quantity, unit: ingredient.unit, previousStock, newStock: previousStock - quantity };
+          }),
+        });
       }
     } catch (error) {
       results.success = false;
-      results.errors.push(`Inventory processing error: ${error.message}`);
+      results.errors.push(error instanceof InsufficientStockError
+        ? `Cannot fulfill order: ${error.message} (taken by another order)`
+        : `Inventory processing error: ${error.message}`);
     }
 
     return results;
@@ -137,64 +367,12 @@ class InventoryService {
    * @returns {Object} - Result with success status and ingredients used
    */
   static async prepareFromIngredients(itemName, quantity, options = {}) {
-    try {
-      const { itemDoc: providedItemDoc } = options;
-      // Try to read recipe from Items collection first
-      const itemDoc = providedItemDoc || await Item.findOne({ name: { $regex: new RegExp(itemName, 'i') } });
-      let dishRequirements = null;
-      if (itemDoc && Array.isArray(itemDoc.ingredients) && itemDoc.ingredients.length) {
-        dishRequirements = itemDoc.ingredients.map(r => ({
-          name: r.name || undefined,
-          ingredientId: r.ingredient,
-          quantity: r.quantity,
-          unit: r.unit,
-        }));
-      }
-      if (!dishRequirements) {
-        // Fallback to predefined mapping
-        dishRequirements = this.getDishIngredientRequirements(itemName);
-      }
-      
-      if (!dishRequirements) {
-        return {
-          success: false,
-          error: `No ingredient requirements defined for ${itemName}. Please add this dish to the items table or define its ingredient requirements.`
-        };
-      }
-
-      // Check if we have enough ingredients
-      const ingredientCheck = await this.checkIngredientAvailability(dishRequirements, quantity);
-      
-      if (!ingredientCheck.available) {
-        return {
-          success: false,
-          error: `Insufficient ingredients: ${ingredientCheck.missingIngredients.join(', ')}`
-        };
-      }
-
-      // Deduct ingredients from inventory
-      const deductionResult = await this.deductIngredients(dishRequirements, quantity, {
-        resolvedDetails: ingredientCheck.details,
-        contextName: itemName,
-      });
-      
-      if (deductionResult.success) {
-        return {
-          success: true,
-          ingredientsUsed: deductionResult.ingredientsUsed
-        };
-      } else {
-        return {
-          success: false,
-          error: deductionResult.error
-        };
-      }
-    } catch (error) {
-      return {
-        success: false,
-        error: `Ingredient processing error: ${error.message}`
-      };
+    const { itemDoc } = options;
+    const result = await this.processOrderInventory([{ item: itemDoc ? itemDoc._id : null, name: itemName, quantity }]);
+    if (!result.success) {
+      return { success: false, error: result.errors.join('; ') };
     }
+    return { success: true, ingredientsUsed: result.processedItems[0].ingredientsUsed };
   }
 
   /**
@@ -272,21 +450,13 @@ class InventoryService {
   static async checkIngredientAvailability(dishRequirements, quantity) {
     const missingIngredients = [];
     const details = [];
+    const ingredients = await this.resolveIngredients(dishRequirements);
 
-    for (const requirement of dishRequirements) {
-      let ingredient = null;
-      if (requirement.ingredientId) {
-        ingredient = await Ingredient.findById(requirement.ingredientId);
-      }
-      if (!ingredient && requirement.name) {
-        ingredient = await Ingredient.findOne({ 
-          name: { $regex: new RegExp(requirement.name, 'i') } 
-        });
-      }
-      
+    dishRequirements.forEach((requirement, i) => {
+      const ingredient = ingredients[i];
       if (!ingredient) {
         missingIngredients.push(`${requirement.name} (not found in inventory)`);
-        continue;
+        return;
       }
 
       const requiredQuantityRaw = requirement.quantity * quantity;
@@ -302,7 +472,7 @@ class InventoryService {
         available: ingredient.isManuallyOutOfStock ? 0 : ingredient.currentStock,
         ingredientDoc: ingredient
       });
-    }
+    });
 
     return {
       available: missingIngredients.length === 0,
@@ -312,64 +482,42 @@ class InventoryService {
   }
 
   /**
-   * Deduct ingredients from inventory
+   * Deduct ingredients from inventory (all-or-nothing, see applyDeductions)
    * @param {Array} dishRequirements - Array of required ingredients
    * @param {number} quantity - Quantity to prepare
    * @returns {Object} - Result with deduction status
    */
   static async deductIngredients(dishRequirements, quantity, options = {}) {
-    const ingredientsUsed = [];
     const { resolvedDetails = null, contextName = null } = options;
 
     try {
-      if (resolvedDetails) {
-        for (const d of resolvedDetails) {
-          const ingredient = d.ingredientDoc;
-          const requiredQuantity = d.required;
-          if (!ingredient) {
-            return { success: false, error: 'Ingredient not found in resolved details' };
-          }
-          const subResult = await this.subtractFromIngredientAndBatches(ingredient, requiredQuantity, contextName ? `${quantity}x ${contextName}` : null);
-          if (!subResult.success) {
-            return { success: false, error: subResult.error };
-          }
-          ingredientsUsed.push({
-            name: ingredient.name,
-            quantity: requiredQuantity,
-            unit: ingredient.unit,
-            previousStock: subResult.previousStock,
-            newStock: subResult.newStock
-          });
-        }
-      } else {
-        for (const requirement of dishRequirements) {
-          let ingredient = null;
-          if (requirement.ingredientId) {
-            ingredient = await Ingredient.findById(requirement.ingredientId);
-          }
-          if (!ingredient && requirement.name) {
-            ingredient = await Ingredient.findOne({ 
-              name: { $regex: new RegExp(requirement.name, 'i') } 
-            });
-          }
-          if (!ingredient) {
-            return { success: false, error: `Ingredient ${requirement.name} not found` };
-          }
-          const requiredQuantity = this.convertToIngredientUnit(requirement.unit, ingredient.unit, requirement.quantity * quantity);
-          const subResult = await this.subtractFromIngredientAndBatches(ingredient, requiredQuantity, contextName ? `${quantity}x ${contextName}` : null);
-          if (!subResult.success) {
-            return { success: false, error: subResult.error };
-          }
-          ingredientsUsed.push({
-            name: ingredient.name,
-            quantity: requiredQuantity,
-            unit: ingredient.unit,
-            previousStock: subResult.previousStock,
-            newStock: subResult.newStock
-          });
+      let details = resolvedDetails;
+      if (!details) {
+        const ingredients = await this.resolveIngredients(dishRequirements);
+        const notFound = dishRequirements.find((r, i) => !ingredients[i]);
+        if (notFound) {
+          return { success: false, error: `Ingredient ${notFound.name} not found` };
         }
+        details = dishRequirements.map((r, i) => ({
+          name: ingredients[i].name,
+          unit: ingredients[i].unit,
+          required: this.convertToIngredientUnit(r.unit, ingredients[i].unit, r.quantity * quantity),
+          ingredientDoc: ingredients[i],
+        }));
       }
+      await this.applyDeductions(details.map((d) => ({
+        ingredient: d.ingredientDoc,
+        quantity: d.required,
+        contextName: contextName ? `${quantity}x ${contextName}` : null,
+      })));
 
+      const running = new Map();
+      const ingredientsUsed = details.map((d) => {
+        const key = String(d.ingredientDoc._id);
+        const previousStock = running.has(key) ? running.get(key) : d.ingredientDoc.currentStock;
+        running.set(key, previousStock - d.required);
+        return { name: d.name, quantity: d.required, unit: d.unit, previousStock, newStock: previousStock - d.required };
+      });
       return {
         success: true,
         ingredientsUsed
@@ -377,7 +525,7 @@ class InventoryService {
     } catch (error) {
       return {
         success: false,
-        error: `Deduction error: ${error.message}`
+        error: error instanceof InsufficientStockError ? error.message : `Deduction error: ${error.message}`
       };
     }
   }
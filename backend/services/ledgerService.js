@@ -0,0 +1,372 @@
+const mongoose = require('mongoose');
+const DailyInventory = require('../models/DailyInventory');
+const InventoryTransaction = require('../models/InventoryTransaction');
+const Ingredient = require('../models/Ingredient');
+
+// Service day starts at 02:00 local time
+const DAY_START_HOUR = 2;
+const TIMEZONE = Intl.DateTimeFormat().resolvedOptions().timeZone;
+// Transaction kinds that feed the ledger, and the column each one adds to
+const FLOW_FIELDS = { purchase: 'purchaseQty', dispose: 'disposeQty', usage: 'usageQty' };
+const EPSILON = 1e-6;
+
+const emptyFlows = () => ({ purchaseQty: 0, disposeQty: 0, usageQty: 0 });
+const netOf = (f) => f.purchaseQty - f.disposeQty - f.usageQty;
+// Stock never closes below zero. Rows kept by $inc may hold a negative close (usage recorded
+// against stock the ledger never saw arrive), so stored closes are clamped when read.
+const closeOf = (di) => Math.max(Number(di.closeQty) || 0, 0);
+const INGREDIENT_FIELDS = { name: 1, unit: 1, currentStock: 1 };
+
+function ledgerEntry(ingredient, openQty, flows = emptyFlows()) {
+  return {
+    ingredient: ingredient._id,
+    name: ingredient.name,
+    unit: ingredient.unit,
+    openQty,
+    ...flows,
+    closeQty: Math.max(openQty + netOf(flows), 0),
+  };
+}
+
+class LedgerService {
+  // Service day of a calendar date (the date's 02:00); defaults to today
+  static serviceDay(dateInput) {
+    const d = dateInput ? new Date(dateInput) : new Date();
+    return new Date(d.getFullYear(), d.getMonth(), d.getDate(), DAY_START_HOUR, 0, 0, 0);
+  }
+
+  // Service day a moment falls in (01:30 belongs to the previous day)
+  static serviceDayOf(moment) {
+    const d = new Date(moment);
+    d.setHours(d.getHours() - DAY_START_HOUR);
+    return LedgerService.serviceDay(d);
+  }
+
+  static addDays(day, n) {
+    const d = new Date(day);
+    d.setDate(d.getDate() + n);
+    return d;
+  }
+
+  /**
+   * Net ledger change (purchase - dispose - usage) per ingredient recorded from `since` on:
+   * one aggregate over InventoryTransaction.
+   * @returns {Promise<Map<string, number>>}
+   */
+  static async netSince(since, ingredientIds = null) {
+    const match = { kind: { $in: Object.keys(FLOW_FIELDS) }, date: { $gte: since } };
+    if (ingredientIds) match.ingredient = { $in: ingredientIds.map((id) => new mongoose.Types.ObjectId(String(id))) };
+    const rows = await InventoryTransaction.aggregate([
+      { $match: match },
+      { $group: {
+        _id: '$ingredient',
+        net: { $sum: { $cond: [{ $eq: ['$kind', 'purchase'] }, '$quantity', { $multiply: ['$quantity', -1] }] } },
+      } },
+    ]);
+    return new Map(rows.map((r) => [String(r._id), r.net]));
+  }
+
+  // Stock at the start of `date`: current stock minus every change recorded since. The
+  // aggregate is narrowed to these ingredients unless they are all of them.
+  static async stockAt(date, ingredients, all = false) {
+    const net = await LedgerService.netSince(date, all ? null : ingredients.map((ing) => ing._id));
+    return new Map(ingredients.map((ing) => [
+      String(ing._id), Math.max((Number(ing.currentStock) || 0) - (net.get(String(ing._id)) || 0), 0),
+    ]));
+  }
+
+  /**
+   * Create the day's document with a row for every ingredient, unless it already has rows.
+   * Opening stock is the previous day's close, else current stock minus the changes
+   * transactions recorded since the day began. Stock and transactions are both read from the
+   * database, so concurrent first writes of a day agree on it and none is counted twice.
+   * @param {Date} date - service day
+   */
+  static async seedDay(date) {
+    const prev = await DailyInventory.findOne({ date: LedgerService.addDays(date, -1) }, { ingredients: 1 }).lean();
+    const prevClose = new Map(prev ? prev.ingredients.map((di) => [String(di.ingredient), closeOf(di)]) : []);
+    const ingredients = await Ingredient.find({}, INGREDIENT_FIELDS).lean();
+    const unseen = ingredients.filter((ing) => !prevClose.has(String(ing._id)));
+    const fromStock = unseen.length
+      ? await LedgerService.stockAt(date, unseen, unseen.length === ingredients.length)
+      : new Map();
+    const entries = ingredients.map((ing) => {
+      const id = String(ing._id);
+      return ledgerEntry(ing, prevClose.has(id) ? prevClose.get(id) : fromStock.get(id));
+    });
+    try {
+      // Matches a missing document (upsert) or one created without rows; a populated day is left alone
+      await DailyInventory.updateOne(
+        { date, 'ingredients.0': { $exists: false } },
+        { $set: { ingredients: entries }, $setOnInsert: { finalized: false } },
+        { upsert: true }
+      );
+    } catch (e) {
+      // Another request seeded the day first (unique index on date)
+      if (e.code !== 11000) throw e;
+    }
+  }
+
+  /**
+   * Add freshly written InventoryTransactions to their days' ledgers: one $inc per day
+   * (arrayFilters over the ingredient rows), so the cost does not grow with the number of
+   * transactions already recorded. Finalized days are not touched. Call it once the
+   * transactions are saved: a day seeded here derives its opening stock from them.
+   * @param {Array} transactions - InventoryTransaction documents or plain objects
+   */
+  static async record(transactions) {
+    const byDay = new Map();
+    for (const tx of transactions || []) {
+      const field = FLOW_FIELDS[tx.kind];
+      const quantity = Number(tx.quantity) || 0;
+      if (!field || !tx.ingredient || quantity <= 0) continue;
+      const key = LedgerService.serviceDayOf(tx.date || new Date()).getTime();
+      const flows = byDay.get(key) || new Map();
+      const id = String(tx.ingredient._id || tx.ingredient);
+      const f = flows.get(id) || emptyFlows();
+      f[field] += quantity;
+      flows.set(id, f);
+      byDay.set(key, flows);
+    }
+    for (const [key, flows] of byDay) {
+      await LedgerService.applyFlows(new Date(key), flows);
+    }
+  }
+
+  /**
+   * Give ingredients created after the day was seeded (and not yet used that day, which would
+   * have added their row) a row opening at their current stock. Meant for the current day;
+   * a past day's current stock says nothing about its opening.
+   * @returns {Promise<number>} rows added
+   */
+  static async addMissingRows(date, daily) {
+    const present = new Set((daily.ingredients || []).map((di) => String(di.ingredient)));
+    const ingredients = await Ingredient.find({}, INGREDIENT_FIELDS).lean();
+    const missing = ingredients.filter((ing) => !present.has(String(ing._id)));
+    if (!missing.length) return 0;
+    await DailyInventory.bulkWrite(missing.map((ing) => ({
+      updateOne: {
+        filter: { date, finalized: { $ne: true }, 'ingredients.ingredient': { $ne: ing._id } },
+        update: { $push: { ingredients: ledgerEntry(ing, Math.max(Number(ing.currentStock) || 0, 0)) } },
+      },
+    })), { ordered: false });
+    return missing.length;
+  }
+
+  // A stored day as served: closing stock clamped at zero
+  static present(daily) {
+    const doc = daily && typeof daily.toObject === 'function' ? daily.toObject() : daily;
+    if (!doc) return doc;
+    return { ...doc, ingredients: (doc.ingredients || []).map((di) => ({ ...di, closeQty: closeOf(di) })) };
+  }
+
+  // record() for request handlers: the ledger is derived data, so a failure is logged, not raised
+  static async recordQuietly(transactions) {
+    try {
+      await LedgerService.record(transactions);
+    } catch (e) {
+      console.error('Failed to update the daily inventory ledger', e.message);
+    }
+  }
+
+  static async applyFlows(date, flows) {
+    const net = new Map([...flows].map(([id, f]) => [id, netOf(f)]));
+    let daily = await DailyInventory.findOne({ date }, { finalized: 1, 'ingredients.ingredient': 1 }).lean();
+    if (!daily || !daily.ingredients.length) {
+      await LedgerService.seedDay(date);
+      daily = await DailyInventory.findOne({ date }, { finalized: 1, 'ingredients.ingredient': 1 }).lean();
+    }
+    if (!daily || daily.finalized) return;
+
+    // Ingredients created since the day was seeded get their row now
+    const present = new Set(daily.ingredients.map((di) => String(di.ingredient)));
+    const missing = [...flows.keys()].filter((id) => !present.has(id));
+    if (missing.length) {
+      const ingredients = await Ingredient.find({ _id: { $in: missing } }, INGREDIENT_FIELDS).lean();
+      if (ingredients.length) {
+        const open = await LedgerService.stockAt(date, ingredients);
+        await DailyInventory.bulkWrite(ingredients.map((ing) => ({
+          updateOne: {
+            filter: { date, 'ingredients.ingredient': { $ne: ing._id } },
+            update: { $push: { ingredients: ledgerEntry(ing, open.get(String(ing._id))) } },
+          },
+        })), { ordered: false });
+      }
+    }
+
+    const inc = {};
+    const arrayFilters = [];
+    [...flows].forEach(([id, f], i) => {
+      const row = `i${i}`;
+      for (const field of Object.values(FLOW_FIELDS)) {
+        if (f[field]) inc[`ingredients.$[${row}].${field}`] = f[field];
+      }
+      inc[`ingredients.$[${row}].closeQty`] = net.get(id);
+      arrayFilters.push({ [`${row}.ingredient`]: new mongoose.Types.ObjectId(id) });
+    });
+    await DailyInventory.updateOne({ date, finalized: { $ne: true } }, { $inc: inc }, { arrayFilters });
+  }
+
+  /**
+   * Purchase/dispose/usage totals per service day and ingredient from InventoryTransaction.
+   * @returns {Promise<Map<number, Map<string, object>>>} day timestamp -> ingredient id -> flows
+   */
+  static async dailyFlows(from, to) {
+    const sumOf = (kind) => ({ $sum: { $cond: [{ $eq: ['$kind', kind] }, '$quantity', 0] } });
+    const rows = await InventoryTransaction.aggregate([
+      { $match: { date: { $gte: from, $lt: to }, kind: { $in: Object.keys(FLOW_FIELDS) } } },
+      { $group: {
+        _id: {
+          day: { $dateToString: { format: '%Y-%m-%d', date: { $subtract: ['$date', DAY_START_HOUR * 3600000] }, timezone: TIMEZONE } },
+          ingredient: '$ingredient',
+        },
+        purchaseQty: sumOf('purchase'),
+        disposeQty: sumOf('dispose'),
+        usageQty: sumOf('usage'),
+      } },
+    ]);
+    const byDay = new Map();
+    for (const row of rows) {
+      const [y, m, d] = row._id.day.split('-').map(Number);
+      const key = new Date(y, m - 1, d, DAY_START_HOUR).getTime();
+      if (!byDay.has(key)) byDay.set(key, new Map());
+      byDay.get(key).set(String(row._id.ingredient), {
+        purchaseQty: row.purchaseQty, disposeQty: row.disposeQty, usageQty: row.usageQty,
+      });
+    }
+    return byDay;
+  }
+
+  // Closing stock the day before `from`: that day's ledger, else current stock minus every net change since `from`
+  static async closingBefore(from, ingredients) {
+    const prev = await DailyInventory.findOne({ date: LedgerService.addDays(from, -1) }, { ingredients: 1 }).lean();
+    if (prev && prev.ingredients.length) {
+      return new Map(prev.ingredients.map((di) => [String(di.ingredient), closeOf(di)]));
+    }
+    return LedgerService.stockAt(from, ingredients, true);
+  }
+
+  /**
+   * Backfill and consistency check for service days from..to (inclusive). Missing days are
+   * built from transactions, each opening at the previous day's close. Existing days are
+   * checked: every row's purchase/dispose/usage must equal its transactions and its close
+   * must equal open + purchase - dispose - usage (not below zero). With fix, mismatched days are rewritten
+   * (keeping their opening stock), finalized or not.
+   */
+  static async backfill(from, to, { fix = false, onDay = null } = {}) {
+    const first = LedgerService.serviceDay(from);
+    const last = LedgerService.serviceDay(to);
+    const end = LedgerService.addDays(last, 1);
+    const [flowsByDay, storedDocs, ingredients] = await Promise.all([
+      LedgerService.dailyFlows(first, end),
+      DailyInventory.find({ date: { $gte: first, $lt: end } }).lean(),
+      Ingredient.find({}, INGREDIENT_FIELDS).lean(),
+    ]);
+    const stored = new Map(storedDocs.map((doc) => [new Date(doc.date).getTime(), doc]));
+    const ingredientsById = new Map(ingredients.map((ing) => [String(ing._id), ing]));
+    let prevClose = await LedgerService.closingBefore(first, ingredients);
+    const report = { days: 0, created: 0, consistent: 0, mismatched: [], fixed: 0 };
+
+    for (let date = first; date < end; date = LedgerService.addDays(date, 1)) {
+      report.days += 1;
+      const flows = flowsByDay.get(date.getTime()) || new Map();
+      const doc = stored.get(date.getTime());
+      let rows;
+      let status;
+
+      if (!doc || !doc.ingredients.length) {
+        rows = ingredients.map((ing) => {
+          const id = String(ing._id);
+          return ledgerEntry(ing, prevClose.get(id) || 0, flows.get(id));
+        });
+        await DailyInventory.updateOne(
+          { date },
+          { $set: { ingredients: rows }, $setOnInsert: { finalized: date < LedgerService.serviceDayOf(new Date()) } },
+          { upsert: true }
+        );
+        report.created += 1;
+        status = 'created';
+      } else {
+        const issues = [];
+        rows = doc.ingredients.map((di) => {
+          const expected = flows.get(String(di.ingredient)) || emptyFlows();
+          for (const field of Object.keys(expected)) {
+            if (Math.abs((Number(di[field]) || 0) - expected[field]) > EPSILON) {
+              issues.push({ ingredient: di.name, field, stored: di[field], expected: expected[field] });
+            }
+          }
+          const closeQty = Math.max((Number(di.openQty) || 0) + netOf(expected), 0);
+          if (Math.abs((Number(di.closeQty) || 0) - closeQty) > EPSILON) {
+            issues.push({ ingredient: di.name, field: 'closeQty', stored: di.closeQty, expected: closeQty });
+          }
+          return { ...di, ...expected, closeQty };
+        });
+        const present = new Set(doc.ingredients.map((di) => String(di.ingredient)));
+        for (const [id, f] of flows) {
+          const ing = ingredientsById.get(id);
+          if (present.has(id) || !ing) continue;
+          issues.push({ ingredient: ing.name, field: 'row', stored: null, expected: 'missing' });
+          rows.push(ledgerEntry(ing, prevClose.get(id) || 0, f));
+        }
+        if (!issues.length) {
+          report.consistent += 1;
+          status = 'consistent';
+        } else {
+          report.mismatched.push({ date, issues });
+          status = 'mismatched';
+          if (fix) {
+            await DailyInventory.updateOne({ _id: doc._id }, { $set: { ingredients: rows } });
+            report.fixed += 1;
+            status = 'fixed';
+          } else {
+            rows = doc.ingredients;
+          }
+        }
+      }
+      prevClose = new Map(rows.map((r) => [String(r.ingredient), closeOf(r)]));
+      if (onDay) onDay(date, status);
+    }
+    return report;
+  }
+
+  /**
+   * Weekly (Monday-based) or monthly rollups over the stored daily ledgers from..to
+   * (inclusive): opening stock of each period's first day, summed flows, closing stock of
+   * its last day. Reads only the precomputed daily documents.
+   */
+  static async rollup(from, to, period = 'week') {
+    const first = LedgerService.serviceDay(from);
+    const end = LedgerService.addDays(LedgerService.serviceDay(to), 1);
+    const days = await DailyInventory.find({ date: { $gte: first, $lt: end } }).sort({ date: 1 }).lean();
+    const periods = new Map();
+    for (const day of days) {
+      const date = new Date(day.date);
+      const start = period === 'month'
+        ? new Date(date.getFullYear(), date.getMonth(), 1, DAY_START_HOUR)
+        : LedgerService.addDays(date, -((date.getDay() + 6) % 7));
+      const key = start.getTime();
+      if (!periods.has(key)) periods.set(key, { period, start, end: date, days: 0, rows: new Map() });
+      const bucket = periods.get(key);
+      bucket.end = date;
+      bucket.days += 1;
+      for (const di of day.ingredients) {
+        const id = String(di.ingredient);
+        const row = bucket.rows.get(id);
+        if (!row) {
+          bucket.rows.set(id, {
+            ingredient: di.ingredient, name: di.name, unit: di.unit, openQty: di.openQty,
+            purchaseQty: di.purchaseQty, disposeQty: di.disposeQty, usageQty: di.usageQty, closeQty: closeOf(di),
+          });
+        } else {
+          row.purchaseQty += di.purchaseQty;
+          row.disposeQty += di.disposeQty;
+          row.usageQty += di.usageQty;
+          row.closeQty = closeOf(di);
+        }
+      }
+    }
+    return [...periods.values()].map(({ rows, ...bucket }) => ({ ...bucket, ingredients: [...rows.values()] }));
+  }
+}
+
+module.exports = LedgerService;
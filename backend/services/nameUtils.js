@@ -0,0 +1,9 @@
+// Normalized lookup key for names: lowercase with whitespace and hyphens removed.
+// Must stay in sync with normalize_title_for_match() in assistant.py.
+function toNameKey(name) {
+  return String(name || '').trim().toLowerCase().replace(/[\s-]+/g, '');
+}
+
+module.exports = {
+  toNameKey,
+};
@@ -0,0 +1,217 @@
+const Reservation = require('../models/Reservation');
+const ReservationSlot = require('../models/ReservationSlot');
+
+const SLOT_MINUTES = Number(process.env.RESERVATION_SLOT_MINUTES) || 30;
+// How long a party keeps its table
+const DINING_MINUTES = Number(process.env.RESERVATION_DINING_MINUTES) || 90;
+// Guests that can be seated at the same time
+const CAPACITY = Number(process.env.RESERVATION_CAPACITY) || 60;
+// Local opening hours; the last seating leaves a full dining time before closing
+const OPENING = process.env.RESERVATION_OPEN || '11:00';
+const CLOSING = process.env.RESERVATION_CLOSE || '23:00';
+// How far ahead "next free slots" looks
+const SEARCH_DAYS = 14;
+const SLOT_MS = SLOT_MINUTES * 60 * 1000;
+const DINING_MS = DINING_MINUTES * 60 * 1000;
+// Statuses whose guests occupy seats; cancelled and waitlisted ones do not
+const HOLDING_STATUSES = ['pending', 'confirmed', 'completed'];
+
+// Thrown when a guarded slot increment matched nothing; nothing is held
+class SlotFullError extends Error {
+  constructor(start) {
+    super(`No seats left at ${start.toISOString()}`);
+    this.start = start;
+  }
+}
+
+// Guarded increment of one slot. Two first bookings of a slot can both try to insert it; the
+// loser's duplicate key is retried once against the now existing document before it counts as full.
+async function holdSlot(start, guests) {
+  for (let attempt = 0; ; attempt += 1) {
+    try {
+      return await ReservationSlot.updateOne(
+        { start, guests: { $lte: CAPACITY - guests } },
+        { $inc: { guests } },
+        { upsert: true }
+      );
+    } catch (e) {
+      if (e.code !== 11000 || attempt) throw e;
+    }
+  }
+}
+
+const minutesOf = (hhmm) => {
+  const [h, m] = String(hhmm).split(':').map(Number);
+  return (h || 0) * 60 + (m || 0);
+};
+
+class ReservationSlotService {
+  static isSlotFull(err) {
+    return err instanceof SlotFullError;
+  }
+
+  // Slot starts (ms) covered by a table taken at `date` for the dining time
+  static slotsFor(date) {
+    const t = new Date(date).getTime();
+    const slots = [];
+    for (let s = Math.floor(t / SLOT_MS) * SLOT_MS; s < t + DINING_MS; s += SLOT_MS) slots.push(s);
+    return slots;
+  }
+
+  /**
+   * Guests a reservation puts on each slot (none while cancelled or waitlisted).
+   * @param {{date: Date, numberOfGuests: number, status: string}} reservation
+   * @returns {Map<number, number>} slot start (ms) -> guests
+   */
+  static contribution(reservation) {
+    const load = new Map();
+    const guests = Number(reservation && reservation.numberOfGuests) || 0;
+    if (!reservation || !HOLDING_STATUSES.includes(reservation.status || 'pending') || guests <= 0) return load;
+    for (const s of ReservationSlotService.slotsFor(reservation.date)) load.set(s, guests);
+    return load;
+  }
+
+  // Per-slot change when a reservation goes from `before` to `after` (either may be null)
+  static diff(before, after) {
+    const delta = new Map(ReservationSlotService.contribution(after));
+    for (const [s, g] of ReservationSlotService.contribution(before)) delta.set(s, (delta.get(s) || 0) - g);
+    for (const [s, g] of delta) if (!g) delta.delete(s);
+    return delta;
+  }
+
+  static negate(delta) {
+    return new Map([...delta].map(([s, g]) => [s, -g]));
+  }
+
+  /**
+   * Apply a per-slot change all-or-nothing. Increments are guarded upserts
+   * (guests <= capacity - party): a full slot matches nothing and the upsert then collides
+   * with the unique start index, so two bookings can never share the last seats. Increments
+   * that did apply are undone when any misses. Releases are applied after the increments,
+   * in one bulkWrite, so a moved booking never gives up its seats before it has new ones.
+   * @param {Map<number, number>} delta - slot start (ms) -> guests to add (negative releases)
+   * @throws {SlotFullError} when a slot has no room; nothing is changed
+   */
+  static async applyDelta(delta) {
+    const holds = [...delta].filter(([, g]) => g > 0);
+    const releases = [...delta].filter(([, g]) => g < 0);
+
+    const results = await Promise.allSettled(holds.map(([s, g]) => {
+      if (g > CAPACITY) return Promise.reject(new SlotFullError(new Date(s)));
+      return holdSlot(new Date(s), g);
+    }));
+    const failed = results.findIndex((r) => r.status === 'rejected');
+    if (failed >= 0) {
+      const applied = holds.filter((h, i) => results[i].status === 'fulfilled');
+      if (applied.length) {
+        await ReservationSlot.bulkWrite(applied.map(([s, g]) => ({
+          updateOne: { filter: { start: new Date(s) }, update: { $inc: { guests: -g } } },
+        })), { ordered: false });
+      }
+      const err = results[failed].reason;
+      throw err && err.code === 11000 ? new SlotFullError(new Date(holds[failed][0])) : err;
+    }
+
+    if (releases.length) {
+      await ReservationSlot.bulkWrite(releases.map(([s, g]) => ({
+        updateOne: { filter: { start: new Date(s) }, update: { $inc: { guests: g } } },
+      })), { ordered: false });
+    }
+  }
+
+  /**
+   * The next `limit` seating times from `from` with room for the party, within opening hours.
+   * Reads only the slot documents of the search window (one indexed range query).
+   * @returns {Promise<Array<{start: Date, seatsLeft: number}>>}
+   */
+  static async nextFree(party, from = new Date(), limit = 5) {
+    const size = Math.max(Number(party) || 1, 1);
+    if (size > CAPACITY) return [];
+    const start = new Date(from);
+    const end = new Date(start.getFullYear(), start.getMonth(), start.getDate() + SEARCH_DAYS);
+    const slots = await ReservationSlot.find(
+      { start: { $gte: new Date(Math.floor(start.getTime() / SLOT_MS) * SLOT_MS), $lt: new Date(end.getTime() + DINING_MS) }, guests: { $gt: 0 } },
+      { start: 1, guests: 1 }
+    ).lean();
+    const booked = new Map(slots.map((s) => [s.start.getTime(), s.guests]));
+
+    const open = minutesOf(OPENING);
+    const lastSeating = minutesOf(CLOSING) - DINING_MINUTES;
+    const free = [];
+    for (let day = 0; day < SEARCH_DAYS && free.length < limit; day += 1) {
+      for (let m = open; m <= lastSeating && free.length < limit; m += SLOT_MINUTES) {
+        const t = new Date(start.getFullYear(), start.getMonth(), start.getDate() + day, 0, m);
+        if (t < start) continue;
+        const busiest = Math.max(...ReservationSlotService.slotsFor(t).map((s) => booked.get(s) || 0));
+        if (CAPACITY - busiest >= size) free.push({ start: t, seatsLeft: CAPACITY - busiest });
+      }
+    }
+    return free;
+  }
+
+  /**
+   * Seat waitlisted reservations, oldest first, that overlap slots a released booking freed.
+   * @returns {Promise<number>} reservations moved to pending
+   */
+  static async promoteWaitlist(released) {
+    const slots = ReservationSlotService.slotsFor(released.date);
+    const waiting = await Reservation.find({
+      status: 'waitlisted',
+      date: { $gt: new Date(slots[0] - DINING_MS), $lt: new Date(slots[slots.length - 1] + SLOT_MS) },
+    }).sort({ createdAt: 1 }).lean();
+    let promoted = 0;
+    for (const r of waiting) {
+      const delta = ReservationSlotService.diff(r, { ...r, status: 'pending' });
+      try {
+        await ReservationSlotService.applyDelta(delta);
+      } catch (e) {
+        if (ReservationSlotService.isSlotFull(e)) continue;
+        throw e;
+      }
+      const updated = await Reservation.updateOne({ _id: r._id, status: 'waitlisted' }, { $set: { status: 'pending' } });
+      if (updated.modifiedCount) promoted += 1;
+      else await ReservationSlotService.applyDelta(ReservationSlotService.negate(delta));
+    }
+    return promoted;
+  }
+
+  static promoteInBackground(released) {
+    ReservationSlotService.promoteWaitlist(released)
+      .catch((e) => console.error('Failed to promote waitlisted reservations', e.message));
+  }
+
+  /**
+   * Recompute slot totals from the reservations taking seats from `since` on, and fix the
+   * documents that drifted.
+   * @returns {Promise<{reservations: number, slots: number, corrected: number}>}
+   */
+  static async rebuild(since = new Date()) {
+    const first = Math.floor(new Date(since).getTime() / SLOT_MS) * SLOT_MS;
+    // Bookings made up to a dining time earlier still sit in the first slots
+    const reservations = await Reservation.find(
+      { status: { $in: HOLDING_STATUSES }, date: { $gt: new Date(first - DINING_MS) } },
+      { date: 1, numberOfGuests: 1, status: 1 }
+    ).lean();
+    const expected = new Map();
+    for (const r of reservations) {
+      for (const [s, g] of ReservationSlotService.contribution(r)) {
+        if (s >= first) expected.set(s, (expected.get(s) || 0) + g);
+      }
+    }
+    const stored = await ReservationSlot.find({ start: { $gte: new Date(first) } }, { start: 1, guests: 1 }).lean();
+    const ops = [];
+    for (const slot of stored) {
+      const s = slot.start.getTime();
+      const want = expected.get(s) || 0;
+      if (slot.guests !== want) ops.push({ updateOne: { filter: { _id: slot._id }, update: { $set: { guests: want } } } });
+      expected.delete(s);
+    }
+    for (const [s, g] of expected) {
+      ops.push({ updateOne: { filter: { start: new Date(s) }, update: { $set: { guests: g } }, upsert: true } });
+    }
+    if (ops.length) await ReservationSlot.bulkWrite(ops, { ordered: false });
+    return { reservations: reservations.length, slots: stored.length + expected.size, corrected: ops.length };
+  }
+}
+
+module.exports = ReservationSlotService;
@@ -7,15 +7,61 @@ export default function AI() {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
 
+  // Read the server-sent events from /ask-stream and hand each chunk to onChunk as it arrives
+  const askStreaming = async (onChunk) => {
+    const res = await fetch('/api/assistant/ask-stream', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ text }),
+    });
+    if (!res.ok || !res.body) throw new Error('Stream unavailable');
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      let sep;
+      while ((sep = buffer.indexOf('\n\n')) >= 0) {
+        const frame = buffer.slice(0, sep);
+        buffer = buffer.slice(sep + 2);
+        const event = (frame.match(/^event: (.*)$/m) || [])[1] || 'message';
+        const data = (frame.match(/^data: (.*)$/m) || [])[1];
+        if (event === 'error') throw new Error('Assistant failed');
+        if (event === 'message' && data) {
+          const { chunk } = JSON.parse(data);
+          onChunk(chunk);
+        }
+      }
+    }
+  };
+
   const handleAsk = async () => {
     if (!text.trim()) return;
     setLoading(true);
     setError('');
+    setReply('');
+    let received = false;
     try {
-      const res = await axios.post('/api/assistant/ask', { text });
-      setReply(res.data.reply);
-    } catch (err) {
-      setError('Failed to get reply');
+      await askStreaming((chunk) => {
+        received = true;
+        setReply((prev) => prev + chunk);
+      });
+    } catch (streamErr) {
+      // Once part of the answer is on screen, asking again would run a second synthesis
+      // and silently replace it; only a stream that never started falls back to /ask
+      if (received) {
+        setError('The answer was interrupted. Please ask again.');
+      } else {
+        try {
+          const res = await axios.post('/api/assistant/ask', { text });
+          setReply(res.data.reply);
+        } catch (err) {
+          setError('Failed to get reply');
+        }
+      }
     }
     setLoading(false);
   };
@@ -37,7 +83,7 @@ export default function AI() {
       {reply && (
         <div style={{ marginTop: 20 }}>
           <h4>Assistant's Reply:</h4>
-          <p>{reply}</p>
+          <p style={{ whiteSpace: 'pre-wrap' }}>{reply}</p>
         </div>
       )}
 
@@ -26,6 +26,7 @@ export default function Reservations() {
       case 'confirmed': return 'success';
       case 'cancelled': return 'danger';
       case 'completed': return 'info';
+      case 'waitlisted': return 'secondary';
       default: return 'secondary';
     }
   };
@@ -36,6 +37,7 @@ export default function Reservations() {
       case 'confirmed': return 'Confirmed';
       case 'cancelled': return 'Cancelled';
       case 'completed': return 'Completed';
+      case 'waitlisted': return 'Waitlisted';
       default: return status;
     }
   };
@@ -279,15 +281,16 @@ export default function Reservations() {
                   <option value="confirmed">Confirmed</option>
                   <option value="cancelled">Cancelled</option>
                   <option value="completed">Completed</option>
+                  <option value="waitlisted">Waitlisted</option>
                 </Form.Select>
               </Form.Group>
             </Col>
             <Col md={2}>
               <Form.Group>
-                <Form.Label>Email</Form.Label>
+                <Form.Label>Email starts with</Form.Label>
                 <Form.Control
                   type="text"
-                  placeholder="Search by email"
+                  placeholder="Email starts with..."
                   value={emailFilter}
                   onChange={(e) => setEmailFilter(e.target.value)}
                 />
@@ -411,6 +414,7 @@ export default function Reservations() {
                   <option value="confirmed">Confirmed</option>
                   <option value="cancelled">Cancelled</option>
                   <option value="completed">Completed</option>
+                  <option value="waitlisted">Waitlisted</option>
                 </Form.Select>
               </Form.Group>
             </div>